@@ -2,15 +2,18 @@ import os
 import shutil
 import uuid
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
 from datetime import datetime
 
 from app.database.connection import get_invoices_collection, get_batch_jobs_collection
 from app.database.models import generate_id, invoice_helper, batch_job_helper
 from app.auth.dependencies import get_current_user
 import asyncio
-from app.worker.tasks import celery, _process_invoice_async, DISABLE_CELERY
+from app.worker.tasks import (
+    celery, _process_invoice_async, _complete_cached_invoice_async, lookup_cached_extraction, DISABLE_CELERY
+)
 from app.api.schemas import BatchJobResponse
+from app.core.result_cache import ExtractionCache
 
 router = APIRouter(prefix="/batch", tags=["Batch Processing"])
 
@@ -21,6 +24,7 @@ LOCAL_TASK_TIMEOUT_SECONDS = int(os.getenv("LOCAL_TASK_TIMEOUT_SECONDS", "180"))
 @router.post("/upload", response_model=BatchJobResponse)
 async def batch_upload(
     files: List[UploadFile] = File(...),
+    bypass_cache: bool = Query(False, description="Always run a fresh extraction"),
     current_user: dict = Depends(get_current_user),
 ):
     """
@@ -75,6 +79,8 @@ async def batch_upload(
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
         
+        content_hash = await asyncio.to_thread(ExtractionCache.hash_file, file_path)
+        
         # Create invoice record
         invoice_id = generate_id()
         invoice_doc = {
@@ -84,6 +90,8 @@ async def batch_upload(
             "file_type": ext,
             "file_size": os.path.getsize(file_path),
             "file_path": file_path,
+            "content_hash": content_hash,
+            "batch_id": batch_id,
             "status": "pending",
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow(),
@@ -92,15 +100,23 @@ async def batch_upload(
         await invoices_col.insert_one(invoice_doc)
         invoice_ids.append(invoice_id)
         
+        # Re-uploaded file: reuse the earlier extraction instead of calling the LLM
+        cached = None if bypass_cache else await lookup_cached_extraction(content_hash)
+        
+        # The task id is stored before the work starts, so every webhook of the invoice carries it
+        task_id = str(uuid.uuid4())
+        await invoices_col.update_one({"_id": invoice_id}, {"$set": {"task_id": task_id}})
+        
         if DISABLE_CELERY:
             # Local mode: process synchronously to avoid background-task flakiness on Windows.
-            task_id = str(uuid.uuid4())
-            await invoices_col.update_one({"_id": invoice_id}, {"$set": {"task_id": task_id}})
-            try:
-                await asyncio.wait_for(
-                    _process_invoice_async(file_path, file.content_type, invoice_id, current_user["id"]),
-                    timeout=LOCAL_TASK_TIMEOUT_SECONDS,
+            if cached is not None:
+                processing = _complete_cached_invoice_async(
+                    invoice_id, cached["result"], cached.get("invoice_id"), file.content_type, current_user["id"], batch_id
                 )
+            else:
+                processing = _process_invoice_async(file_path, file.content_type, invoice_id, current_user["id"], batch_id)
+            try:
+                await asyncio.wait_for(processing, timeout=LOCAL_TASK_TIMEOUT_SECONDS)
                 local_results["completed"] += 1
             except asyncio.TimeoutError:
                 local_results["failed"] += 1
@@ -114,17 +130,18 @@ async def batch_upload(
                     {"_id": invoice_id},
                     {"$set": {"status": "failed", "error_message": str(exc), "updated_at": datetime.utcnow()}},
                 )
+        elif cached is not None:
+            celery.send_task(
+                "tasks.complete_cached_invoice_task",
+                args=[invoice_id, cached["result"], cached.get("invoice_id"), file.content_type, current_user["id"], batch_id],
+                task_id=task_id
+            )
         else:
             # Trigger async task
-            task = celery.send_task(
+            celery.send_task(
                 "tasks.process_invoice_task",
-                args=[file_path, file.content_type, invoice_id, current_user["id"]]
-            )
-
-            # Update invoice with task_id
-            await invoices_col.update_one(
-                {"_id": invoice_id},
-                {"$set": {"task_id": task.id}}
+                args=[file_path, file.content_type, invoice_id, current_user["id"], batch_id],
+                task_id=task_id
             )
     
     # Update batch job with invoice IDs
@@ -13,8 +13,21 @@ from app.api.schemas import (
     InvoiceUpdate
 )
 from app.core.export_service import ExportService
+from app.core.tools.exchange_rate import ExchangeRateTool
 
 router = APIRouter(prefix="/invoices", tags=["Invoices"])
+exchange_tool = ExchangeRateTool()
+
+
+async def amounts_in_try(rows):
+    """TRY value of (amount, currency, invoice date) rows at their invoice dates' rates; None if unknown."""
+    conversions = await exchange_tool.convert_many_to_try(
+        [(amount, currency or "TRY", invoice_date) for amount, currency, invoice_date in rows]
+    )
+    return [
+        conversion["amount_try"] if conversion.get("currency", "TRY") == "TRY" else None
+        for conversion in conversions
+    ]
 
 
 @router.get("", response_model=InvoiceListResponse)
@@ -100,11 +113,28 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
             "total_amount": {"$sum": {"$ifNull": ["$total_amount", 0]}},
             "total_tax": {"$sum": {"$ifNull": ["$tax_amount", 0]}},
             "avg_processing": {"$avg": {"$ifNull": ["$processing_time_ms", 0]}},
+            "llm_tokens": {"$sum": {"$ifNull": ["$llm_usage.total_tokens", 0]}},
         }}
     ]
     
     result = await invoices.aggregate(pipeline).to_list(1)
     stats = result[0] if result else {}
+
+    # Total in TRY: one conversion per currency and invoice date
+    amounts_pipeline = [
+        {"$match": {"user_id": user_id, "total_amount": {"$ne": None}}},
+        {"$group": {
+            "_id": {"currency": "$currency", "date": "$invoice_date"},
+            "total": {"$sum": "$total_amount"},
+            "count": {"$sum": 1}
+        }}
+    ]
+    amount_groups = await invoices.aggregate(amounts_pipeline).to_list(None)
+    amounts_try = await amounts_in_try(
+        [(group["total"], group["_id"].get("currency"), group["_id"].get("date")) for group in amount_groups]
+    )
+    # Groups without a rate are left out of the TRY total and reported instead
+    unconverted = [group for group, amount in zip(amount_groups, amounts_try) if amount is None]
     
     # Time-based stats
     now = datetime.utcnow()
@@ -173,8 +203,12 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
         failed_invoices=stats.get("failed", 0),
         pending_invoices=stats.get("pending", 0),
         total_amount=stats.get("total_amount", 0),
+        total_amount_try=round(sum(amount for amount in amounts_try if amount), 2),
+        unconverted_invoices=sum(group["count"] for group in unconverted),
+        unconverted_currencies=sorted({str(group["_id"].get("currency")) for group in unconverted}),
         total_tax=stats.get("total_tax", 0),
         avg_processing_time_ms=stats.get("avg_processing", 0),
+        llm_tokens_used=stats.get("llm_tokens", 0),
         invoices_today=invoices_today,
         invoices_this_week=invoices_this_week,
         top_suppliers=[
@@ -282,6 +316,12 @@ async def export_invoices(
     
     if not invoices:
         raise HTTPException(status_code=404, detail="No invoices found for export")
+
+    amounts_try = await amounts_in_try(
+        [(inv.get("total_amount"), inv.get("currency"), inv.get("invoice_date")) for inv in invoices]
+    )
+    for inv, amount_try in zip(invoices, amounts_try):
+        inv["amount_try"] = amount_try
     
     # Convert to objects for export service
     class InvoiceObj:
@@ -4,7 +4,7 @@ import shutil
 import uuid
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request, Response
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request, Response, Query
 
 load_dotenv()
 from fastapi.middleware.cors import CORSMiddleware
@@ -16,7 +16,10 @@ from typing import Optional, Dict, Any
 
 from app.database.connection import connect_to_mongo, close_mongo_connection, get_invoices_collection
 from app.database.models import generate_id
-from app.worker.tasks import celery, _process_invoice_async, DISABLE_CELERY
+from app.worker.tasks import (
+    celery, engine, reviewer_agent, _process_invoice_async, _complete_cached_invoice_async, lookup_cached_extraction,
+    run_review_sweeper, DISABLE_CELERY
+)
 from app.auth.router import router as auth_router
 from app.auth.dependencies import get_current_user, get_current_user_optional
 from app.api.invoices import router as invoices_router
@@ -24,6 +27,8 @@ from app.api.webhooks import router as webhooks_router
 from app.api.batch import router as batch_router
 from app.core.rate_limiter import limiter, rate_limit_exceeded_handler
 from app.core.metrics import MetricsMiddleware, get_metrics, metrics_content_type
+from app.core.result_cache import ExtractionCache
+from app.core.http_clients import close_http_clients
 from datetime import datetime
 
 
@@ -31,8 +36,14 @@ from datetime import datetime
 async def lifespan(app: FastAPI):
     """Application lifespan handler for MongoDB."""
     await connect_to_mongo()
+    # Without Celery there is no beat to flush review groups left behind by a restart or a failed flush
+    sweeper = asyncio.create_task(run_review_sweeper()) if DISABLE_CELERY and reviewer_agent.batcher.enabled else None
     yield
+    if sweeper is not None:
+        sweeper.cancel()
+    await close_http_clients()
     await close_mongo_connection()
+    engine.render_pool.shutdown()
 
 
 app = FastAPI(
@@ -126,6 +137,7 @@ async def prometheus_metrics():
 async def upload_invoice(
     request: Request,
     file: UploadFile = File(...),
+    bypass_cache: bool = Query(False, description="Always run a fresh extraction"),
     current_user: dict = Depends(get_current_user)
 ):
     """Upload a single invoice for processing with MongoDB tracking."""
@@ -141,6 +153,8 @@ async def upload_invoice(
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
     
+    content_hash = await asyncio.to_thread(ExtractionCache.hash_file, file_path)
+    
     # Create invoice record in MongoDB
     invoice_id = generate_id()
     invoice_doc = {
@@ -150,6 +164,7 @@ async def upload_invoice(
         "file_type": file_ext,
         "file_size": os.path.getsize(file_path),
         "file_path": file_path,
+        "content_hash": content_hash,
         "status": "pending",
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
@@ -158,18 +173,27 @@ async def upload_invoice(
     invoices = get_invoices_collection()
     await invoices.insert_one(invoice_doc)
     
+    # Re-uploaded file: reuse the earlier extraction instead of calling the LLM
+    cached = None if bypass_cache else await lookup_cached_extraction(content_hash)
+    
+    # The task id is stored before the work starts, so every webhook of the invoice carries it
+    task_id = str(uuid.uuid4())
+    await invoices.update_one({"_id": invoice_id}, {"$set": {"task_id": task_id}})
+    
     if DISABLE_CELERY:
-        task_id = str(uuid.uuid4())
-        await invoices.update_one({"_id": invoice_id}, {"$set": {"task_id": task_id}})
         LOCAL_TASKS[task_id] = {"status": "PENDING", "result": None}
 
+        if cached is not None:
+            processing = _complete_cached_invoice_async(
+                invoice_id, cached["result"], cached.get("invoice_id"), file.content_type, current_user["id"]
+            )
+        else:
+            processing = _process_invoice_async(file_path, file.content_type, invoice_id, current_user["id"])
+
         async def run_local_task():
             try:
                 LOCAL_TASKS[task_id]["status"] = "STARTED"
-                result = await asyncio.wait_for(
-                    _process_invoice_async(file_path, file.content_type, invoice_id, current_user["id"]),
-                    timeout=LOCAL_TASK_TIMEOUT_SECONDS,
-                )
+                result = await asyncio.wait_for(processing, timeout=LOCAL_TASK_TIMEOUT_SECONDS)
                 LOCAL_TASKS[task_id] = {"status": "SUCCESS", "result": result}
             except asyncio.TimeoutError:
                 LOCAL_TASKS[task_id] = {"status": "FAILED", "result": {"error": "processing_timeout"}}
@@ -180,14 +204,20 @@ async def upload_invoice(
         return {"task_id": task_id, "invoice_id": invoice_id}
 
     # Trigger task
-    task = celery.send_task(
-        "tasks.process_invoice_task", 
-        args=[file_path, file.content_type, invoice_id, current_user["id"]]
-    )
-    
-    await invoices.update_one({"_id": invoice_id}, {"$set": {"task_id": task.id}})
+    if cached is not None:
+        celery.send_task(
+            "tasks.complete_cached_invoice_task",
+            args=[invoice_id, cached["result"], cached.get("invoice_id"), file.content_type, current_user["id"]],
+            task_id=task_id
+        )
+    else:
+        celery.send_task(
+            "tasks.process_invoice_task", 
+            args=[file_path, file.content_type, invoice_id, current_user["id"]],
+            task_id=task_id
+        )
     
-    return {"task_id": task.id, "invoice_id": invoice_id}
+    return {"task_id": task_id, "invoice_id": invoice_id}
 
 
 @app.get("/files/{invoice_id}")
@@ -237,11 +267,25 @@ async def get_status(
             response["result"] = task.get("result") or {"error": "Processing failed"}
         elif task["status"] == "SUCCESS":
             response["result"] = task.get("result")
+        else:
+            invoice = await get_invoices_collection().find_one({"task_id": task_id}, {"partial_result": 1})
+            if invoice and invoice.get("partial_result"):
+                response["partial_result"] = invoice["partial_result"]
         return response
 
     task_result = celery.AsyncResult(task_id)
     response = {"task_id": task_id, "status": task_result.status}
     
+    if not task_result.ready():
+        invoice = await get_invoices_collection().find_one(
+            {"task_id": task_id}, {"cached_from": 1, "raw_result": 1, "partial_result": 1}
+        )
+        # Cache hits never reach Celery; their result lives on the invoice
+        if invoice and invoice.get("cached_from"):
+            return {"task_id": task_id, "status": "SUCCESS", "result": invoice.get("raw_result")}
+        if invoice and invoice.get("partial_result"):
+            response["partial_result"] = invoice["partial_result"]
+    
     if task_result.ready():
         if task_result.failed():
             response["status"] = "FAILED"
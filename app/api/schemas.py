@@ -28,6 +28,7 @@ class InvoiceResponse(BaseModel):
     status: str
     error_message: Optional[str] = None
     processing_time_ms: Optional[int] = None
+    stage_timings_ms: Optional[Dict[str, int]] = None
     
     # Extracted fields
     invoice_number: Optional[str] = None
@@ -49,6 +50,11 @@ class InvoiceResponse(BaseModel):
     # Agentic data
     ai_review: Optional[Dict[str, Any]] = None
     conversion: Optional[Dict[str, Any]] = None
+    enrichment_status: Optional[str] = None
+    llm_usage: Optional[Dict[str, Any]] = None
+    
+    # Fields streamed in so far while the extraction is still running
+    partial_result: Optional[Dict[str, Any]] = None
     
     created_at: datetime
     updated_at: Optional[datetime] = None
@@ -164,8 +170,12 @@ class DashboardStats(BaseModel):
     failed_invoices: int
     pending_invoices: int
     total_amount: float
+    total_amount_try: float = 0  # every currency converted at its invoice date's rate
+    unconverted_invoices: int = 0  # invoices left out of total_amount_try for lack of a rate
+    unconverted_currencies: List[str] = []
     total_tax: float
     avg_processing_time_ms: float
+    llm_tokens_used: int = 0
     invoices_today: int
     invoices_this_week: int
     top_suppliers: List[Dict[str, Any]]
@@ -1,11 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from datetime import datetime
-import httpx
 
 from app.database.connection import get_webhooks_collection
 from app.database.models import generate_id, webhook_helper
 from app.auth.dependencies import get_current_user
+from app.core.http_clients import get_http_client
 from app.api.schemas import WebhookCreate, WebhookUpdate, WebhookResponse
 
 router = APIRouter(prefix="/webhooks", tags=["Webhooks"])
@@ -154,18 +154,17 @@ async def test_webhook(
     }
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                webhook["url"],
-                json=test_payload,
-                timeout=10.0
-            )
-            
-            return {
-                "success": response.status_code < 300,
-                "status_code": response.status_code,
-                "response_body": response.text[:500] if response.text else None
-            }
+        response = await get_http_client("webhook", webhook["url"]).post(
+            webhook["url"],
+            json=test_payload,
+            timeout=10.0
+        )
+        
+        return {
+            "success": response.status_code < 300,
+            "status_code": response.status_code,
+            "response_body": response.text[:500] if response.text else None
+        }
     except Exception as e:
         return {
             "success": False,
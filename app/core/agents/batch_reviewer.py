@@ -0,0 +1,212 @@
+import os
+import json
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from app.core.extraction_engine import LLMProvider, clean_json_response
+from app.core.llm_usage import llm_stage, start_usage_tracking
+from app.core.metrics import INVOICE_REVIEWS
+from app.database.connection import get_invoices_collection, get_review_queue_collection
+
+logger = logging.getLogger(__name__)
+
+REVIEW_PROPERTIES = {
+    "summary": {"type": "string"},
+    "risk_level": {"type": "string", "enum": ["Low", "Medium", "High"]},
+    "risk_reason": {"type": "string"},
+    "suggested_action": {"type": "string"},
+}
+
+REVIEW_BATCH_JSON_SCHEMA = {
+    "title": "invoice_review_batch",
+    "type": "object",
+    "properties": {
+        "reviews": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"invoice_id": {"type": "string"}, **REVIEW_PROPERTIES},
+                "required": ["invoice_id", *REVIEW_PROPERTIES],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["reviews"],
+    "additionalProperties": False,
+}
+
+# Token usage fields of llm_usage that a batched request is split over
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens")
+
+
+class BatchReviewer:
+    """
+    Reviews escalated invoices REVIEW_BATCH_SIZE at a time in one LLM request.
+    Summaries wait in the review_queue collection, so all worker processes
+    share it. A group (an upload batch, or a user's single uploads) is flushed
+    once it is full or REVIEW_BATCH_MAX_WAIT_SECONDS after its first entry;
+    groups whose flush was lost or died are picked up by a periodic sweep.
+    """
+
+    def __init__(self, llm_provider: LLMProvider):
+        self.llm_provider = llm_provider
+        self.batch_size = int(os.getenv("REVIEW_BATCH_SIZE", "1"))
+        self.max_wait_seconds = float(os.getenv("REVIEW_BATCH_MAX_WAIT_SECONDS", "10"))
+        # Entries claimed by a flush that never finished (e.g. a killed worker) are claimed again after this
+        self.claim_timeout = timedelta(seconds=int(os.getenv("REVIEW_BATCH_CLAIM_TIMEOUT_SECONDS", "300")))
+        # How often overdue groups are looked for and flushed
+        self.sweep_seconds = float(os.getenv("REVIEW_BATCH_SWEEP_SECONDS", "60"))
+
+    @property
+    def enabled(self) -> bool:
+        return self.batch_size > 1
+
+    @staticmethod
+    def group_key(user_id: str, batch_id: Optional[str] = None) -> str:
+        return f"batch:{batch_id}" if batch_id else f"user:{user_id}"
+
+    async def enqueue(self, invoice_id: str, group: str, summary: Dict[str, Any], pending_review: Dict[str, Any]) -> int:
+        """Queue an invoice for the next batch of its group; returns the group's unclaimed entries."""
+        queue = get_review_queue_collection()
+        await queue.update_one(
+            {"_id": invoice_id},
+            {"$set": {
+                "group": group,
+                "summary": summary,
+                "pending_review": pending_review,
+                "claimed_by": None,
+                "enqueued_at": datetime.utcnow(),
+            }},
+            upsert=True
+        )
+        return await queue.count_documents({"group": group, "claimed_by": None})
+
+    async def _claim(self, group: str) -> List[Dict[str, Any]]:
+        """Atomically take up to batch_size entries of the group for this flush."""
+        queue = get_review_queue_collection()
+        claim_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        claimable = {"group": group, "$or": [
+            {"claimed_by": None},
+            {"claimed_at": {"$lt": now - self.claim_timeout}},
+        ]}
+        cursor = queue.find(claimable, {"_id": 1}).sort("enqueued_at", 1).limit(self.batch_size)
+        ids = [doc["_id"] async for doc in cursor]
+        if not ids:
+            return []
+        # Another flush may have claimed some of them in between; keep only ours
+        await queue.update_many(
+            {**claimable, "_id": {"$in": ids}},
+            {"$set": {"claimed_by": claim_id, "claimed_at": now}}
+        )
+        return [doc async for doc in queue.find({"claimed_by": claim_id})]
+
+    async def overdue_groups(self) -> List[str]:
+        """
+        Groups with entries whose flush should have run already: unclaimed past
+        max_wait_seconds (the scheduled flush was lost) or claimed past the claim
+        timeout (the flush died).
+        """
+        now = datetime.utcnow()
+        return await get_review_queue_collection().distinct("group", {"$or": [
+            {"claimed_by": None, "enqueued_at": {"$lt": now - timedelta(seconds=self.max_wait_seconds)}},
+            {"claimed_by": {"$ne": None}, "claimed_at": {"$lt": now - self.claim_timeout}},
+        ]})
+
+    async def _review(self, entries: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """One LLM request for all entries; returns reviews by invoice id (missing ones are left out)."""
+        invoices = [{"invoice_id": entry["_id"], **entry["summary"]} for entry in entries]
+        prompt = f"""
+        As an expert financial auditor, review each of the following extracted invoices and provide for each:
+        1. A brief business summary (1 sentence).
+        2. A risk assessment (Low, Medium, High) with a reason.
+        3. A suggested action (e.g., 'Approve', 'Check Supplier', 'Verify Tax').
+
+        Invoices: {json.dumps(invoices, ensure_ascii=False, default=str)}
+
+        Return one review per invoice, with its invoice_id, in JSON format like this:
+        {{
+            "reviews": [
+                {{"invoice_id": "...", "summary": "...", "risk_level": "...", "risk_reason": "...", "suggested_action": "..."}}
+            ]
+        }}
+        """
+        try:
+            with llm_stage("review"):
+                response_str = await self.llm_provider.generate_json(prompt, response_schema=REVIEW_BATCH_JSON_SCHEMA)
+            reviews = json.loads(clean_json_response(response_str)).get("reviews", [])
+        except Exception as e:
+            logger.warning(f"Batched review of {len(entries)} invoices failed: {e}")
+            return {}
+        return {
+            str(review.pop("invoice_id")): review
+            for review in reviews
+            if isinstance(review, dict) and review.get("invoice_id")
+        }
+
+    async def flush(self, group: str) -> List[Dict[str, Any]]:
+        """
+        Review everything queued for the group, batch_size invoices per request, and
+        write the reviews to the invoices with bulk_write. Returns the reviewed
+        entries, each with its review and its share of the tokens as "llm_usage".
+        """
+        queue = get_review_queue_collection()
+        reviewed = []
+        while True:
+            entries = await self._claim(group)
+            if not entries:
+                return reviewed
+
+            usage = start_usage_tracking()
+            reviews = await self._review(entries)
+            totals = usage.to_dict()
+            share = {key: totals[key] // len(entries) for key in USAGE_FIELDS}
+            cost_share = totals.get("estimated_cost_usd", 0) / len(entries)
+
+            operations = []
+            for entry in entries:
+                review = reviews.get(entry["_id"])
+                source = "llm_batch" if review else "fallback"
+                if review is None:
+                    review = {
+                        **entry["pending_review"],
+                        "summary": f"Invoice from {entry['summary'].get('supplier')} for "
+                                   f"{entry['summary'].get('total')} {entry['summary'].get('currency')}.",
+                        "risk_level": "High",
+                        "suggested_action": "Manual Review",
+                    }
+                pending = entry["pending_review"]
+                entry["review"] = {
+                    **review,
+                    "risk_score": pending.get("risk_score"),
+                    "risk_signals": pending.get("risk_signals"),
+                    "review_source": source,
+                }
+                entry["llm_usage"] = {**share, "stages": {"review": share}}
+                if cost_share:
+                    entry["llm_usage"]["estimated_cost_usd"] = cost_share
+                INVOICE_REVIEWS.labels(source=source).inc()
+
+                inc = {f"llm_usage.{key}": share[key] for key in USAGE_FIELDS}
+                inc.update({f"llm_usage.stages.review.{key}": share[key] for key in USAGE_FIELDS})
+                if cost_share:
+                    inc["llm_usage.estimated_cost_usd"] = cost_share
+                operations.append(UpdateOne(
+                    {"_id": entry["_id"]},
+                    {
+                        "$set": {
+                            "ai_review": entry["review"],
+                            "raw_result.ai_review": entry["review"],
+                            "updated_at": datetime.utcnow(),
+                        },
+                        "$inc": inc,
+                    }
+                ))
+
+            await get_invoices_collection().bulk_write(operations, ordered=False)
+            await queue.delete_many({"_id": {"$in": [entry["_id"] for entry in entries]}})
+            reviewed.extend(entries)
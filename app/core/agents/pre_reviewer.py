@@ -0,0 +1,177 @@
+import os
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.database.connection import get_invoices_collection
+
+logger = logging.getLogger(__name__)
+
+# Score added by each signal; the LLM reviewer is only asked above the escalation threshold
+SIGNAL_WEIGHTS = {
+    "failed_pages": 1.0,
+    "arithmetic_mismatch": 0.5,
+    "tax_mismatch": 0.5,
+    "missing_fields": 0.5,
+    "amount_outlier": 0.3,
+    "currency_mismatch": 0.3,
+    "new_supplier": 0.2,
+}
+
+
+@dataclass
+class SupplierStats:
+    invoices: int = 0
+    # Amount statistics over the invoices in the currency being assessed only
+    currency_invoices: int = 0
+    avg_amount: Optional[float] = None
+    std_amount: Optional[float] = None
+    currencies: List[str] = field(default_factory=list)
+
+
+@dataclass
+class RiskAssessment:
+    score: float
+    signals: Dict[str, str]
+    escalate: bool
+
+    @property
+    def risk_level(self) -> str:
+        if self.score >= 0.5:
+            return "High"
+        if self.score >= 0.25:
+            return "Medium"
+        return "Low"
+
+
+class PreReviewer:
+    """
+    Deterministic risk scoring from the validation results and the supplier's
+    earlier invoices (amount outliers, unusual currency). Invoices that score
+    below the escalation threshold get a rule-based review instead of an LLM call.
+    """
+
+    def __init__(self):
+        self.threshold = float(os.getenv("REVIEW_ESCALATION_THRESHOLD", "0.5"))
+        self.min_history = int(os.getenv("REVIEW_MIN_SUPPLIER_INVOICES", "3"))
+        self.outlier_zscore = float(os.getenv("REVIEW_OUTLIER_ZSCORE", "3.0"))
+        # With (almost) identical earlier amounts the z-score is useless; compare to the mean instead
+        self.outlier_ratio = float(os.getenv("REVIEW_OUTLIER_RATIO", "0.5"))
+
+    async def supplier_stats(
+        self,
+        user_id: Optional[str],
+        supplier_name: Optional[str],
+        exclude_invoice_id: Optional[str] = None,
+        currency: Optional[str] = None
+    ) -> SupplierStats:
+        """
+        Count and currencies of the supplier's completed invoices, with the mean
+        and spread of the total amounts of those in the given currency.
+        """
+        if not user_id or not supplier_name:
+            return SupplierStats()
+        match: Dict[str, Any] = {"user_id": user_id, "supplier_name": supplier_name, "status": "completed"}
+        if exclude_invoice_id:
+            match["_id"] = {"$ne": exclude_invoice_id}
+        # $avg and $stdDevPop skip the nulls, so other currencies stay out of the amount statistics
+        same_currency = {"$eq": ["$currency", currency]}
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": None,
+                "invoices": {"$sum": 1},
+                "currency_invoices": {"$sum": {"$cond": [same_currency, 1, 0]}},
+                "avg_amount": {"$avg": {"$cond": [same_currency, "$total_amount", None]}},
+                "std_amount": {"$stdDevPop": {"$cond": [same_currency, "$total_amount", None]}},
+                "currencies": {"$addToSet": "$currency"},
+            }},
+        ]
+        try:
+            async for doc in get_invoices_collection().aggregate(pipeline):
+                return SupplierStats(
+                    invoices=doc["invoices"],
+                    currency_invoices=doc.get("currency_invoices", 0),
+                    avg_amount=doc.get("avg_amount"),
+                    std_amount=doc.get("std_amount"),
+                    currencies=[c for c in doc.get("currencies", []) if c],
+                )
+        except Exception as e:
+            logger.warning(f"Supplier history lookup failed: {e}")
+        return SupplierStats()
+
+    def _signals(self, data: Dict[str, Any], stats: SupplierStats) -> Dict[str, str]:
+        signals: Dict[str, str] = {}
+
+        mismatched = [check for check in data.get("arithmetic_validation") or [] if not check.get("is_valid", True)]
+        if mismatched:
+            signals["arithmetic_mismatch"] = f"{len(mismatched)} line item(s) where quantity x unit price != total"
+
+        tax = data.get("tax_validation") or {}
+        if tax and not tax.get("matches_tax_calculation", True):
+            signals["tax_mismatch"] = (
+                f"Items plus {tax.get('detected_tax_rate')}% tax give {tax.get('expected_total_with_tax')}, "
+                f"invoice total is {tax.get('actual_total_amount')}"
+            )
+
+        failed_pages = (data.get("_metadata") or {}).get("failed_pages")
+        if failed_pages:
+            signals["failed_pages"] = f"Page(s) {', '.join(map(str, failed_pages))} could not be extracted"
+
+        missing = [key for key in ("supplier_name", "total_amount", "currency") if not data.get(key)]
+        if missing:
+            signals["missing_fields"] = f"Missing {', '.join(missing)}"
+
+        amount, currency = data.get("total_amount"), data.get("currency")
+        if stats.invoices < self.min_history:
+            signals["new_supplier"] = f"Only {stats.invoices} earlier invoice(s) from this supplier"
+        else:
+            enough_history = stats.currency_invoices >= self.min_history
+            if isinstance(amount, (int, float)) and stats.avg_amount and enough_history:
+                deviation = abs(amount - stats.avg_amount)
+                spread = stats.std_amount or 0
+                if spread > 0.01 * stats.avg_amount:
+                    outlier = deviation / spread > self.outlier_zscore
+                else:
+                    outlier = deviation > self.outlier_ratio * stats.avg_amount
+                if outlier:
+                    signals["amount_outlier"] = (
+                        f"Total {amount} is far from this supplier's average of {round(stats.avg_amount, 2)} {currency}"
+                    )
+            if currency and stats.currencies and currency not in stats.currencies:
+                signals["currency_mismatch"] = (
+                    f"Currency {currency}, earlier invoices were in {', '.join(sorted(stats.currencies))}"
+                )
+        return signals
+
+    async def assess(
+        self,
+        data: Dict[str, Any],
+        user_id: Optional[str] = None,
+        invoice_id: Optional[str] = None
+    ) -> RiskAssessment:
+        stats = await self.supplier_stats(user_id, data.get("supplier_name"), invoice_id, data.get("currency"))
+        signals = self._signals(data, stats)
+        score = round(min(sum(SIGNAL_WEIGHTS[name] for name in signals), 1.0), 2)
+        return RiskAssessment(score=score, signals=signals, escalate=score >= self.threshold)
+
+    @staticmethod
+    def rule_review(data: Dict[str, Any], assessment: RiskAssessment) -> Dict[str, Any]:
+        """Review in the LLM reviewer's format, built from the risk signals alone."""
+        if "failed_pages" in assessment.signals:
+            action = "Manual Review"
+        elif "new_supplier" in assessment.signals:
+            action = "Check Supplier"
+        elif assessment.signals:
+            action = "Verify Amount"
+        else:
+            action = "Approve"
+        return {
+            "summary": (
+                f"Invoice from {data.get('supplier_name')} for {data.get('total_amount')} {data.get('currency')}"
+                f" with {len(data.get('items', []))} item(s)."
+            ),
+            "risk_level": assessment.risk_level,
+            "risk_reason": "; ".join(assessment.signals.values()) or "Arithmetic and tax checks passed for a known supplier",
+            "suggested_action": action,
+        }
@@ -1,25 +1,95 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from app.core.extraction_engine import LLMProvider
+from app.core.llm_usage import llm_stage
+from app.core.metrics import INVOICE_REVIEWS
+from app.core.agents.pre_reviewer import PreReviewer
+from app.core.agents.batch_reviewer import BatchReviewer
+
+REVIEW_JSON_SCHEMA = {
+    "title": "invoice_review",
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "risk_level": {"type": "string", "enum": ["Low", "Medium", "High"]},
+        "risk_reason": {"type": "string"},
+        "suggested_action": {"type": "string"},
+    },
+    "required": ["summary", "risk_level", "risk_reason", "suggested_action"],
+    "additionalProperties": False,
+}
 
 class ReviewerAgent:
     """Agent that reviews extracted invoice data for business insights and risks."""
     
-    def __init__(self, llm_provider: LLMProvider):
+    def __init__(self, llm_provider: LLMProvider, pre_reviewer: Optional[PreReviewer] = None):
         self.llm_provider = llm_provider
+        self.pre_reviewer = pre_reviewer or PreReviewer()
+        self.batcher = BatchReviewer(llm_provider)
 
-    async def review_invoice(self, extraction_result: Dict[str, Any]) -> Dict[str, Any]:
-        """Review the invoice data using LLM logic."""
-        
-        # Summary of data for the agent to review
-        summary = {
+    @staticmethod
+    def _summary(extraction_result: Dict[str, Any], signals: List[str], reasons: List[str]) -> Dict[str, Any]:
+        """Summary of data for the agent to review."""
+        return {
             "supplier": extraction_result.get("supplier_name"),
             "total": extraction_result.get("total_amount"),
             "currency": extraction_result.get("currency"),
             "category": extraction_result.get("category"),
             "items_count": len(extraction_result.get("items", [])),
-            "tax_ok": extraction_result.get("tax_validation", {}).get("is_valid", True)
+            "arithmetic_ok": "arithmetic_mismatch" not in signals,
+            "tax_ok": (extraction_result.get("tax_validation") or {}).get("matches_tax_calculation", True),
+            "risk_signals": reasons
         }
 
+    async def review_invoice(
+        self,
+        extraction_result: Dict[str, Any],
+        user_id: Optional[str] = None,
+        invoice_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Score the invoice with rules; only risky invoices are reviewed by the LLM.
+        With batching enabled, risky invoices get a "batch_pending" review that
+        queue_review() hands to the batch reviewer once the invoice is saved.
+        """
+        assessment = await self.pre_reviewer.assess(extraction_result, user_id, invoice_id)
+        risk = {"risk_score": assessment.score, "risk_signals": list(assessment.signals)}
+
+        if assessment.escalate and self.batcher.enabled:
+            return {
+                "summary": None,
+                "risk_level": assessment.risk_level,
+                "risk_reason": "; ".join(assessment.signals.values()),
+                "suggested_action": "Pending Review",
+                **risk,
+                "review_source": "batch_pending",
+            }
+
+        if not assessment.escalate:
+            review = PreReviewer.rule_review(extraction_result, assessment)
+            source = "rules"
+        else:
+            review, source = await self._llm_review(extraction_result, assessment.signals)
+
+        INVOICE_REVIEWS.labels(source=source).inc()
+        return {**review, **risk, "review_source": source}
+
+    async def queue_review(
+        self,
+        extraction_result: Dict[str, Any],
+        invoice_id: str,
+        user_id: str,
+        batch_id: Optional[str] = None
+    ) -> Tuple[str, int]:
+        """Queue a saved invoice with a batch_pending review; returns its group and the group's queue length."""
+        pending = extraction_result["ai_review"]
+        group = BatchReviewer.group_key(user_id, batch_id)
+        summary = self._summary(extraction_result, pending["risk_signals"], [pending["risk_reason"]])
+        return group, await self.batcher.enqueue(invoice_id, group, summary, pending)
+
+    async def _llm_review(self, extraction_result: Dict[str, Any], signals: Dict[str, str]):
+        """Review the invoice data using LLM logic. Returns (review, source)."""
+        summary = self._summary(extraction_result, list(signals), list(signals.values()))
+
         prompt = f"""
         As an expert financial auditor, review the following extracted invoice data and provide:
         1. A brief business summary (1 sentence).
@@ -39,7 +109,8 @@ class ReviewerAgent:
 
         try:
             # We use the LLM provider to 'think' about the data
-            response_str = await self.llm_provider.generate_json(prompt)
+            with llm_stage("review"):
+                response_str = await self.llm_provider.generate_json(prompt, response_schema=REVIEW_JSON_SCHEMA)
             
             # Basic cleanup of LLM response
             import json
@@ -48,12 +119,12 @@ class ReviewerAgent:
             elif "```" in response_str:
                 response_str = response_str.split("```")[1].split("```")[0].strip()
             
-            return json.loads(response_str)
+            return json.loads(response_str), "llm"
         except Exception:
-            # Fallback if AI review fails
+            # Fallback if AI review fails; the invoice was escalated, so it still needs a look
             return {
                 "summary": f"Invoice from {summary['supplier']} for {summary['total']} {summary['currency']}.",
-                "risk_level": "Low",
-                "risk_reason": "Automated basic check passed",
-                "suggested_action": "Proceed"
-            }
+                "risk_level": "High",
+                "risk_reason": "; ".join(signals.values()) or "Automated review unavailable",
+                "suggested_action": "Manual Review"
+            }, "fallback"
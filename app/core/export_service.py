@@ -38,6 +38,7 @@ class ExportService:
                 "Supplier": ExportService._get_val(inv, "supplier_name") or "",
                 "Amount": ExportService._get_val(inv, "total_amount") or 0,
                 "Currency": ExportService._get_val(inv, "currency") or "TRY",
+                "Amount (TRY)": ExportService._get_val(inv, "amount_try"),
                 "Tax Amount": ExportService._get_val(inv, "tax_amount") or 0,
                 "Tax Rate (%)": ExportService._get_val(inv, "tax_rate") or 0,
                 "Status": ExportService._get_val(inv, "status"),
@@ -103,7 +104,7 @@ class ExportService:
                     cell.border = thin_border
                     
                     # Format numbers
-                    if isinstance(value, (int, float)) and key in ["Amount", "Tax Amount"]:
+                    if isinstance(value, (int, float)) and key in ["Amount", "Amount (TRY)", "Tax Amount"]:
                         cell.number_format = '#,##0.00'
             
             # Auto-adjust column widths
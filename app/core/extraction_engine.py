@@ -1,94 +1,510 @@
 import os
-import httpx
 from google import genai
 from google.genai import types
+from google.genai import errors as genai_errors
 from PIL import Image
 import fitz  # PyMuPDF
-import base64
-import uuid
 import logging
-import mimetypes
 from io import BytesIO
+from pathlib import Path
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator
 import json
 import asyncio
-from app.core.prompts import SYSTEM_PROMPT, USER_PROMPT_TEMPLATE, MULTIPAGE_MERGE_PROMPT
+from app.core.prompts import (
+    USER_PROMPT_TEMPLATE, MULTIPAGE_MERGE_PROMPT, INVOICE_JSON_SCHEMA, INVOICE_ROWS_JSON_SCHEMA, ITEM_COLUMNS,
+    build_system_prompt
+)
+from app.core.text_quality import TextLayerClassifier
+from app.core.page_images import (
+    PageImage, ImageInput, ImageEncodingPolicy, RenderScalePolicy, PagePacker, load_page_image_async, pack_pages
+)
+from app.core import pdf_renderer
+from app.core.pdf_renderer import PdfRenderPool
+from app.core.http_clients import get_http_client
+from app.core.json_stream import JsonStreamConsumer, ProgressCallback
+from app.core.prompt_cache import GeminiPromptCache
+from app.core.gemini_files import GeminiFileStore
+from app.core.llm_usage import record_llm_usage
+from app.core.supplier_templates import SupplierTemplateStore, learn_sample_from_file
 
 logger = logging.getLogger(__name__)
 
+
+def clean_json_response(json_str: str) -> str:
+    """Strip markdown code fences and stray prefixes/suffixes around a JSON response."""
+    json_str = json_str.strip()
+    # Remove Markdown code block wrappers
+    if "```json" in json_str:
+        json_str = json_str.split("```json")[-1].split("```")[0]
+    elif "```" in json_str:
+        json_str = json_str.split("```")[-1].split("```")[0]
+    
+    # Final strip of whitespace or potential artifacts
+    json_str = json_str.strip()
+    
+    # If the string starts with anything other than { or [, it's likely malformed
+    if not (json_str.startswith("{") or json_str.startswith("[")):
+        start_idx = json_str.find("{")
+        if start_idx != -1:
+            json_str = json_str[start_idx:]
+        end_idx = json_str.rfind("}")
+        if end_idx != -1:
+            json_str = json_str[:end_idx+1]
+    return json_str
+
+
+def expand_item_rows(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn compact item_rows (values in ITEM_COLUMNS order) back into item dicts."""
+    rows = result.pop("item_rows", None)
+    if rows is None:
+        return result
+    items = result.setdefault("items", [])
+    for row in rows:
+        if isinstance(row, dict):
+            items.append(row)
+        elif isinstance(row, list):
+            values = row[:len(ITEM_COLUMNS)] + [None] * (len(ITEM_COLUMNS) - len(row))
+            items.append(dict(zip(ITEM_COLUMNS, values)))
+    return result
+
+
+def to_gemini_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a JSON Schema to the OpenAPI subset accepted by Gemini's response_schema."""
+    converted: Dict[str, Any] = {}
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        types_ = [t for t in schema_type if t != "null"]
+        if len(types_) == 1:
+            converted["type"] = types_[0]
+        else:
+            converted["anyOf"] = [{"type": t} for t in types_]
+        if "null" in schema_type:
+            converted["nullable"] = True
+    elif schema_type:
+        converted["type"] = schema_type
+    if "enum" in schema:
+        converted["enum"] = schema["enum"]
+    if "properties" in schema:
+        converted["properties"] = {name: to_gemini_schema(prop) for name, prop in schema["properties"].items()}
+        # Keep the declared key order instead of Gemini's alphabetical default
+        converted["propertyOrdering"] = list(schema["properties"])
+    if "items" in schema:
+        converted["items"] = to_gemini_schema(schema["items"])
+    for bound in ("minItems", "maxItems"):
+        if bound in schema:
+            converted[bound] = schema[bound]
+    if "required" in schema:
+        converted["required"] = schema["required"]
+    return converted
+
+
 class LLMProvider(ABC):
+    # Short provider name used in metrics and metadata; also selects the engine's local-model prompts
+    name = "llm"
+
     @abstractmethod
-    async def generate_json(self, content: str, image_paths: Optional[List[str]] = None) -> Dict[str, Any]:
-        """Generate JSON from content and optional images."""
+    async def generate_json(
+        self,
+        content: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate JSON from content and optional images (file paths or in-memory
+        PageImages). When streaming, on_progress receives fields as they complete.
+        response_schema is a JSON Schema the output is constrained to, where the
+        provider supports it.
+        """
         pass
 
+    async def generate_json_from_pages(
+        self,
+        content: str,
+        pages: AsyncIterator[PageImage],
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate JSON from pages streamed as they finish rendering. By default
+        all pages are collected and sent in page order; providers that can
+        start work on individual pages override this.
+        """
+        collected = [page async for page in pages]
+        collected.sort(key=lambda page: page.page_index)
+        return await self.generate_json(
+            content, image_paths=collected, on_progress=on_progress, response_schema=response_schema
+        )
+
 class GeminiProvider(LLMProvider):
+    name = "gemini"
+
     def __init__(self, api_key: str):
         model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash") # Stable default
         self.model_name = model_name
+        self.timeout = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "120"))
+        # Stream completions through JsonStreamConsumer (progress, loop abort, stream metrics)
+        self.streaming = os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+        # Constrain output to response_schema instead of relying on the prose schema alone
+        self.structured_output = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+        self.items_format = os.getenv("GEMINI_ITEMS_FORMAT", "objects")  # objects or rows
+        # Optional estimate used for llm_prefill_seconds_saved_total (Gemini reports no prefill timings)
+        self.prefill_ms_per_1k_tokens = float(os.getenv("GEMINI_PREFILL_MS_PER_1K_TOKENS", "0"))
+        # "native" sends the PDF itself instead of rendered pages plus extracted text
+        self.pdf_mode = os.getenv("GEMINI_PDF_MODE", "images")  # images or native
+        # Larger PDFs go through the Files API (inline requests are capped at 20 MB)
+        self.pdf_inline_max_bytes = int(float(os.getenv("GEMINI_PDF_INLINE_MAX_MB", "15")) * 1024 * 1024)
         self.client = genai.Client(api_key=api_key)
+        self.prompt_cache = GeminiPromptCache(self.client, self.model_name)
+        self.file_store = GeminiFileStore(self.client)
 
-    async def generate_json(self, content: str, image_paths: Optional[List[str]] = None) -> Dict[str, Any]:
-        prompt = f"{SYSTEM_PROMPT}\n\n{USER_PROMPT_TEMPLATE.format(content=content)}"
-        
-        parts = [types.Part.from_text(text=prompt)]
-        
+    async def generate_json(
+        self,
+        content: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        parts = []
         # Add multiple images for multi-page support
         if image_paths:
-            for img_path in image_paths:
-                with open(img_path, "rb") as img_file:
-                    img_data = img_file.read()
-                mime_type = mimetypes.guess_type(img_path)[0] or "image/png"
-                parts.append(types.Part.from_bytes(data=img_data, mime_type=mime_type))
-
-        response = self.client.models.generate_content(
-            model=self.model_name,
-            contents=[types.Content(role="user", parts=parts)],
-            config=types.GenerateContentConfig(response_mime_type="application/json"),
+            for image in image_paths:
+                page = await load_page_image_async(image)
+                parts.append(types.Part.from_bytes(data=page.data, mime_type=page.mime_type))
+        return await self._generate_with_parts(content, parts, on_progress, response_schema)
+
+    async def generate_json_from_pdf(
+        self,
+        content: str,
+        file_path: str,
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Send the original PDF (inline, or as an uploaded file reused across retries)."""
+        data = await asyncio.to_thread(Path(file_path).read_bytes)
+        if len(data) <= self.pdf_inline_max_bytes:
+            part = types.Part.from_bytes(data=data, mime_type="application/pdf")
+            return await self._generate_with_parts(content, [part], on_progress, response_schema)
+
+        uploaded = await self.file_store.get(file_path, data, "application/pdf")
+        try:
+            return await self._generate_with_parts(
+                content, [types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type)],
+                on_progress, response_schema
+            )
+        except genai_errors.APIError as e:
+            if e.code not in (403, 404):
+                raise
+            # The upload expired or was deleted server-side; upload again once
+            logger.warning(f"Gemini file {uploaded.name} rejected ({e.code}), uploading again")
+            self.file_store.invalidate(uploaded.name)
+            uploaded = await self.file_store.get(file_path, data, "application/pdf")
+            return await self._generate_with_parts(
+                content, [types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type)],
+                on_progress, response_schema
+            )
+
+    async def _generate_with_parts(
+        self,
+        content: str,
+        media_parts: List[types.Part],
+        on_progress: Optional[ProgressCallback],
+        response_schema: Optional[Dict[str, Any]]
+    ) -> str:
+        # The static system prompt goes first (or lives in an explicit cache) so the prefix is reused
+        system_prompt = build_system_prompt(response_schema)
+        parts = [types.Part.from_text(text=USER_PROMPT_TEMPLATE.format(content=content))] + media_parts
+        contents = [types.Content(role="user", parts=parts)]
+        cache_name = await self.prompt_cache.get(system_prompt)
+        try:
+            return await self._generate(contents, self._config(system_prompt, cache_name, response_schema), on_progress)
+        except genai_errors.APIError as e:
+            if cache_name is None or e.code not in (400, 403, 404):
+                raise
+            # The cached content expired or was deleted server-side; fall back to the inline prompt
+            logger.warning(f"Gemini cached content {cache_name} rejected ({e.code}), retrying without it")
+            self.prompt_cache.invalidate(cache_name)
+            return await self._generate(contents, self._config(system_prompt, None, response_schema), on_progress)
+
+    def _config(
+        self,
+        system_prompt: str,
+        cache_name: Optional[str],
+        response_schema: Optional[Dict[str, Any]]
+    ) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            system_instruction=None if cache_name else system_prompt,
+            cached_content=cache_name,
+            response_mime_type="application/json",
+            response_schema=to_gemini_schema(response_schema) if response_schema and self.structured_output else None,
         )
+
+    async def _generate(
+        self,
+        contents: List[types.Content],
+        config: types.GenerateContentConfig,
+        on_progress: Optional[ProgressCallback]
+    ) -> str:
+        # Async SDK surface; cancelling the wait also cancels the in-flight request
+        try:
+            if self.streaming:
+                text = await asyncio.wait_for(self._stream_content(contents, config, on_progress), timeout=self.timeout)
+                if text is not None:
+                    return text
+                # The stream was stopped on a loop; ask again for the whole response at once
+            response = await asyncio.wait_for(
+                self.client.aio.models.generate_content(model=self.model_name, contents=contents, config=config),
+                timeout=self.timeout,
+            )
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Gemini request exceeded timeout of {self.timeout:g}s")
+        self._record_usage(response.usage_metadata)
         return response.text
 
+    def _record_usage(self, usage: Optional[types.GenerateContentResponseUsageMetadata]):
+        if not usage or not usage.prompt_token_count:
+            return
+        cached = usage.cached_content_token_count or 0
+        record_llm_usage(
+            "gemini", self.model_name, usage.prompt_token_count,
+            (usage.candidates_token_count or 0) + (usage.thoughts_token_count or 0), cached,
+            cached * self.prefill_ms_per_1k_tokens / 1_000_000 if self.prefill_ms_per_1k_tokens else None
+        )
+
+    async def _stream_content(
+        self,
+        contents: List[types.Content],
+        config: types.GenerateContentConfig,
+        on_progress: Optional[ProgressCallback]
+    ) -> Optional[str]:
+        consumer = JsonStreamConsumer("gemini", on_progress)
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model_name, contents=contents, config=config
+        )
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = chunk.usage_metadata or usage
+                if usage and usage.candidates_token_count:
+                    consumer.completion_tokens = usage.candidates_token_count
+                if chunk.text and not await consumer.feed(chunk.text):
+                    break
+        finally:
+            # Closing the generator drops the connection when the stream was aborted
+            await stream.aclose()
+        self._record_usage(usage)
+        return consumer.finish()
+
 class LocalLLMProvider(LLMProvider):
+    name = "local"
+
     def __init__(self, base_url: str, model_name: str = "qwen/qwen3-vl-4b"):
         self.base_url = base_url
         self.model_name = model_name
         self.max_images_per_request = int(os.getenv("LOCAL_LLM_MAX_IMAGES", "3"))
+        # Estimated vision tokens per request, from image dimensions
+        self.image_token_budget = int(os.getenv("LOCAL_LLM_IMAGE_TOKEN_BUDGET", "16384"))
+        self.image_patch_px = int(os.getenv("LOCAL_LLM_IMAGE_PATCH_PX", "28"))
+        # Concurrent requests the inference server can serve (e.g. llama.cpp --parallel)
+        self.parallel_slots = int(os.getenv("LOCAL_LLM_PARALLEL_SLOTS", "2"))
+        self.page_retries = int(os.getenv("LOCAL_LLM_PAGE_RETRIES", "2"))
+        self.streaming = os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+        # response_format json_schema (LM Studio, llama.cpp server, vLLM)
+        self.structured_output = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+        self.items_format = os.getenv("LOCAL_LLM_ITEMS_FORMAT", "objects")  # objects or rows
+        # llama.cpp server: reuse the KV cache of the shared system prompt prefix across requests
+        self.cache_prompt = os.getenv("LOCAL_LLM_CACHE_PROMPT", "true").lower() in ("1", "true", "yes")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop = None
 
-    async def _process_single_page(self, content: str, image_path: str) -> str:
-        """Process a single page with the local LLM."""
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-        ]
-        
-        user_content = [{"type": "text", "text": USER_PROMPT_TEMPLATE.format(content=content)}]
-        
-        with open(image_path, "rb") as img_file:
-            img_data = base64.b64encode(img_file.read()).decode('utf-8')
-            user_content.append({
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{img_data}"}
-            })
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Slot semaphore bound to the running loop (the API and each worker process run their own)."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.parallel_slots)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    @staticmethod
+    def _image_content(page: PageImage) -> Dict[str, Any]:
+        """OpenAI-style image part carrying the page's real MIME type."""
+        return {
+            "type": "image_url",
+            "image_url": {"url": page.to_data_url()}
+        }
+
+    async def _chat_completion(
+        self,
+        content: str,
+        images: Optional[List[ImageInput]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Single /chat/completions call with the system prompt, text and optional images."""
+        messages = [{"role": "system", "content": build_system_prompt(response_schema)}]
         
-        messages.append({"role": "user", "content": user_content})
+        if images:
+            user_content = [{"type": "text", "text": USER_PROMPT_TEMPLATE.format(content=content)}]
+            for image in images:
+                user_content.append(self._image_content(await load_page_image_async(image)))
+            messages.append({"role": "user", "content": user_content})
+        else:
+            messages.append({"role": "user", "content": USER_PROMPT_TEMPLATE.format(content=content)})
 
-        async with httpx.AsyncClient() as client:
-            payload = {
-                "model": self.model_name,
-                "messages": messages,
-                "temperature": 0.1
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": 0.1
+        }
+        if self.cache_prompt:
+            payload["cache_prompt"] = True
+        if response_schema and self.structured_output:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": response_schema.get("title", "response"),
+                    "strict": True,
+                    "schema": response_schema,
+                },
             }
-            
-            response = await client.post(
-                f"{self.base_url}/chat/completions",
-                json=payload,
-                timeout=600.0
-            )
+
+        url = f"{self.base_url}/chat/completions"
+        if self.streaming:
+            text = await self._stream_chat_completion(url, payload, on_progress)
+            if text is not None:
+                return text
+            # The stream was stopped on a loop; ask again for the whole response at once
+
+        response = await get_http_client("llm", url).post(url, json=payload, timeout=600.0)
+        response.raise_for_status()
+        body = response.json()
+        self._record_usage(body)
+        return body["choices"][0]["message"]["content"]
+
+    def _record_usage(self, body: Dict[str, Any]):
+        """Token usage from OpenAI-style usage, with llama.cpp timings for the prompt cache."""
+        usage = body.get("usage") or {}
+        timings = body.get("timings") or {}
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        saved = None
+        if "cache_n" in timings:
+            cached = timings.get("cache_n") or 0
+            saved = cached * (timings.get("prompt_per_token_ms") or 0) / 1000
+        prompt = usage.get("prompt_tokens") or (timings.get("prompt_n") or 0) + cached
+        completion = usage.get("completion_tokens") or timings.get("predicted_n") or 0
+        if prompt:
+            record_llm_usage("local", self.model_name, prompt, completion, cached, saved)
+
+    async def _stream_chat_completion(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        on_progress: Optional[ProgressCallback]
+    ) -> Optional[str]:
+        """Server-sent-events variant of /chat/completions; None when the stream was aborted."""
+        consumer = JsonStreamConsumer("local", on_progress)
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        stats: Dict[str, Any] = {}
+
+        # Leaving the block early closes the connection, which stops generation on the server
+        async with get_http_client("llm", url).stream("POST", url, json=payload, timeout=600.0) as response:
             response.raise_for_status()
-            return response.json()["choices"][0]["message"]["content"]
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    consumer.completion_tokens = chunk["usage"].get("completion_tokens")
+                # Usage and llama.cpp timings may arrive on different chunks; record them once at the end
+                stats.update({key: chunk[key] for key in ("timings", "usage") if chunk.get(key)})
+                for choice in chunk.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta and not await consumer.feed(delta):
+                        # Count the tokens generated before the abort, like the Gemini path does
+                        self._record_usage(stats)
+                        return consumer.finish()
+        self._record_usage(stats)
+        return consumer.finish()
+
+    def _new_packer(self) -> PagePacker:
+        return PagePacker(self.max_images_per_request, self.image_token_budget, self.image_patch_px)
+
+    @staticmethod
+    def _group_content(content: str, group: List[PageImage], header: PageImage) -> str:
+        """Tell the model that a repeated header page is context only."""
+        if group[0] is not header or len(group) == 1:
+            return content
+        pages = ", ".join(str(page.page_index + 1) for page in group[1:])
+        return (
+            f"{content}\n\nThe first image is page {header.page_index + 1}, repeated only so the "
+            f"invoice header (number, date, supplier, totals) stays visible. "
+            f"Extract line items only from page(s) {pages}."
+        )
+
+    async def _process_group_with_retry(
+        self,
+        content: str,
+        group: List[PageImage],
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Send one page group within the slot limit, retrying when the JSON does not parse."""
+        for attempt in range(self.page_retries + 1):
+            async with self._get_semaphore():
+                result_str = await self._chat_completion(content, group, on_progress, response_schema)
+            try:
+                return expand_item_rows(json.loads(clean_json_response(result_str)))
+            except json.JSONDecodeError:
+                logger.warning(f"Unparseable group result (attempt {attempt + 1}/{self.page_retries + 1})")
+        return None
+
+    async def _process_groups(
+        self,
+        content: str,
+        groups: List[List[PageImage]],
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Fan page groups out concurrently and merge the results in page order."""
+        header = groups[0][0]
+        results = await asyncio.gather(*(
+            self._process_group_with_retry(
+                self._group_content(content, group, header), group, on_progress, response_schema
+            )
+            for group in groups
+        ))
+        return await self._merge_group_results(groups, results)
+
+    async def _merge_group_results(
+        self,
+        groups: List[List[PageImage]],
+        results: List[Optional[Dict[str, Any]]]
+    ) -> str:
+        """
+        Merge the groups that parsed; the pages only covered by groups that never
+        parsed are listed in "_failed_pages" so the invoice goes to review.
+        """
+        parsed = [result for result in results if result is not None]
+        if not parsed:
+            raise ValueError(f"None of the {len(groups)} page groups returned parseable JSON")
+        merged = await self._merge_results(parsed)
+        covered = {page.page_index for group, result in zip(groups, results) if result is not None for page in group}
+        failed_pages = sorted({
+            page.page_index + 1
+            for group, result in zip(groups, results) if result is None
+            for page in group if page.page_index not in covered
+        })
+        if failed_pages:
+            logger.warning(f"Page(s) {failed_pages} left out after {self.page_retries + 1} unparseable attempts")
+            merged = {**merged, "_failed_pages": failed_pages}
+        return json.dumps(merged)
 
     async def _merge_results(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Merge multiple page results into a single invoice."""
+        """Merge multiple page group results into a single invoice."""
         if len(results) == 1:
             return results[0]
         
@@ -115,72 +531,67 @@ class LocalLLMProvider(LLMProvider):
         
         return merged
 
-    async def generate_json(self, content: str, image_paths: Optional[List[str]] = None) -> str:
+    async def generate_json(
+        self,
+        content: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
         if not image_paths:
             # Text-only processing
-            messages = [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": USER_PROMPT_TEMPLATE.format(content=content)}
-            ]
-            
-            async with httpx.AsyncClient() as client:
-                payload = {
-                    "model": self.model_name,
-                    "messages": messages,
-                    "temperature": 0.1
-                }
-                
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    json=payload,
-                    timeout=600.0
-                )
-                response.raise_for_status()
-                return response.json()["choices"][0]["message"]["content"]
+            return await self._chat_completion(content, on_progress=on_progress, response_schema=response_schema)
         
-        # Multi-page processing: process each page and merge
-        if len(image_paths) <= self.max_images_per_request:
-            # Can process all at once with Qwen VL
-            messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-            user_content = [{"type": "text", "text": USER_PROMPT_TEMPLATE.format(content=content)}]
-            
-            for img_path in image_paths:
-                with open(img_path, "rb") as img_file:
-                    img_data = base64.b64encode(img_file.read()).decode('utf-8')
-                    user_content.append({
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{img_data}"}
-                    })
+        pages = [await load_page_image_async(image) for image in image_paths]
+        for i, page in enumerate(pages):
+            if page.page_index is None:
+                page.page_index = i
+        groups = pack_pages(pages, self.max_images_per_request, self.image_token_budget, self.image_patch_px)
+        
+        if len(groups) == 1:
+            # Everything fits in one request
+            return await self._chat_completion(content, groups[0], on_progress, response_schema)
+        
+        # Multi-page processing: page groups sharing the header page, merged afterwards
+        return await self._process_groups(content, groups, on_progress, response_schema)
+
+    async def generate_json_from_pages(
+        self,
+        content: str,
+        pages: AsyncIterator[PageImage],
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Start group requests as soon as each group of rendered pages is complete."""
+        packer = self._new_packer()
+        groups: List[List[PageImage]] = []
+        group_tasks: List[asyncio.Task] = []
+
+        def start(group: List[PageImage]):
+            groups.append(group)
+            group_content = self._group_content(content, group, packer.header)
+            group_tasks.append(asyncio.ensure_future(
+                self._process_group_with_retry(group_content, group, on_progress, response_schema)
+            ))
+
+        try:
+            async for page in pages:
+                for group in packer.add(page):
+                    start(group)
             
-            messages.append({"role": "user", "content": user_content})
+            remaining = packer.flush()
+            if not group_tasks and len(remaining) == 1:
+                # Everything fits in one request
+                return await self._chat_completion(content, remaining[0], on_progress, response_schema)
+            for group in remaining:
+                start(group)
             
-            async with httpx.AsyncClient() as client:
-                payload = {
-                    "model": self.model_name,
-                    "messages": messages,
-                    "temperature": 0.1
-                }
-                
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    json=payload,
-                    timeout=600.0
-                )
-                response.raise_for_status()
-                return response.json()["choices"][0]["message"]["content"]
-        else:
-            # Process pages in batches and merge results
-            results = []
-            for img_path in image_paths:
-                result_str = await self._process_single_page(content, img_path)
-                try:
-                    result = json.loads(result_str)
-                    results.append(result)
-                except json.JSONDecodeError:
-                    continue
-            
-            merged = await self._merge_results(results)
-            return json.dumps(merged)
+            results = await asyncio.gather(*group_tasks)
+        finally:
+            for task in group_tasks:
+                task.cancel()
+        
+        return await self._merge_group_results(groups, results)
 
 
 class ExtractionEngine:
@@ -188,40 +599,67 @@ class ExtractionEngine:
         self.llm_provider = llm_provider
         self.max_pages = int(os.getenv("MAX_PDF_PAGES", "10"))
         self.dpi_scale = float(os.getenv("PDF_DPI_SCALE", "1.5"))
+        self.text_fast_path = os.getenv("TEXT_FAST_PATH_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.text_classifier = TextLayerClassifier()
+        self.image_policy = ImageEncodingPolicy.from_env()
+        self.scale_policy = RenderScalePolicy.from_env()
+        self.render_pool = PdfRenderPool()
+        self.templates = SupplierTemplateStore()
+
+    def invoice_schema(self) -> Dict[str, Any]:
+        """Schema for the provider's item format; "rows" avoids repeating key names per item."""
+        if getattr(self.llm_provider, "items_format", "objects") == "rows":
+            return INVOICE_ROWS_JSON_SCHEMA
+        return INVOICE_JSON_SCHEMA
+
+    def extract_page_texts(self, file_path: str) -> List[str]:
+        """Extract the text layer of each page."""
+        return pdf_renderer.extract_page_texts(file_path)
+
+    @staticmethod
+    def _join_page_texts(page_texts: List[str], page_indexes: Optional[List[int]] = None) -> str:
+        if page_indexes is None:
+            page_indexes = list(range(len(page_texts)))
+        return "".join(f"\n--- Page {i+1} ---\n{page_texts[i]}" for i in page_indexes)
 
     def extract_text_from_pdf(self, file_path: str) -> str:
         """Extract text directly from PDF using PyMuPDF (no system dependencies)."""
-        doc = fitz.open(file_path)
-        full_text = ""
-        for i, page in enumerate(doc):
-            full_text += f"\n--- Page {i+1} ---\n{page.get_text()}"
-        doc.close()
-        return full_text
+        return self._join_page_texts(self.extract_page_texts(file_path))
 
-    def convert_pdf_to_images(self, file_path: str) -> List[str]:
-        """Convert all PDF pages to images for vision processing with unique filenames."""
+    def convert_pdf_to_images(self, file_path: str, page_indexes: Optional[List[int]] = None) -> List[PageImage]:
+        """Render PDF pages (all, or only page_indexes) to in-memory images for vision processing."""
         doc = fitz.open(file_path)
-        image_paths = []
+        page_images = []
         
         num_pages = min(len(doc), self.max_pages)
-        process_id = os.getpid()
-        unique_id = uuid.uuid4().hex[:8]
+        if page_indexes is None:
+            page_indexes = list(range(num_pages))
         
-        for i in range(num_pages):
-            page = doc.load_page(i)
-            # 150 DPI is usually enough for OCR while keeping file size small
-            pix = page.get_pixmap(matrix=fitz.Matrix(self.dpi_scale, self.dpi_scale))
-            temp_image = os.path.join(os.path.dirname(file_path), f"temp_{unique_id}_{process_id}_{i}.png")
-            pix.save(temp_image)
-            image_paths.append(temp_image)
+        for i in page_indexes:
+            if i >= num_pages:
+                continue
+            # Scale per page from its font sizes and the pixel budget (PDF_DPI_SCALE when not adaptive)
+            page_images.append(pdf_renderer.render_page(doc.load_page(i), self.image_policy, self.scale_policy))
         
         doc.close()
-        return image_paths
+        return page_images
 
-    async def process_invoice(self, file_path: str, content_type: Optional[str]) -> Dict[str, Any]:
+    async def _stream_pages(self, file_path: str, page_indexes: List[int], rendered: List[PageImage]):
+        """Render pages in the pool, recording each one as it is handed to the provider."""
+        page_indexes = [i for i in page_indexes if i < self.max_pages]
+        async for page in self.render_pool.iter_pages(file_path, page_indexes, self.image_policy, self.scale_policy):
+            rendered.append(page)
+            yield page
+
+    async def process_invoice(
+        self,
+        file_path: str,
+        content_type: Optional[str],
+        on_progress: Optional[ProgressCallback] = None,
+        user_id: Optional[str] = None
+    ) -> Dict[str, Any]:
         text = ""
         image_paths = []
-        temp_images = []
         
         # Detect type by extension as fallback
         ext = os.path.splitext(file_path)[1].lower()
@@ -230,66 +668,151 @@ class ExtractionEngine:
         c_type = (content_type or "").lower()
 
         is_pdf = "pdf" in c_type or ext == ".pdf"
-        is_local = isinstance(self.llm_provider, LocalLLMProvider)
+        is_local = self.llm_provider.name == "local"
+        native_pdf = is_pdf and getattr(self.llm_provider, "pdf_mode", "images") == "native"
 
-        try:
-            if is_pdf:
-                text = self.extract_text_from_pdf(file_path)
+        # Recurring supplier layouts are read from the text layer without the LLM
+        if is_pdf and await self.templates.has_active(user_id):
+            layout = await self.render_pool.extract_page_layouts(file_path, self.max_pages)
+            matched = await self.templates.extract(user_id, layout)
+            if matched is not None:
+                result, template_id = matched
+                result["_metadata"] = {
+                    "pages_processed": len(layout),
+                    "file_type": ext,
+                    "provider": "template",
+                    "extraction_path": "template",
+                    "template_id": template_id,
+                    "text_pages": [i + 1 for i in range(len(layout))],
+                    "vision_pages": [],
+                    "page_dpi": {},
+                }
+                return result
+        
+        extraction_path = "text"
+        pages_processed = 1
+        text_pages: List[int] = []
+        vision_pages: List[int] = []
+        render_pages: List[int] = []
+        rendered: List[PageImage] = []
+
+        if native_pdf:
+            pages_processed = await self.render_pool.count_pages(file_path)
+            if pages_processed > self.max_pages:
+                # The whole document would be sent; render only the first MAX_PDF_PAGES instead
+                logger.info(f"{pages_processed}-page PDF exceeds MAX_PDF_PAGES, using the image path")
+                native_pdf = False
+
+        if native_pdf:
+            # The model reads the PDF's text layer and page images itself; nothing is rendered here
+            extraction_path = "native_pdf"
+            text = f"Extract from the attached {pages_processed} page(s) PDF invoice."
+        elif is_pdf:
+            # PyMuPDF work runs in the render pool so the event loop stays free
+            page_texts = await self.render_pool.extract_page_texts(file_path)
+            pages_processed = len(page_texts)
+            
+            if self.text_fast_path:
+                report = self.text_classifier.classify(page_texts)
+                text_pages, vision_pages = report.text_pages, report.vision_pages
+                extraction_path = report.path
+            else:
+                vision_pages = list(range(len(page_texts)))
+                extraction_path = "vision"
+            # Only the first MAX_PDF_PAGES pages are rendered; later scanned pages are left out
+            vision_pages = [i for i in vision_pages if i < self.max_pages]
+            if extraction_path == "hybrid" and not vision_pages:
+                extraction_path = "text"
+            
+            if extraction_path == "vision":
+                text = self._join_page_texts(page_texts)
                 
                 # Convert ALL pages to images for vision processing
-                temp_images = self.convert_pdf_to_images(file_path)
-                image_paths = temp_images
+                render_pages = list(range(min(len(page_texts), self.max_pages)))
+                pages_processed = len(render_pages)
                 
                 if is_local:
                     # For local models, use simpler content description
-                    text = f"Extracted from the attached {len(temp_images)} page(s) invoice image(s)."
-                    
-            elif "image" in c_type or ext in [".jpg", ".jpeg", ".png"]:
-                image_paths = [file_path]
-                text = "Process this invoice image"
+                    text = f"Extracted from the attached {len(render_pages)} page(s) invoice image(s)."
             else:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-
-            json_str = await self.llm_provider.generate_json(text, image_paths=image_paths if image_paths else None)
-            
-            # Handle potential markdown code blocks and unexpected prefixes in response
-            if isinstance(json_str, str):
-                json_str = json_str.strip()
-                # Remove Markdown code block wrappers
-                if "```json" in json_str:
-                    json_str = json_str.split("```json")[-1].split("```")[0]
-                elif "```" in json_str:
-                    json_str = json_str.split("```")[-1].split("```")[0]
-                
-                # Final strip of whitespace or potential artifacts
-                json_str = json_str.strip()
+                # Born-digital pages go as text; only scanned pages are rendered
+                text = self._join_page_texts(page_texts, text_pages)
+                pages_processed = len(text_pages) + len(vision_pages)
+                if vision_pages:
+                    render_pages = vision_pages
+                    text += (
+                        f"\n\nPage(s) {', '.join(str(i + 1) for i in vision_pages)} "
+                        f"have no usable text layer and are attached as image(s)."
+                    )
                 
-                # If the string starts with anything other than { or [, it's likely malformed
-                if not (json_str.startswith("{") or json_str.startswith("[")):
-                    start_idx = json_str.find("{")
-                    if start_idx != -1:
-                        json_str = json_str[start_idx:]
-                    end_idx = json_str.rfind("}")
-                    if end_idx != -1:
-                        json_str = json_str[:end_idx+1]
-            
-            result = json.loads(json_str)
-            
-            # Add metadata
-            result["_metadata"] = {
-                "pages_processed": len(temp_images) if temp_images else 1,
-                "file_type": ext,
-                "provider": "local" if is_local else "gemini"
+        elif "image" in c_type or ext in [".jpg", ".jpeg", ".png"]:
+            image_paths = [file_path]
+            text = "Process this invoice image"
+            extraction_path = "vision"
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+
+        if native_pdf:
+            json_str = await self.llm_provider.generate_json_from_pdf(
+                text, file_path, on_progress=on_progress, response_schema=self.invoice_schema()
+            )
+        elif render_pages:
+            # Pages are streamed to the provider as the pool finishes them
+            json_str = await self.llm_provider.generate_json_from_pages(
+                text, self._stream_pages(file_path, render_pages, rendered),
+                on_progress=on_progress, response_schema=self.invoice_schema()
+            )
+        else:
+            json_str = await self.llm_provider.generate_json(
+                text, image_paths=image_paths if image_paths else None,
+                on_progress=on_progress, response_schema=self.invoice_schema()
+            )
+        
+        # Without constrained decoding the model may wrap the JSON in markdown or prose
+        if isinstance(json_str, str):
+            json_str = clean_json_response(json_str)
+        
+        result = expand_item_rows(json.loads(json_str))
+        failed_pages = result.pop("_failed_pages", None)
+        
+        # Add metadata
+        result["_metadata"] = {
+            "pages_processed": pages_processed,
+            "file_type": ext,
+            "provider": self.llm_provider.name,
+            "extraction_path": extraction_path,
+            "text_pages": [i + 1 for i in text_pages],
+            "vision_pages": [i + 1 for i in vision_pages],
+            "page_dpi": {
+                str(page.page_index + 1): page.dpi
+                for page in sorted(rendered, key=lambda page: page.page_index)
             }
-            
-            return result
-            
-        finally:
-            # Clean up temp images
-            for temp_img in temp_images:
-                if os.path.exists(temp_img):
-                    try:
-                        os.remove(temp_img)
-                    except Exception:
-                        pass
+        }
+        if failed_pages:
+            result["_metadata"]["failed_pages"] = failed_pages
+        
+        return result
+
+    async def learn_supplier_template(self, file_path: str, result: Dict[str, Any], user_id: Optional[str]):
+        """
+        Add a verified LLM extraction of a PDF as a sample of its supplier's
+        template. Called once the invoice is saved; the layout extraction and the
+        anchor search run as one render pool job.
+        """
+        metadata = result.get("_metadata") or {}
+        if (
+            metadata.get("file_type") != ".pdf" or metadata.get("extraction_path") == "template"
+            or metadata.get("failed_pages") or not self.templates.should_learn(user_id, result)
+        ):
+            return
+        try:
+            sample = await self.render_pool.run(
+                learn_sample_from_file, file_path, self.max_pages,
+                {"general_fields": result["general_fields"], "items": result.get("items")}
+            )
+        except Exception as e:
+            logger.warning(f"Supplier template sample of {file_path} failed: {e}")
+            return
+        if sample is not None:
+            await self.templates.learn(user_id, result, sample)
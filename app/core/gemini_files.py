@@ -0,0 +1,72 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# Uploaded files are deleted by the API after 48 hours; stop reusing them a little earlier
+FILE_REUSE_SECONDS = 47 * 3600
+# Uploads are usually ACTIVE at once; larger PDFs may need a moment of server-side processing
+ACTIVE_POLL_SECONDS = 1.0
+ACTIVE_POLL_ATTEMPTS = 30
+
+
+class GeminiFileStore:
+    """
+    Gemini Files API uploads keyed by content hash, so a document that is
+    retried (or uploaded twice) is sent to the API only once while its handle
+    is still valid.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._files: Dict[str, Tuple[types.File, float]] = {}  # sha256 -> (file, reuse until)
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    async def get(self, file_path: str, data: bytes, mime_type: str) -> types.File:
+        """Uploaded file for these bytes, uploading them if no live handle exists."""
+        key = hashlib.sha256(data).hexdigest()
+        async with self._get_lock():
+            now = time.monotonic()
+            for stale in [k for k, (_, until) in self._files.items() if until <= now]:
+                del self._files[stale]
+            if key in self._files:
+                return self._files[key][0]
+
+            uploaded = await self.client.aio.files.upload(
+                file=file_path,
+                config=types.UploadFileConfig(mime_type=mime_type, display_name=os.path.basename(file_path)),
+            )
+            uploaded = await self._wait_active(uploaded)
+            logger.info(f"Uploaded {os.path.basename(file_path)} to Gemini as {uploaded.name}")
+            self._files[key] = (uploaded, now + FILE_REUSE_SECONDS)
+            return uploaded
+
+    async def _wait_active(self, uploaded: types.File) -> types.File:
+        for _ in range(ACTIVE_POLL_ATTEMPTS):
+            if uploaded.state != types.FileState.PROCESSING:
+                break
+            await asyncio.sleep(ACTIVE_POLL_SECONDS)
+            uploaded = await self.client.aio.files.get(name=uploaded.name)
+        if uploaded.state == types.FileState.FAILED:
+            raise RuntimeError(f"Gemini could not process uploaded file {uploaded.name}")
+        return uploaded
+
+    def invalidate(self, name: str):
+        """Forget a handle the API no longer accepts."""
+        for key, (uploaded, _) in list(self._files.items()):
+            if uploaded.name == name:
+                del self._files[key]
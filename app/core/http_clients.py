@@ -0,0 +1,188 @@
+import os
+import asyncio
+import logging
+import importlib.util
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import httpcore
+from prometheus_client import REGISTRY
+
+from app.core.metrics import HTTP_POOL_WAITS, HttpPoolCollector
+
+logger = logging.getLogger(__name__)
+
+# httpx only negotiates HTTP/2 (over TLS, via ALPN) when the h2 package is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Pool usage is read from private httpcore 1.x internals (AsyncConnectionPool.connections
+# and _requests); with other versions it is not reported
+POOL_INTROSPECTION = httpcore.__version__.split(".")[0] == "1"
+
+
+def _pool_connections(transport: httpx.AsyncHTTPTransport) -> Optional[list]:
+    """Connections of the httpcore pool behind a transport, or None when they cannot be read."""
+    if not POOL_INTROSPECTION:
+        return None
+    try:
+        return list(transport._pool.connections)
+    except AttributeError:
+        return None
+
+
+class PooledTransport(httpx.AsyncHTTPTransport):
+    """HTTP transport that counts requests which have to wait for a free pooled connection."""
+
+    def __init__(self, name: str, limits: httpx.Limits, **kwargs):
+        super().__init__(limits=limits, **kwargs)
+        self.name = name
+        self.max_connections = limits.max_connections
+        self.in_flight = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        # HTTP/1.1 connections carry one request at a time; HTTP/2 ones multiplex
+        connections = _pool_connections(self) or []
+        multiplexed = any(c.is_available() and c.info().startswith("HTTP/2") for c in connections)
+        if self.in_flight >= self.max_connections and not multiplexed:
+            HTTP_POOL_WAITS.labels(client=self.name).inc()
+        self.in_flight += 1
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.in_flight -= 1
+
+
+class HttpClientRegistry:
+    """
+    Long-lived httpx clients shared by the LLM, exchange-rate and webhook
+    callers. There is one client per (name, host), so connection limits apply
+    per host and keep-alive connections are reused across requests. Webhook
+    hosts are user-supplied, so only HTTP_MAX_CLIENTS clients are kept and the
+    least recently used idle ones are closed beyond that. Clients are bound to
+    the event loop they were created on and are recreated when the running
+    loop changes, like the Motor client in app.database.connection.
+    """
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "10"))
+        self.max_keepalive = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "5"))
+        self.keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+        self.http2 = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes") and HTTP2_AVAILABLE
+        self.max_clients = int(os.getenv("HTTP_MAX_CLIENTS", "32"))
+        self._clients: "OrderedDict[Tuple[str, str], httpx.AsyncClient]" = OrderedDict()
+        self._loop = None
+        # Closes of evicted clients in progress, kept so the tasks are not garbage collected
+        self._closing = set()
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def get(self, name: str, url: str) -> httpx.AsyncClient:
+        """Shared client for requests from `name` to the host of `url`."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._drop_loop_clients()
+            self._loop = loop
+
+        key = (name, self._host_key(url))
+        client = self._clients.get(key)
+        if client is not None and not client.is_closed:
+            self._clients.move_to_end(key)
+        else:
+            transport = PooledTransport(
+                name,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            )
+            client = httpx.AsyncClient(transport=transport)
+            self._clients[key] = client
+            self._evict()
+        return client
+
+    def _evict(self):
+        """Close the least recently used idle clients above max_clients (busy ones are kept for now)."""
+        overflow = len(self._clients) - self.max_clients
+        if overflow <= 0:
+            return
+        for key in [key for key, client in self._clients.items() if client._transport.in_flight == 0][:overflow]:
+            self._close_later(self._clients.pop(key))
+
+    @staticmethod
+    async def _close(client: httpx.AsyncClient):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Error closing HTTP client: {e}")
+
+    def _close_later(self, client: httpx.AsyncClient):
+        task = asyncio.ensure_future(self._close(client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _drop_loop_clients(self):
+        """Forget the clients of the previous loop, closing them on it if it is still open."""
+        clients, self._clients = list(self._clients.values()), OrderedDict()
+        old_loop = self._loop
+        if old_loop is None or old_loop.is_closed():
+            # Their connections went down with the loop's transports
+            return
+        for client in clients:
+            old_loop.call_soon_threadsafe(self._close_later, client)
+
+    @staticmethod
+    def _pool_stats(client: httpx.AsyncClient) -> Optional[Dict[str, int]]:
+        """Connection counts read from the httpcore pool behind the client; None when unknown."""
+        connections = _pool_connections(client._transport)
+        if connections is None:
+            return None
+        try:
+            waiting = sum(1 for r in client._transport._pool._requests if r.connection is None)
+        except AttributeError:
+            return None
+        idle = sum(1 for c in connections if c.is_idle())
+        return {"active": len(connections) - idle, "idle": idle, "waiting": waiting}
+
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """Connection counts per client name, summed over hosts (names with unknown counts are left out)."""
+        totals: Dict[str, Dict[str, int]] = {}
+        for (name, _), client in list(self._clients.items()):
+            if client.is_closed:
+                continue
+            stats = self._pool_stats(client)
+            if stats is None:
+                continue
+            entry = totals.setdefault(name, {"active": 0, "idle": 0, "waiting": 0})
+            for state, count in stats.items():
+                entry[state] += count
+        return totals
+
+    async def aclose(self):
+        """Close every client created on the running loop."""
+        clients, self._clients = self._clients, OrderedDict()
+        if self._loop is not asyncio.get_running_loop():
+            return
+        for client in clients.values():
+            await self._close(client)
+        if self._closing:
+            await asyncio.gather(*self._closing)
+
+
+http_clients = HttpClientRegistry()
+REGISTRY.register(HttpPoolCollector(http_clients.pool_stats))
+
+
+def get_http_client(name: str, url: str) -> httpx.AsyncClient:
+    """Shared pooled client for `name` requests to the host of `url`."""
+    return http_clients.get(name, url)
+
+
+async def close_http_clients():
+    await http_clients.aclose()
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.metrics import LLM_TIME_TO_FIRST_FIELD, LLM_STREAM_TOKENS_PER_SECOND, LLM_STREAM_ABORTS
+
+logger = logging.getLogger(__name__)
+
+# Called with {"fields": {...newly completed general fields}, "items": <new item count>}
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# A repeat of the last LOOP_REPEATS * period characters for some period in this range is a loop
+LOOP_MIN_PERIOD = 8
+LOOP_MAX_PERIOD = 512
+LOOP_REPEATS = 4
+LOOP_CHECK_EVERY = 256  # characters between loop checks
+
+# Line items arrive as "items" objects or as compact "item_rows"
+ITEM_KEYS = ("items", "item_rows")
+
+
+@dataclass
+class _Frame:
+    """An open object or array while scanning."""
+    kind: str  # "{" or "["
+    path: Tuple
+    key: Optional[str] = None
+    key_start: Optional[int] = None
+    expect_key: bool = False
+    index: int = 0
+    value_start: Optional[int] = None
+
+    @property
+    def member(self):
+        return self.key if self.kind == "{" else self.index
+
+
+class IncrementalJsonParser:
+    """
+    Scans a JSON document as it streams in and reports each value as soon
+    as it is complete, for values up to emit_depth levels deep, e.g.
+    ("general_fields", "invoice_number") or ("items", 3). Anything before the
+    first "{" (such as a code fence) is skipped.
+    """
+
+    def __init__(self, emit_depth: int = 2):
+        self.emit_depth = emit_depth
+        self.text = ""
+        self.end: Optional[int] = None  # index just past the closing brace
+        self.partial: Dict[str, Any] = {}  # completed values, rebuilt into the document shape
+        self._prefix = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        return json.loads(self.text[:self.end]) if self.complete else None
+
+    def feed(self, chunk: str) -> List[Tuple[Tuple, Any]]:
+        """Add streamed text; returns the (path, value) pairs completed by it."""
+        if self.complete:
+            return []
+        if not self.text:
+            self._prefix += chunk
+            start = self._prefix.find("{")
+            if start == -1:
+                return []
+            chunk, self._prefix = self._prefix[start:], ""
+
+        self.text += chunk
+        events = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            frame = self._stack[-1] if self._stack else None
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if frame.expect_key and frame.key_start is not None:
+                        frame.key = json.loads(text[frame.key_start:i + 1])
+                        frame.key_start = None
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if frame is not None and frame.expect_key:
+                    frame.key_start = i
+            elif c in "{[":
+                path = frame.path + (frame.member,) if frame else ()
+                self._stack.append(_Frame(
+                    kind=c, path=path, expect_key=(c == "{"),
+                    value_start=i + 1 if c == "[" else None,
+                ))
+            elif frame is None:
+                continue
+            elif c == ":" and frame.kind == "{":
+                frame.expect_key = False
+                frame.value_start = i + 1
+            elif c == ",":
+                self._complete_value(frame, i, events)
+                if frame.kind == "{":
+                    frame.expect_key = True
+                else:
+                    frame.index += 1
+                    frame.value_start = i + 1
+            elif c in "}]":
+                self._complete_value(frame, i, events)
+                self._stack.pop()
+                if not self._stack:
+                    self.end = i + 1
+                    break
+
+        self._pos = len(text) if self.end is None else self.end
+        return events
+
+    def _complete_value(self, frame: _Frame, end: int, events: List[Tuple[Tuple, Any]]):
+        start, frame.value_start = frame.value_start, None
+        if start is None or len(frame.path) >= self.emit_depth:
+            return
+        raw = self.text[start:end].strip()
+        if not raw:
+            return
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        path = frame.path + (frame.member,)
+        events.append((path, value))
+        self._record(path, value)
+
+    def _record(self, path: Tuple, value: Any):
+        if len(path) == 1:
+            # Containers were already recorded member by member
+            if not isinstance(value, (dict, list)) or path[0] not in self.partial:
+                self.partial[path[0]] = value
+            return
+        parent, member = path
+        container = self.partial.setdefault(parent, [] if isinstance(member, int) else {})
+        if isinstance(container, list):
+            container.append(value)
+        else:
+            container[member] = value
+
+
+def find_tail_loop(text: str) -> Optional[int]:
+    """Period of a chunk repeated LOOP_REPEATS times at the end of text, if any."""
+    for period in range(LOOP_MIN_PERIOD, min(LOOP_MAX_PERIOD, len(text) // LOOP_REPEATS) + 1):
+        tail = text[-period:]
+        if text[-period * LOOP_REPEATS:] == tail * LOOP_REPEATS:
+            return period
+    return None
+
+
+class JsonStreamConsumer:
+    """
+    Feeds a provider's streamed completion into an IncrementalJsonParser,
+    reports newly completed general fields and items through on_progress,
+    records time-to-first-field and tokens/sec, and asks the provider to stop
+    the stream when the model loops: the text repeats without completing any
+    value, or the same item keeps coming back far more often than an invoice
+    would list it. An aborted stream yields no result; the provider asks again
+    without streaming instead of keeping a partial extraction.
+    """
+
+    def __init__(self, llm_provider: str, on_progress: Optional[ProgressCallback] = None):
+        self.llm_provider = llm_provider
+        self.on_progress = on_progress
+        self.max_repeated_items = int(os.getenv("STREAM_MAX_REPEATED_ITEMS", "25"))
+        self.progress_item_step = int(os.getenv("STREAM_PROGRESS_ITEM_STEP", "5"))
+        self.parser = IncrementalJsonParser()
+        self.started = time.monotonic()
+        self.first_field_at: Optional[float] = None
+        self.chunks = 0
+        self.completion_tokens: Optional[int] = None  # set by the provider from usage data
+        self.abort_reason: Optional[str] = None
+        self._raw = ""
+        self._last_loop_check = 0
+        self._last_value_at = 0  # length of _raw when a value last completed
+        self._last_item: Optional[str] = None
+        self._item_repeats = 0
+        self._pending_fields: Dict[str, Any] = {}
+        self._pending_items = 0
+
+    async def feed(self, text: str) -> bool:
+        """Consume a chunk; returns False when the stream should be aborted."""
+        self.chunks += 1
+        self._raw += text
+
+        events = self.parser.feed(text)
+        if events:
+            self._last_value_at = len(self._raw)
+        for path, value in events:
+            if path[0] in ITEM_KEYS and len(path) == 2:
+                self._mark_first_field()
+                self._pending_items += 1
+                if self._is_repeated_item(value):
+                    return self._abort("repeated_items")
+            elif len(path) == 2 and path[0] == "general_fields":
+                self._mark_first_field()
+                self._pending_fields[path[1]] = value
+            elif len(path) == 1 and path[0] != "general_fields" and path[0] not in ITEM_KEYS:
+                self._mark_first_field()
+                self._pending_fields[path[0]] = value
+
+        if not self.parser.complete and len(self._raw) - self._last_loop_check >= LOOP_CHECK_EVERY:
+            self._last_loop_check = len(self._raw)
+            period = find_tail_loop(self._raw)
+            # Identical items repeat the text too; only a loop that completes nothing is a decoding loop
+            if period and len(self._raw) - period * LOOP_REPEATS >= self._last_value_at:
+                return self._abort("repeated_text")
+
+        await self._report_progress()
+        return True
+
+    def _mark_first_field(self):
+        if self.first_field_at is None:
+            self.first_field_at = time.monotonic()
+            LLM_TIME_TO_FIRST_FIELD.labels(llm_provider=self.llm_provider).observe(self.first_field_at - self.started)
+
+    def _is_repeated_item(self, item: Any) -> bool:
+        key = json.dumps(item, sort_keys=True)
+        self._item_repeats = self._item_repeats + 1 if key == self._last_item else 1
+        self._last_item = key
+        return self._item_repeats >= self.max_repeated_items
+
+    def _abort(self, reason: str) -> bool:
+        self.abort_reason = reason
+        LLM_STREAM_ABORTS.labels(llm_provider=self.llm_provider, reason=reason).inc()
+        logger.warning(f"Aborted {self.llm_provider} stream after {len(self._raw)} chars: {reason}")
+        return False
+
+    async def _report_progress(self):
+        if self.on_progress is None:
+            return
+        if not self._pending_fields and self._pending_items < self.progress_item_step:
+            return
+        progress = {"fields": self._pending_fields, "items": self._pending_items}
+        self._pending_fields, self._pending_items = {}, 0
+        try:
+            await self.on_progress(progress)
+        except Exception as e:
+            logger.warning(f"Stream progress callback failed: {e}")
+
+    def finish(self) -> Optional[str]:
+        """
+        Record throughput and return the JSON text to hand to process_invoice,
+        or None when the stream was aborted.
+        """
+        elapsed = time.monotonic() - self.started
+        tokens = self.completion_tokens or self.chunks
+        if elapsed > 0 and tokens:
+            LLM_STREAM_TOKENS_PER_SECOND.labels(llm_provider=self.llm_provider).observe(tokens / elapsed)
+
+        if self.abort_reason is not None:
+            return None
+        if self.parser.complete:
+            return self.parser.text[:self.parser.end]
+        # Truncated output; let the caller's JSON handling deal with it
+        return self._raw
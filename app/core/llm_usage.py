@@ -0,0 +1,165 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+
+from app.core.metrics import LLM_TOKENS, LLM_COST, record_prompt_cache
+
+# Stage a provider call is attributed to; callers switch it with llm_stage()
+DEFAULT_STAGE = "extraction"
+
+
+@dataclass
+class StageUsage:
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+@dataclass
+class TokenPrices:
+    """USD per 1M tokens; cached prompt tokens are billed at the cached rate instead of the input rate."""
+    prompt: float
+    completion: float
+    cached: float
+
+    @classmethod
+    def from_env(cls) -> "TokenPrices":
+        prompt = float(os.getenv("LLM_PRICE_PER_1M_PROMPT_TOKENS", "0"))
+        return cls(
+            prompt=prompt,
+            completion=float(os.getenv("LLM_PRICE_PER_1M_COMPLETION_TOKENS", "0")),
+            cached=float(os.getenv("LLM_PRICE_PER_1M_CACHED_TOKENS", str(prompt))),
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.prompt or self.completion or self.cached)
+
+    def cost(self, usage: StageUsage) -> float:
+        uncached = max(usage.prompt_tokens - usage.cached_tokens, 0)
+        return (
+            uncached * self.prompt + usage.cached_tokens * self.cached + usage.completion_tokens * self.completion
+        ) / 1_000_000
+
+
+class UsageTracker:
+    """Token usage of one invoice, split by stage."""
+
+    def __init__(self):
+        self.stages: Dict[str, StageUsage] = {}
+        self.provider: Optional[str] = None
+        self.model: Optional[str] = None
+        self.prices = TokenPrices.from_env()
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "UsageTracker":
+        """Tracker holding a stored llm_usage document, to add later stages to it."""
+        tracker = cls()
+        if data:
+            tracker.provider, tracker.model = data.get("provider"), data.get("model")
+            for stage, usage in (data.get("stages") or {}).items():
+                tracker.stages[stage] = StageUsage(
+                    requests=usage.get("requests", 0),
+                    prompt_tokens=usage.get("prompt_tokens", 0),
+                    completion_tokens=usage.get("completion_tokens", 0),
+                    cached_tokens=usage.get("cached_tokens", 0),
+                )
+        return tracker
+
+    def merge(self, other: "UsageTracker"):
+        """Add the usage collected by another tracker (e.g. a follow-up task)."""
+        for stage, usage in other.stages.items():
+            own = self.stages.setdefault(stage, StageUsage())
+            own.requests += usage.requests
+            own.prompt_tokens += usage.prompt_tokens
+            own.completion_tokens += usage.completion_tokens
+            own.cached_tokens += usage.cached_tokens
+        if other.provider:
+            self.provider, self.model = other.provider, other.model
+
+    def add(self, stage: str, provider: str, model: str, prompt: int, completion: int, cached: int):
+        usage = self.stages.setdefault(stage, StageUsage())
+        usage.requests += 1
+        usage.prompt_tokens += prompt
+        usage.completion_tokens += completion
+        usage.cached_tokens += cached
+        self.provider, self.model = provider, model
+
+    @property
+    def total(self) -> StageUsage:
+        total = StageUsage()
+        for usage in self.stages.values():
+            total.requests += usage.requests
+            total.prompt_tokens += usage.prompt_tokens
+            total.completion_tokens += usage.completion_tokens
+            total.cached_tokens += usage.cached_tokens
+        return total
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Document stored on the invoice as llm_usage."""
+        total = self.total
+        data = {
+            "provider": self.provider,
+            "model": self.model,
+            **asdict(total),
+            "total_tokens": total.total_tokens,
+            "stages": {
+                stage: {**asdict(usage), "total_tokens": usage.total_tokens}
+                for stage, usage in self.stages.items()
+            },
+        }
+        if self.prices.configured:
+            data["estimated_cost_usd"] = round(sum(self.prices.cost(u) for u in self.stages.values()), 6)
+        return data
+
+
+_tracker: ContextVar[Optional[UsageTracker]] = ContextVar("llm_usage_tracker", default=None)
+_stage: ContextVar[str] = ContextVar("llm_usage_stage", default=DEFAULT_STAGE)
+
+
+def start_usage_tracking() -> UsageTracker:
+    """Collect the usage of every LLM call made from the current task from here on."""
+    tracker = UsageTracker()
+    _tracker.set(tracker)
+    return tracker
+
+
+@contextmanager
+def llm_stage(stage: str):
+    """Attribute LLM calls inside the block to stage (e.g. "review")."""
+    token = _stage.set(stage)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+def record_llm_usage(
+    llm_provider: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_tokens: int = 0,
+    prefill_seconds_saved: Optional[float] = None
+):
+    """Called by providers with the usage reported for each response."""
+    stage = _stage.get()
+    for kind, count in (("prompt", prompt_tokens), ("completion", completion_tokens), ("cached", cached_tokens)):
+        LLM_TOKENS.labels(llm_provider=llm_provider, model=model, stage=stage, kind=kind).inc(count)
+    if prompt_tokens:
+        record_prompt_cache(llm_provider, cached_tokens, prefill_seconds_saved)
+
+    tracker = _tracker.get()
+    prices = tracker.prices if tracker else TokenPrices.from_env()
+    if prices.configured:
+        usage = StageUsage(1, prompt_tokens, completion_tokens, cached_tokens)
+        LLM_COST.labels(llm_provider=llm_provider, model=model, stage=stage).inc(prices.cost(usage))
+    if tracker is not None:
+        tracker.add(stage, llm_provider, model, prompt_tokens, completion_tokens, cached_tokens)
@@ -2,9 +2,10 @@ import os
 import logging
 import time
 from prometheus_client import Counter, Histogram, Gauge, Info, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
-from typing import Callable
+from typing import Callable, Dict
 
 # Configure logging
 logging.basicConfig(
@@ -45,6 +46,78 @@ WEBHOOK_CALLS = Counter(
     ['success']
 )
 
+EXTRACTION_CACHE_HITS = Counter(
+    'extraction_cache_hits_total',
+    'Uploads served from the extraction result cache',
+    ['llm_provider']
+)
+
+EXTRACTION_CACHE_MISSES = Counter(
+    'extraction_cache_misses_total',
+    'Uploads not found in the extraction result cache',
+    ['llm_provider']
+)
+
+LLM_STREAM_ABORTS = Counter(
+    'llm_stream_aborts_total',
+    'Streamed extractions stopped early because the model was looping',
+    ['llm_provider', 'reason']
+)
+
+PROMPT_CACHE_REQUESTS = Counter(
+    'llm_prompt_cache_requests_total',
+    'LLM requests by whether a cached prompt prefix was reused',
+    ['llm_provider', 'result']
+)
+
+PREFILL_SECONDS_SAVED = Counter(
+    'llm_prefill_seconds_saved_total',
+    'Estimated prefill time saved by prompt prefix caching',
+    ['llm_provider']
+)
+
+LLM_TOKENS = Counter(
+    'llm_tokens_total',
+    'LLM tokens by kind (prompt, completion, cached prompt)',
+    ['llm_provider', 'model', 'stage', 'kind']
+)
+
+LLM_COST = Counter(
+    'llm_estimated_cost_usd_total',
+    'Estimated LLM cost from the configured token prices',
+    ['llm_provider', 'model', 'stage']
+)
+
+INVOICE_REVIEWS = Counter(
+    'invoice_reviews_total',
+    'Invoice reviews by the path that produced them (rules, llm, llm_batch, fallback)',
+    ['source']
+)
+
+EXCHANGE_RATE_LOOKUPS = Counter(
+    'exchange_rate_lookups_total',
+    'Exchange rate lookups by where the rate came from',
+    ['source']
+)
+
+EXCHANGE_RATE_FETCHES = Counter(
+    'exchange_rate_fetches_total',
+    'Rate table requests to the exchange rate API',
+    ['result']
+)
+
+SUPPLIER_TEMPLATE_EXTRACTIONS = Counter(
+    'supplier_template_extractions_total',
+    'Invoices matched to a learned supplier template (extracted, or rejected and sent to the LLM)',
+    ['result']
+)
+
+HTTP_POOL_WAITS = Counter(
+    'http_client_pool_waits_total',
+    'Outgoing requests that had to wait for a pooled connection',
+    ['client']
+)
+
 # Histograms
 REQUEST_LATENCY = Histogram(
     'invoice_api_request_latency_seconds',
@@ -60,6 +133,27 @@ PROCESSING_TIME = Histogram(
     buckets=[1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0]
 )
 
+LLM_TIME_TO_FIRST_FIELD = Histogram(
+    'llm_time_to_first_field_seconds',
+    'Time from request start to the first complete field of a streamed extraction',
+    ['llm_provider'],
+    buckets=[0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0]
+)
+
+LLM_STREAM_TOKENS_PER_SECOND = Histogram(
+    'llm_stream_tokens_per_second',
+    'Generation speed of streamed extractions',
+    ['llm_provider'],
+    buckets=[5, 10, 20, 40, 60, 80, 120, 200, 400]
+)
+
+PIPELINE_STAGE_SECONDS = Histogram(
+    'invoice_pipeline_stage_seconds',
+    'Time spent in each stage of invoice processing',
+    ['stage'],
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+)
+
 # Gauges
 ACTIVE_TASKS = Gauge(
     'active_processing_tasks',
@@ -79,6 +173,60 @@ APP_INFO.info({
 })
 
 
+class HttpPoolCollector:
+    """Reports connection pool usage of the shared HTTP clients at scrape time."""
+
+    def __init__(self, stats_fn: Callable[[], Dict[str, Dict[str, int]]]):
+        self.stats_fn = stats_fn
+
+    def collect(self):
+        connections = GaugeMetricFamily(
+            'http_client_pool_connections',
+            'Pooled outgoing HTTP connections by state',
+            labels=['client', 'state']
+        )
+        waiting = GaugeMetricFamily(
+            'http_client_pool_waiting_requests',
+            'Outgoing requests currently waiting for a pooled connection',
+            labels=['client']
+        )
+        for client, stats in self.stats_fn().items():
+            connections.add_metric([client, 'active'], stats['active'])
+            connections.add_metric([client, 'idle'], stats['idle'])
+            waiting.add_metric([client], stats['waiting'])
+        yield connections
+        yield waiting
+
+
+class StageTimer:
+    """
+    Times consecutive pipeline stages; each lap() closes the stage that just ran.
+    Stages that run concurrently are timed separately with measure(), so their
+    timings overlap with each other and with the lap() that encloses them.
+    """
+
+    def __init__(self):
+        self.timings_ms: Dict[str, int] = {}
+        self._last = time.perf_counter()
+
+    def _observe(self, stage: str, elapsed: float):
+        self.timings_ms[stage] = round(elapsed * 1000)
+        PIPELINE_STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        elapsed, self._last = now - self._last, now
+        self._observe(stage, elapsed)
+
+    async def measure(self, stage: str, awaitable):
+        """Await awaitable and record its own duration as stage; lap() timing is unaffected."""
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self._observe(stage, time.perf_counter() - started)
+
+
 class MetricsMiddleware(BaseHTTPMiddleware):
     """Middleware to collect request metrics."""
     
@@ -151,6 +299,13 @@ def log_invoice_processing(
         INVOICE_PROCESSED.labels(status="failure", llm_provider=llm_provider, file_type=file_type).inc()
 
 
+def record_prompt_cache(llm_provider: str, cached_tokens: int, prefill_seconds_saved: float = None):
+    """Record whether a request reused a cached prompt prefix."""
+    PROMPT_CACHE_REQUESTS.labels(llm_provider=llm_provider, result="hit" if cached_tokens else "miss").inc()
+    if prefill_seconds_saved:
+        PREFILL_SECONDS_SAVED.labels(llm_provider=llm_provider).inc(prefill_seconds_saved)
+
+
 def log_auth_attempt(method: str, success: bool, user_id: str = None, reason: str = None):
     """Log authentication attempt."""
     extra = {"method": method, "success": success}
@@ -0,0 +1,231 @@
+import os
+import io
+import asyncio
+import math
+import base64
+import mimetypes
+from dataclasses import dataclass
+from typing import List, Optional, Union
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+
+@dataclass
+class PageImage:
+    """Encoded page image kept in memory and passed straight to the LLM providers."""
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    page_index: Optional[int] = None
+    dpi: Optional[int] = None
+
+    @classmethod
+    def from_path(cls, path: str) -> "PageImage":
+        """Load an image file (e.g. a direct image upload)."""
+        with open(path, "rb") as f:
+            data = f.read()
+        with Image.open(path) as img:
+            width, height = img.size
+        mime_type = mimetypes.guess_type(path)[0] or "image/png"
+        return cls(data=data, mime_type=mime_type, width=width, height=height)
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+    def to_data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.to_base64()}"
+
+
+# Providers accept in-memory pages alongside plain file paths
+ImageInput = Union[str, PageImage]
+
+
+def load_page_image(image: ImageInput) -> PageImage:
+    """Normalize a file path or PageImage to a PageImage."""
+    if isinstance(image, PageImage):
+        return image
+    return PageImage.from_path(image)
+
+
+async def load_page_image_async(image: ImageInput) -> PageImage:
+    """load_page_image that reads image files in a thread instead of on the event loop."""
+    if isinstance(image, PageImage):
+        return image
+    return await asyncio.to_thread(PageImage.from_path, image)
+
+
+@dataclass
+class ImageEncodingPolicy:
+    """How rendered pages are encoded before they are sent to the LLM."""
+    format: str = "png"  # png, jpeg or webp
+    quality: int = 85  # jpeg/webp only
+    grayscale: bool = False
+    palette_colors: int = 0  # >0 quantizes png/webp to this many colours
+
+    MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+    def __post_init__(self):
+        self.format = self.format.lower().replace("jpg", "jpeg")
+        if self.format not in self.MIME_TYPES:
+            raise ValueError(f"Unsupported page image format: {self.format}")
+
+    @classmethod
+    def from_env(cls) -> "ImageEncodingPolicy":
+        return cls(
+            format=os.getenv("PAGE_IMAGE_FORMAT", "png"),
+            quality=int(os.getenv("PAGE_IMAGE_QUALITY", "85")),
+            grayscale=os.getenv("PAGE_IMAGE_GRAYSCALE", "false").lower() in ("1", "true", "yes"),
+            palette_colors=int(os.getenv("PAGE_IMAGE_PALETTE_COLORS", "0")),
+        )
+
+    @property
+    def colorspace(self):
+        """Render grayscale pages directly instead of converting afterwards."""
+        return fitz.csGRAY if self.grayscale else fitz.csRGB
+
+    def encode(self, pix: "fitz.Pixmap", page_index: Optional[int] = None, dpi: Optional[int] = None) -> PageImage:
+        """Encode a rendered pixmap according to this policy."""
+        if self.format == "png" and not self.palette_colors:
+            data = pix.tobytes("png")
+        else:
+            mode = "L" if pix.n == 1 else "RGB"
+            img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+            if self.palette_colors and self.format != "jpeg":
+                img = img.quantize(colors=self.palette_colors)
+
+            buffer = io.BytesIO()
+            if self.format == "png":
+                img.save(buffer, format="PNG", optimize=True)
+            else:
+                img.save(buffer, format=self.format.upper(), quality=self.quality)
+            data = buffer.getvalue()
+
+        return PageImage(
+            data=data,
+            mime_type=self.MIME_TYPES[self.format],
+            width=pix.width,
+            height=pix.height,
+            page_index=page_index,
+            dpi=dpi,
+        )
+
+
+@dataclass
+class RenderScalePolicy:
+    """
+    Picks a render scale per page: small fonts are scaled up until they reach
+    target_font_px, and the result is capped so the page stays within max_pixels.
+    """
+    default_scale: float = 1.5
+    adaptive: bool = True
+    target_font_px: float = 14.0
+    min_scale: float = 1.0
+    max_scale: float = 3.0
+    max_pixels: int = 2_500_000
+
+    @classmethod
+    def from_env(cls) -> "RenderScalePolicy":
+        return cls(
+            default_scale=float(os.getenv("PDF_DPI_SCALE", "1.5")),
+            adaptive=os.getenv("PDF_ADAPTIVE_DPI", "true").lower() in ("1", "true", "yes"),
+            target_font_px=float(os.getenv("PDF_TARGET_FONT_PX", "14")),
+            min_scale=float(os.getenv("PDF_MIN_DPI_SCALE", "1.0")),
+            max_scale=float(os.getenv("PDF_MAX_DPI_SCALE", "3.0")),
+            max_pixels=int(os.getenv("PDF_MAX_PIXELS", "2500000")),
+        )
+
+    @staticmethod
+    def small_font_size(page: "fitz.Page") -> Optional[float]:
+        """10th percentile of the text-layer font sizes, ignoring sub-3pt noise."""
+        sizes = sorted(
+            span["size"]
+            for block in page.get_text("dict")["blocks"]
+            for line in block.get("lines", [])
+            for span in line["spans"]
+            if span["text"].strip() and span["size"] >= 3
+        )
+        if not sizes:
+            return None
+        return sizes[int(len(sizes) * 0.1)]
+
+    def scale_for(self, page: "fitz.Page") -> float:
+        if not self.adaptive:
+            return self.default_scale
+
+        font_size = self.small_font_size(page)
+        # Scanned pages have no fonts to go by
+        scale = self.target_font_px / font_size if font_size else self.default_scale
+        scale = min(max(scale, self.min_scale), self.max_scale)
+
+        # The pixel budget wins over min_scale so oversized pages stay affordable
+        area = page.rect.width * page.rect.height
+        if area > 0:
+            scale = min(scale, math.sqrt(self.max_pixels / area))
+        return round(scale, 3)
+
+
+def estimate_image_tokens(page: PageImage, patch_px: int = 28) -> int:
+    """Vision tokens for an image, assuming one token per patch_px x patch_px tile (Qwen-VL style)."""
+    return math.ceil(page.width / patch_px) * math.ceil(page.height / patch_px)
+
+
+class PagePacker:
+    """
+    Packs consecutive pages into multi-image requests of at most max_images
+    images and token_budget estimated tokens. The first (header) page is
+    repeated at the start of every later group so general fields stay visible.
+    Pages must be added in page order; full groups are returned as soon as
+    they are known so requests can start while later pages still render.
+    """
+
+    def __init__(self, max_images: int, token_budget: int, patch_px: int = 28):
+        self.max_images = max(1, max_images)
+        self.token_budget = token_budget
+        self.patch_px = patch_px
+        self.header: Optional[PageImage] = None
+        self.current: List[PageImage] = []
+        self.body_pages = 0  # pages in the current group other than a repeated header
+
+    def _tokens(self, pages: List[PageImage]) -> int:
+        return sum(estimate_image_tokens(page, self.patch_px) for page in pages)
+
+    def _fits(self, page: PageImage) -> bool:
+        if len(self.current) + 1 > self.max_images:
+            return False
+        return self._tokens(self.current + [page]) <= self.token_budget
+
+    def add(self, page: PageImage) -> List[List[PageImage]]:
+        """Add the next page; returns the groups that became full."""
+        if self.header is None:
+            self.header = page
+            self.current = [page]
+            self.body_pages = 1
+            return []
+
+        ready = []
+        if self.body_pages and not self._fits(page):
+            ready.append(self.current)
+            # Repeat the header only when it leaves room for another page
+            self.current = [self.header] if self.max_images > 1 else []
+            self.body_pages = 0
+        self.current.append(page)
+        self.body_pages += 1
+        return ready
+
+    def flush(self) -> List[List[PageImage]]:
+        """Return the final, partially filled group."""
+        groups = [self.current] if self.body_pages else []
+        self.current = []
+        self.body_pages = 0
+        return groups
+
+
+def pack_pages(pages: List[PageImage], max_images: int, token_budget: int, patch_px: int = 28) -> List[List[PageImage]]:
+    """Pack a complete, page-ordered list of pages into request groups."""
+    packer = PagePacker(max_images, token_budget, patch_px)
+    groups = []
+    for page in pages:
+        groups.extend(packer.add(page))
+    return groups + packer.flush()
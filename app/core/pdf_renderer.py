@@ -0,0 +1,189 @@
+import os
+import re
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import fitz  # PyMuPDF
+
+from app.core.page_images import PageImage, ImageEncodingPolicy, RenderScalePolicy
+
+logger = logging.getLogger(__name__)
+
+# Text separated by two or more spaces inside one span is a separate cell (columns typed with spaces)
+CELL_RE = re.compile(r"\S+(?: \S+)*")
+
+
+# ===== Worker functions (module level so they can be pickled into the pool) =====
+
+def extract_page_texts(file_path: str) -> List[str]:
+    """Extract the text layer of each page."""
+    doc = fitz.open(file_path)
+    try:
+        return [page.get_text() for page in doc]
+    finally:
+        doc.close()
+
+
+def page_layout(page: "fitz.Page") -> Dict[str, Any]:
+    """
+    Text cells of a page grouped into visual rows (top to bottom, cells left to
+    right). Spans that touch are one cell, so a value and its currency sign in
+    another font stay together.
+    """
+    cells = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            merged = []
+            for span in line["spans"]:
+                if not span["text"].strip():
+                    continue
+                x0, y0, x1, y1 = span["bbox"]
+                if merged and x0 - merged[-1]["x1"] < span["size"] * 0.15:
+                    merged[-1].update(text=merged[-1]["text"] + span["text"], x1=x1)
+                else:
+                    merged.append({"text": span["text"], "x0": x0, "x1": x1, "y": (y0 + y1) / 2, "h": y1 - y0})
+            for span in merged:
+                char_width = (span["x1"] - span["x0"]) / max(len(span["text"]), 1)
+                for match in CELL_RE.finditer(span["text"]):
+                    cells.append({
+                        "text": match.group(),
+                        "x0": round(span["x0"] + match.start() * char_width, 1),
+                        "x1": round(span["x0"] + match.end() * char_width, 1),
+                        "y": span["y"],
+                        "h": span["h"],
+                    })
+
+    rows: List[Dict[str, Any]] = []
+    for cell in sorted(cells, key=lambda cell: cell["y"]):
+        if rows and abs(cell["y"] - rows[-1]["y"]) <= min(cell["h"], rows[-1]["h"]) / 2:
+            rows[-1]["cells"].append(cell)
+        else:
+            rows.append({"y": round(cell["y"], 1), "h": cell["h"], "cells": [cell]})
+    return {
+        "width": page.rect.width,
+        "height": page.rect.height,
+        "rows": [
+            {"y": row["y"], "cells": [
+                {"text": cell["text"], "x0": cell["x0"], "x1": cell["x1"]}
+                for cell in sorted(row["cells"], key=lambda cell: cell["x0"])
+            ]}
+            for row in rows
+        ],
+    }
+
+
+def extract_page_layouts(file_path: str, max_pages: int) -> List[Dict[str, Any]]:
+    """Row and cell layout of the first max_pages pages (see page_layout)."""
+    doc = fitz.open(file_path)
+    try:
+        return [page_layout(doc.load_page(i)) for i in range(min(len(doc), max_pages))]
+    finally:
+        doc.close()
+
+
+def count_pages(file_path: str) -> int:
+    """Page count without touching page content."""
+    doc = fitz.open(file_path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def render_page(
+    page: "fitz.Page",
+    image_policy: ImageEncodingPolicy,
+    scale_policy: RenderScalePolicy
+) -> PageImage:
+    """Render one page with the given scale and encoding policies."""
+    scale = scale_policy.scale_for(page)
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=image_policy.colorspace)
+    return image_policy.encode(pix, page_index=page.number, dpi=round(72 * scale))
+
+
+def render_page_from_file(
+    file_path: str,
+    page_index: int,
+    image_policy: ImageEncodingPolicy,
+    scale_policy: RenderScalePolicy
+) -> PageImage:
+    doc = fitz.open(file_path)
+    try:
+        return render_page(doc.load_page(page_index), image_policy, scale_policy)
+    finally:
+        doc.close()
+
+
+# ===== Pool =====
+
+class PdfRenderPool:
+    """
+    Runs PyMuPDF work off the event loop. MuPDF is not thread-safe, so pages
+    are rendered in parallel in a process pool; where a process pool cannot be
+    created (e.g. inside daemonic Celery prefork children) a single background
+    thread is used instead.
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("PDF_RENDER_POOL", "process").lower()  # process, thread or inline
+        self.workers = int(os.getenv("PDF_RENDER_WORKERS", str(os.cpu_count() or 2)))
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Optional[Executor]:
+        if self.mode == "inline":
+            return None
+        if self._executor is None:
+            if self.mode == "process" and not multiprocessing.current_process().daemon:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                if self.mode == "process":
+                    logger.warning("Process pool unavailable in a daemonic process; rendering on one thread")
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-render")
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Run a worker function in the pool (inline when the pool is disabled)."""
+        executor = self._get_executor()
+        if executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(fn, *args))
+
+    async def extract_page_texts(self, file_path: str) -> List[str]:
+        return await self.run(extract_page_texts, file_path)
+
+    async def extract_page_layouts(self, file_path: str, max_pages: int) -> List[Dict[str, Any]]:
+        return await self.run(extract_page_layouts, file_path, max_pages)
+
+    async def count_pages(self, file_path: str) -> int:
+        return await self.run(count_pages, file_path)
+
+    async def iter_pages(
+        self,
+        file_path: str,
+        page_indexes: List[int],
+        image_policy: ImageEncodingPolicy,
+        scale_policy: RenderScalePolicy
+    ) -> AsyncIterator[PageImage]:
+        """Render pages in parallel and yield them in page order as soon as each is ready."""
+        tasks = [
+            asyncio.ensure_future(self.run(render_page_from_file, file_path, i, image_policy, scale_policy))
+            for i in page_indexes
+        ]
+        try:
+            for task in tasks:
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
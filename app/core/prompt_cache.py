@@ -0,0 +1,89 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# Extend a cache once less than this share of its TTL is left
+REFRESH_FRACTION = 0.2
+
+
+class GeminiPromptCache:
+    """
+    Explicit Gemini context cache holding the static system prompt, one cache
+    per (model, prompt). The handle is reused until close to expiry, then its
+    TTL is extended. Prompts below the model's minimum cacheable size are
+    rejected by the API; those are remembered for one TTL and sent as a plain
+    system_instruction instead, which still gets implicit prefix caching.
+    """
+
+    def __init__(self, client, model_name: str):
+        self.client = client
+        self.model_name = model_name
+        self.enabled = os.getenv("GEMINI_PROMPT_CACHE", "true").lower() in ("1", "true", "yes")
+        self.ttl_seconds = int(os.getenv("GEMINI_PROMPT_CACHE_TTL_SECONDS", "3600"))
+        self._entries: Dict[str, Tuple[str, float]] = {}  # key -> (cache name, expires at)
+        self._unavailable_until: Dict[str, float] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def _key(self, system_prompt: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\n{system_prompt}".encode("utf-8")).hexdigest()
+
+    async def get(self, system_prompt: str) -> Optional[str]:
+        """Name of a live cached content for this prompt, or None to send it inline."""
+        if not self.enabled:
+            return None
+        key = self._key(system_prompt)
+        if self._unavailable_until.get(key, 0) > time.monotonic():
+            return None
+
+        async with self._get_lock():
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            if entry and entry[1] - now > self.ttl_seconds * REFRESH_FRACTION:
+                return entry[0]
+
+            ttl = f"{self.ttl_seconds}s"
+            try:
+                if entry and entry[1] > now:
+                    await self.client.aio.caches.update(
+                        name=entry[0], config=types.UpdateCachedContentConfig(ttl=ttl)
+                    )
+                    name = entry[0]
+                else:
+                    cached = await self.client.aio.caches.create(
+                        model=self.model_name,
+                        config=types.CreateCachedContentConfig(
+                            system_instruction=system_prompt,
+                            ttl=ttl,
+                            display_name="invoice-system-prompt",
+                        ),
+                    )
+                    name = cached.name
+            except Exception as e:
+                logger.info(f"Gemini prompt cache unavailable, sending the system prompt inline: {e}")
+                self._entries.pop(key, None)
+                self._unavailable_until[key] = now + self.ttl_seconds
+                return None
+
+            self._entries[key] = (name, now + self.ttl_seconds)
+            return name
+
+    def invalidate(self, name: str):
+        """Forget a handle the API no longer accepts (expired or deleted)."""
+        for key, entry in list(self._entries.items()):
+            if entry[0] == name:
+                del self._entries[key]
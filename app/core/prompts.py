@@ -1,3 +1,6 @@
+# Bump on any change to the prompts or schema below; cached extractions are keyed by it.
+PROMPT_VERSION = "1.2.0"
+
 SYSTEM_PROMPT = """
 You are an expert Invoice Data Extraction Agent. Your goal is to extract structured information from the provided invoice text or OCR output.
 
@@ -57,3 +60,88 @@ Input JSONs:
 
 Output a single merged JSON following the standard schema.
 """
+
+COMPACT_ITEMS_PROMPT = """
+Compact item format: do NOT return "items". Return "item_rows" instead, with one
+array per line item holding the values in exactly this column order:
+["product_name", "quantity", "unit_price", "total_price", "description"]
+Example: "item_rows": [["Diesel", 40, 42.5, 1700, null], ["Car wash", 1, 150, 150, "Exterior"]]
+"""
+
+# Machine-readable version of the schema above, passed to providers that support
+# constrained decoding. Items mirror InvoiceItemInDB; id and is_arithmetic_valid
+# are filled in server-side.
+INVOICE_JSON_SCHEMA = {
+    "title": "invoice",
+    "type": "object",
+    "properties": {
+        "general_fields": {
+            "type": "object",
+            "properties": {
+                "invoice_number": {"type": ["string", "null"]},
+                "date": {"type": ["string", "null"]},
+                "supplier_name": {"type": ["string", "null"]},
+                "total_amount": {"type": ["number", "null"]},
+                "currency": {"type": ["string", "null"]},
+                "tax_amount": {"type": ["number", "null"]},
+                "tax_rate": {"type": ["number", "null"]},
+                "category": {
+                    "type": "string",
+                    "enum": ["Fuel", "Food", "Technology", "Logistics", "Services", "Stationery", "General"]
+                },
+            },
+            "required": [
+                "invoice_number", "date", "supplier_name", "total_amount",
+                "currency", "tax_amount", "tax_rate", "category"
+            ],
+            "additionalProperties": False,
+        },
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "product_name": {"type": ["string", "null"]},
+                    "quantity": {"type": ["number", "null"]},
+                    "unit_price": {"type": ["number", "null"]},
+                    "total_price": {"type": ["number", "null"]},
+                    "description": {"type": ["string", "null"]},
+                },
+                "required": ["product_name", "quantity", "unit_price", "total_price", "description"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["general_fields", "items"],
+    "additionalProperties": False,
+}
+
+# Column order of the compact item_rows format
+ITEM_COLUMNS = list(INVOICE_JSON_SCHEMA["properties"]["items"]["items"]["properties"])
+
+# Same invoice with items as positional rows, so key names are not generated per item
+INVOICE_ROWS_JSON_SCHEMA = {
+    "title": "invoice_rows",
+    "type": "object",
+    "properties": {
+        "general_fields": INVOICE_JSON_SCHEMA["properties"]["general_fields"],
+        "item_rows": {
+            "type": "array",
+            "items": {
+                "type": "array",
+                "items": {"type": ["string", "number", "null"]},
+                "minItems": len(ITEM_COLUMNS),
+                "maxItems": len(ITEM_COLUMNS),
+            },
+        },
+    },
+    "required": ["general_fields", "item_rows"],
+    "additionalProperties": False,
+}
+
+
+def build_system_prompt(response_schema=None) -> str:
+    """System prompt for a request; the compact item format adds its own instructions."""
+    if response_schema and "item_rows" in response_schema.get("properties", {}):
+        return SYSTEM_PROMPT + COMPACT_ITEMS_PROMPT
+    return SYSTEM_PROMPT
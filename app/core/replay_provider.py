@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.core.extraction_engine import LLMProvider
+from app.core.json_stream import JsonStreamConsumer, ProgressCallback
+from app.core.page_images import ImageInput, PageImage, load_page_image_async
+
+MANIFEST_FILE = "manifest.json"
+# Provider settings that change the requests the engine makes; replay must use the recorded ones
+MANIFEST_SETTINGS = ("name", "model_name", "items_format", "pdf_mode")
+REPLAY_CHUNK_CHARS = 64
+
+
+async def request_key(
+    method: str,
+    content: str,
+    images: Optional[List[ImageInput]] = None,
+    response_schema: Optional[Dict[str, Any]] = None,
+    document: Optional[bytes] = None
+) -> str:
+    """Hash of everything that determines the model's answer to a request."""
+    digest = hashlib.sha256()
+    for part in (method, content, json.dumps(response_schema, sort_keys=True)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    for image in images or []:
+        digest.update((await load_page_image_async(image)).data)
+    if document is not None:
+        digest.update(document)
+    return digest.hexdigest()
+
+
+class RecordingProvider(LLMProvider):
+    """
+    Wraps a real provider and writes every response to directory, keyed by
+    request_key, for ReplayProvider. Settings the engine reads (items_format,
+    pdf_mode, ...) are passed through, so recording does not change requests.
+    """
+
+    def __init__(self, provider: LLMProvider, directory: str):
+        self.provider = provider
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        manifest = {key: getattr(provider, key, None) for key in MANIFEST_SETTINGS}
+        (self.directory / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    def __getattr__(self, item):
+        if item == "provider":
+            raise AttributeError(item)
+        return getattr(self.provider, item)
+
+    @property
+    def name(self) -> str:
+        return self.provider.name
+
+    async def _record(self, key: str, call) -> str:
+        started = time.perf_counter()
+        response = await call
+        entry = {
+            "response": response,
+            "latency_s": round(time.perf_counter() - started, 3),
+            "recorded_at": datetime.utcnow().isoformat(),
+        }
+        path = self.directory / f"{key}.json"
+        await asyncio.to_thread(path.write_text, json.dumps(entry, ensure_ascii=False), "utf-8")
+        return response
+
+    async def generate_json(
+        self,
+        content: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        key = await request_key("generate_json", content, image_paths, response_schema)
+        return await self._record(key, self.provider.generate_json(
+            content, image_paths=image_paths, on_progress=on_progress, response_schema=response_schema
+        ))
+
+    async def generate_json_from_pages(
+        self,
+        content: str,
+        pages: AsyncIterator[PageImage],
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        collected = sorted([page async for page in pages], key=lambda page: page.page_index)
+        key = await request_key("generate_json", content, collected, response_schema)
+
+        async def replay_pages():
+            for page in collected:
+                yield page
+
+        return await self._record(key, self.provider.generate_json_from_pages(
+            content, replay_pages(), on_progress=on_progress, response_schema=response_schema
+        ))
+
+    async def generate_json_from_pdf(
+        self,
+        content: str,
+        file_path: str,
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        document = await asyncio.to_thread(Path(file_path).read_bytes)
+        key = await request_key("generate_json_from_pdf", content, None, response_schema, document)
+        return await self._record(key, self.provider.generate_json_from_pdf(
+            content, file_path, on_progress=on_progress, response_schema=response_schema
+        ))
+
+
+class ReplayProvider(LLMProvider):
+    """
+    Serves responses written by RecordingProvider instead of calling a model,
+    so the whole pipeline can be exercised offline. Pages are looked up as one
+    request, like RecordingProvider stores them. With LLM_REPLAY_LATENCY=recorded
+    each response is delayed by the latency it was recorded with.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        manifest_path = self.directory / MANIFEST_FILE
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8")) if manifest_path.exists() else {}
+        self.name = manifest.get("name") or "replay"
+        self.model_name = manifest.get("model_name")
+        self.items_format = manifest.get("items_format") or "objects"
+        self.pdf_mode = manifest.get("pdf_mode") or "images"
+        self.latency_mode = os.getenv("LLM_REPLAY_LATENCY", "none")  # none or recorded
+        self.streaming = os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+
+    async def _replay(self, key: str, on_progress: Optional[ProgressCallback]) -> str:
+        path = self.directory / f"{key}.json"
+        try:
+            entry = json.loads(await asyncio.to_thread(path.read_text, "utf-8"))
+        except FileNotFoundError:
+            raise LookupError(f"No recorded LLM response for request {key[:12]} in {self.directory}")
+
+        if self.latency_mode == "recorded":
+            await asyncio.sleep(entry.get("latency_s", 0))
+        response = entry["response"]
+        if not self.streaming:
+            return response
+
+        # Replay through the stream consumer so progress reporting and stream metrics are exercised
+        consumer = JsonStreamConsumer("replay", on_progress)
+        for start in range(0, len(response), REPLAY_CHUNK_CHARS):
+            if not await consumer.feed(response[start:start + REPLAY_CHUNK_CHARS]):
+                break
+        # An aborted stream is asked again without streaming, which replays the whole response
+        text = consumer.finish()
+        return response if text is None else text
+
+    async def generate_json(
+        self,
+        content: str,
+        image_paths: Optional[List[ImageInput]] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        key = await request_key("generate_json", content, image_paths, response_schema)
+        return await self._replay(key, on_progress)
+
+    async def generate_json_from_pdf(
+        self,
+        content: str,
+        file_path: str,
+        on_progress: Optional[ProgressCallback] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        document = await asyncio.to_thread(Path(file_path).read_bytes)
+        key = await request_key("generate_json_from_pdf", content, None, response_schema, document)
+        return await self._replay(key, on_progress)
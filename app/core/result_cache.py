@@ -0,0 +1,111 @@
+import os
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from app.core.prompts import PROMPT_VERSION
+from app.core.metrics import EXTRACTION_CACHE_HITS, EXTRACTION_CACHE_MISSES
+from app.database.connection import get_extraction_cache_collection
+
+logger = logging.getLogger(__name__)
+
+
+# Only the extraction output is cached; validation, conversion and review depend on
+# the invoice date, the supplier's history and the current rates and are redone on a hit
+CACHED_FIELDS = ("general_fields", "items", "_metadata")
+
+
+class ExtractionCache:
+    """Content-addressed cache of LLM extraction outputs stored in MongoDB."""
+
+    def __init__(self):
+        self.enabled = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.ttl_seconds = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+        self.max_entries = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "10000"))
+
+    @staticmethod
+    def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+        """SHA-256 of the raw file bytes."""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def build_key(content_hash: str, provider: str, model: Optional[str]) -> str:
+        """Cache key: same bytes, same provider/model, same prompt version."""
+        return f"{content_hash}:{provider}:{model or '-'}:{PROMPT_VERSION}"
+
+    async def lookup(self, content_hash: str, provider: str, model: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for this content and refresh its LRU timestamp."""
+        if not self.enabled:
+            return None
+
+        cache_col = get_extraction_cache_collection()
+        now = datetime.utcnow()
+        entry = await cache_col.find_one_and_update(
+            {
+                "_id": self.build_key(content_hash, provider, model),
+                "last_used_at": {"$gte": now - timedelta(seconds=self.ttl_seconds)},
+            },
+            {"$set": {"last_used_at": now}, "$inc": {"hits": 1}},
+        )
+
+        if entry is None:
+            EXTRACTION_CACHE_MISSES.labels(llm_provider=provider).inc()
+            return None
+
+        EXTRACTION_CACHE_HITS.labels(llm_provider=provider).inc()
+        return entry
+
+    async def store(
+        self,
+        content_hash: str,
+        provider: str,
+        model: Optional[str],
+        result: Dict[str, Any],
+        invoice_id: str
+    ):
+        """Store the extraction output of a result and evict least recently used entries."""
+        if not self.enabled:
+            return
+        # Pages that failed to extract should be tried again on the next upload, not replayed
+        if (result.get("_metadata") or {}).get("failed_pages"):
+            return
+
+        cache_col = get_extraction_cache_collection()
+        now = datetime.utcnow()
+        cached = {k: result[k] for k in CACHED_FIELDS if k in result}
+
+        await cache_col.update_one(
+            {"_id": self.build_key(content_hash, provider, model)},
+            {
+                "$set": {
+                    "content_hash": content_hash,
+                    "provider": provider,
+                    "model": model,
+                    "prompt_version": PROMPT_VERSION,
+                    "result": cached,
+                    "invoice_id": invoice_id,
+                    "last_used_at": now,
+                },
+                "$setOnInsert": {"created_at": now, "hits": 0},
+            },
+            upsert=True,
+        )
+        await self._evict()
+
+    async def _evict(self):
+        """Drop the least recently used entries above max_entries."""
+        cache_col = get_extraction_cache_collection()
+        overflow = await cache_col.estimated_document_count() - self.max_entries
+        if overflow <= 0:
+            return
+
+        cursor = cache_col.find({}, {"_id": 1}).sort("last_used_at", 1).limit(overflow)
+        stale_ids = [doc["_id"] async for doc in cursor]
+        if stale_ids:
+            await cache_col.delete_many({"_id": {"$in": stale_ids}})
+            logger.info(f"Evicted {len(stale_ids)} extraction cache entries")
@@ -0,0 +1,540 @@
+import os
+import re
+import logging
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pymongo import ReturnDocument
+
+from app.core.metrics import SUPPLIER_TEMPLATE_EXTRACTIONS
+from app.core.pdf_renderer import extract_page_layouts
+from app.core.validators import DataValidator, clean_number, parse_date
+from app.database.connection import get_supplier_templates_collection
+
+logger = logging.getLogger(__name__)
+
+NUMBER_RE = re.compile(r"\d[\d.,]*\d|\d")
+# Stands for any number in a masked label ('#' itself is common in invoice text)
+NUMBER_MARK = "{#}"
+LETTER_RE = re.compile(r"[^\W\d_]")
+# General fields read from the text next to a learned label, and how their value is parsed
+FIELD_KINDS = {
+    "invoice_number": "text",
+    "date": "text",
+    "total_amount": "number",
+    "tax_amount": "number",
+    "tax_rate": "number",
+}
+# Fields that are the same on every invoice of a supplier (or not printed as such, like the category)
+CONSTANT_FIELDS = ("supplier_name", "currency", "category")
+ITEM_NUMBER_FIELDS = ("quantity", "unit_price", "total_price")
+# Punctuation around a value that the model tends to drop (e.g. '#1234567' -> '1234567')
+STRIP_CHARS = "#:;,-"
+# Fewer shared layout keys than this is too little to recognise a layout by
+MIN_LAYOUT_KEYS = 5
+
+
+# ===== Layout helpers =====
+
+def mask(text: str) -> str:
+    """Text with every number replaced by NUMBER_MARK, so labels compare across invoices."""
+    return " ".join(NUMBER_RE.sub(NUMBER_MARK, text).split())
+
+
+def norm(value: Any) -> str:
+    return " ".join(str(value).split()).casefold()
+
+
+def has_letters(text: str) -> bool:
+    return LETTER_RE.search(text) is not None
+
+
+def parse_amount(token: str, decimal: str) -> Optional[float]:
+    """Parse a printed number with the template's decimal separator ('1.500,00' or '1,500.00')."""
+    if decimal == ".":
+        s = token.replace(",", "")
+    else:
+        s = token.replace(".", "").replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def first_amount(text: Optional[str], decimal: str) -> Optional[float]:
+    match = NUMBER_RE.search(text or "")
+    return parse_amount(match.group(), decimal) if match else None
+
+
+@lru_cache(maxsize=1024)
+def label_regex(label: str, same_cell: bool) -> "re.Pattern":
+    """Regex for a masked label: NUMBER_MARK matches any number and spaces any whitespace."""
+    pattern = NUMBER_RE.pattern.join(
+        r"\s+".join(re.escape(word) for word in part.split(" ")) for part in label.split(NUMBER_MARK)
+    )
+    return re.compile(rf"^{pattern}\s*(?P<value>.+)$" if same_cell else rf"^{pattern}$")
+
+
+def layout_keys(layout: List[Dict[str, Any]]) -> Set[str]:
+    """Labels of the first page with their horizontal position, the layout's fingerprint."""
+    if not layout:
+        return set()
+    page = layout[0]
+    return {
+        f"{int(cell['x0'] / page['width'] * 50)}:{mask(cell['text'])}"
+        for row in page["rows"] for cell in row["cells"]
+        if has_letters(cell["text"])
+    }
+
+
+def row_signature(row: Dict[str, Any]) -> str:
+    return " | ".join(mask(cell["text"]) for cell in row["cells"])
+
+
+def _overlap(cell: Dict[str, Any], x0: float, x1: float) -> float:
+    return min(cell["x1"], x1) - max(cell["x0"], x0)
+
+
+# ===== Reading with a template =====
+
+def read_field(layout: List[Dict[str, Any]], anchor: Dict[str, Any], kind: str, decimal: str) -> Any:
+    """Value of a general field: the text after, right of or below its label."""
+    same_cell = anchor["where"] == "same_cell"
+    regex = label_regex(anchor["label"], same_cell)
+    values = []
+    for page in layout:
+        rows = page["rows"]
+        for r, row in enumerate(rows):
+            for c, cell in enumerate(row["cells"]):
+                match = regex.match(cell["text"])
+                if not match:
+                    continue
+                if same_cell:
+                    raw = match.group("value")
+                elif anchor["where"] == "right":
+                    raw = row["cells"][c + 1]["text"] if c + 1 < len(row["cells"]) else None
+                else:
+                    below = rows[r + 1]["cells"] if r + 1 < len(rows) else []
+                    raw = next((other["text"] for other in below if _overlap(other, cell["x0"], cell["x1"]) > 0), None)
+                value = parse_value(raw, kind, anchor, decimal)
+                if value is not None:
+                    values.append(value)
+    if not values or anchor["occurrence"] >= len(values):
+        return None
+    return values[anchor["occurrence"]]
+
+
+def parse_value(raw: Optional[str], kind: str, anchor: Dict[str, Any], decimal: str) -> Any:
+    if not raw:
+        return None
+    if kind == "number":
+        return first_amount(raw, decimal)
+    value = " ".join(raw.split()[:anchor["tokens"]])
+    if anchor.get("strip"):
+        value = value.strip(STRIP_CHARS).strip()
+    return value or None
+
+
+def assign_columns(row: Dict[str, Any], columns: Dict[str, List[float]]) -> Dict[str, str]:
+    """Text of a table row by column; each cell goes to the column it overlaps most."""
+    values: Dict[str, str] = {}
+    for cell in row["cells"]:
+        overlaps = [(_overlap(cell, x0, x1), field) for field, (x0, x1) in columns.items()]
+        best, field = max(overlaps, default=(0, None))
+        if best > 0:
+            values[field] = f"{values[field]} {cell['text']}" if field in values else cell["text"]
+    return values
+
+
+def read_items(layout: List[Dict[str, Any]], table: Dict[str, Any], decimal: str) -> Optional[List[Dict[str, Any]]]:
+    """Line items between the table header row and the end row; None if the table is not found whole."""
+    items: List[Dict[str, Any]] = []
+    in_table = False
+    for page in layout:
+        rows = page["rows"]
+        # A page that repeats the header continues the table below it; one without continues from the top
+        header_at = next((i for i, row in enumerate(rows) if row_signature(row) == table["header"]), None)
+        if header_at is not None:
+            in_table, rows = True, rows[header_at + 1:]
+        elif not in_table:
+            continue
+        for row in rows:
+            if table["end"] is not None and mask(row["cells"][0]["text"]) == table["end"]:
+                return items
+            values = assign_columns(row, table["columns"])
+            total = first_amount(values.get("total_price"), decimal)
+            if total is not None:
+                items.append({
+                    "product_name": values.get("product_name"),
+                    "quantity": first_amount(values.get("quantity"), decimal),
+                    "unit_price": first_amount(values.get("unit_price"), decimal),
+                    "total_price": total,
+                    "description": None,
+                })
+            elif items and set(values) == {"product_name"}:
+                # Product name wrapped onto the next line
+                items[-1]["product_name"] = f"{items[-1]['product_name'] or ''} {values['product_name']}".strip()
+    return items if in_table and table["end"] is None else None
+
+
+# ===== Learning from a verified extraction =====
+
+def _same_value(value: Any, expected: Any, kind: str, field: str) -> bool:
+    if value is None:
+        return False
+    if kind == "number":
+        return abs(value - expected) < 0.005
+    if norm(value) == norm(expected):
+        return True
+    return field == "date" and parse_date(value) is not None and parse_date(value) == parse_date(expected)
+
+
+def _anchor_candidates(layout: List[Dict[str, Any]], field: str, expected: Any, decimal: str):
+    """
+    (rank, anchor) for the labels next to each place the expected value is
+    printed; a lower rank means the value is alone in its text (a '20' inside
+    a date is a worse tax rate than the one in 'KDV (%20)').
+    """
+    kind = FIELD_KINDS[field]
+    needle = norm(expected).strip(STRIP_CHARS) if kind == "text" else None
+    expected_date = parse_date(expected) if field == "date" else None
+    for page in layout:
+        rows = page["rows"]
+        for r, row in enumerate(rows):
+            for c, cell in enumerate(row["cells"]):
+                text = cell["text"]
+                tokens = 1
+                if kind == "number":
+                    starts = [m.start() for m in NUMBER_RE.finditer(text)
+                              if _same_value(parse_amount(m.group(), decimal), expected, kind, "")]
+                else:
+                    start = text.casefold().find(needle) if needle else -1
+                    if start >= 0:
+                        tokens = len(text[start:start + len(needle)].split())
+                    elif expected_date is not None and parse_date(text) == expected_date:
+                        start, tokens = 0, len(text.split())  # printed in another date format than the model returned
+                    starts = [start] if start >= 0 else []
+                for start in starts:
+                    rank = len(NUMBER_RE.findall(text[start:])) if kind == "number" else 0
+                    prefix = text[:start]
+                    if has_letters(prefix):
+                        yield rank, {"label": mask(prefix), "where": "same_cell", "tokens": tokens}
+                    # The value starts the cell (after symbols like '#' or '%'), so its label is elsewhere
+                    if has_letters(prefix) or NUMBER_RE.search(prefix) or (kind == "text" and prefix.strip(STRIP_CHARS + " ")):
+                        continue
+                    if c > 0 and has_letters(row["cells"][c - 1]["text"]):
+                        yield rank, {"label": mask(row["cells"][c - 1]["text"]), "where": "right", "tokens": tokens}
+                    if r > 0:
+                        above = next((other for other in rows[r - 1]["cells"]
+                                      if _overlap(other, cell["x0"], cell["x1"]) > 0 and has_letters(other["text"])), None)
+                        if above is not None:
+                            yield rank, {"label": mask(above["text"]), "where": "below", "tokens": tokens}
+
+
+def learn_anchor(layout: List[Dict[str, Any]], field: str, expected: Any, decimal: str) -> Optional[Dict[str, Any]]:
+    """A label that reads the expected value back from this layout, or None."""
+    kind = FIELD_KINDS[field]
+    candidates = sorted(_anchor_candidates(layout, field, expected, decimal), key=lambda ranked: ranked[0])
+    for _, candidate in candidates:
+        for occurrence in (0, -1):
+            for strip in (False, True):
+                anchor = {**candidate, "occurrence": occurrence, "strip": strip}
+                if _same_value(read_field(layout, anchor, kind, decimal), expected, kind, field):
+                    return anchor
+    return None
+
+
+def detect_decimal(layout: List[Dict[str, Any]], total: float) -> Optional[str]:
+    """Decimal separator under which the printed total equals the extracted one."""
+    for page in layout:
+        for row in page["rows"]:
+            for cell in row["cells"]:
+                for match in NUMBER_RE.finditer(cell["text"]):
+                    matches = [d for d in (",", ".") if _same_value(parse_amount(match.group(), d), total, "number", "")]
+                    if len(matches) == 1:
+                        return matches[0]
+    return None
+
+
+def _match_item_row(row: Dict[str, Any], item: Dict[str, Any], decimal: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    name = norm(item.get("product_name") or "")
+    product = next((cell for cell in row["cells"] if name and name.startswith(norm(cell["text"]))), None)
+    if product is None:
+        return None
+    cells: Dict[str, Dict[str, Any]] = {"product_name": product}
+    # Amounts are right of the product name (a row number on its left can equal the quantity)
+    right = [cell for cell in row["cells"] if cell["x0"] > product["x0"]]
+    for field in ITEM_NUMBER_FIELDS:
+        if item[field] is None:
+            continue
+        cell = next((cell for cell in right if cell not in cells.values()
+                     and len(NUMBER_RE.findall(cell["text"])) == 1
+                     and _same_value(first_amount(cell["text"], decimal), item[field], "number", "")), None)
+        if cell is not None:
+            cells[field] = cell
+    return cells if "total_price" in cells else None
+
+
+def learn_table(layout: List[Dict[str, Any]], items: List[Dict[str, Any]], decimal: str) -> Optional[Dict[str, Any]]:
+    """Header row, end row and column positions that read the items back exactly, or None."""
+    rows = [row for page in layout for row in page["rows"]]
+    matched, start = [], 0
+    for item in items:
+        found = next(((i, cells) for i in range(start, len(rows))
+                      if (cells := _match_item_row(rows[i], item, decimal))), None)
+        if found is None:
+            return None
+        matched.append(found)
+        start = found[0] + 1
+
+    first, last = matched[0][0], matched[-1][0]
+    if first == 0:
+        return None
+    columns = {}
+    for field in ("product_name", *ITEM_NUMBER_FIELDS):
+        cells = [cells[field] for _, cells in matched if field in cells]
+        if cells:
+            columns[field] = [min(cell["x0"] for cell in cells), max(cell["x1"] for cell in cells)]
+    table = {
+        "header": row_signature(rows[first - 1]),
+        "end": mask(rows[last + 1]["cells"][0]["text"]) if last + 1 < len(rows) else None,
+        "columns": columns,
+    }
+    read = read_items(layout, table, decimal)
+    if read is None or len(read) != len(items):
+        return None
+    for got, item in zip(read, items):
+        if norm(got["product_name"] or "") != norm(item.get("product_name") or ""):
+            return None
+        if any((got[f] is None) != (item[f] is None) or (got[f] is not None and abs(got[f] - item[f]) >= 0.005)
+               for f in ITEM_NUMBER_FIELDS):
+            return None
+    return table
+
+
+def clean_items(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {**item, **{field: clean_number(item.get(field)) for field in ITEM_NUMBER_FIELDS}}
+        for item in result.get("items") or []
+    ]
+
+
+def is_verified(result: Dict[str, Any]) -> bool:
+    """Items, totals and tax add up: the extraction can be trusted (or taught) without a person."""
+    fields = result.get("general_fields") or {}
+    data = {
+        "total_amount": clean_number(fields.get("total_amount")),
+        "tax_rate": clean_number(fields.get("tax_rate")),
+        "items": clean_items(result),
+    }
+    if data["total_amount"] is None or not data["items"]:
+        return False
+    DataValidator.validate_invoice(data)
+    return (
+        all(check["is_valid"] for check in data["arithmetic_validation"])
+        and len(data["arithmetic_validation"]) == len(data["items"])
+        and data["tax_validation"]["matches_tax_calculation"]
+    )
+
+
+def learn_sample(layout: List[Dict[str, Any]], result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """What one verified extraction teaches about its supplier's layout."""
+    fields = result.get("general_fields") or {}
+    total = clean_number(fields.get("total_amount"))
+    decimal = detect_decimal(layout, total) if total is not None else None
+    table = learn_table(layout, clean_items(result), decimal or ",")
+    if table is None:
+        return None
+
+    anchors = {}
+    for field, kind in FIELD_KINDS.items():
+        expected = fields.get(field)
+        if kind == "number":
+            expected = clean_number(expected)
+        if expected in (None, ""):
+            continue
+        anchor = learn_anchor(layout, field, expected, decimal or ",")
+        if anchor is not None:
+            anchors[field] = anchor
+    return {
+        "keys": sorted(layout_keys(layout)),
+        "fields": anchors,
+        "constants": {field: fields[field] for field in CONSTANT_FIELDS if fields.get(field) not in (None, "")},
+        "table": table,
+        "decimal": decimal,
+        "present": [field for field in (*FIELD_KINDS, *CONSTANT_FIELDS) if fields.get(field) not in (None, "")],
+    }
+
+
+def learn_sample_from_file(file_path: str, max_pages: int, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """learn_sample on a PDF's layout, as one render pool job (MuPDF and the anchor search are CPU work)."""
+    return learn_sample(extract_page_layouts(file_path, max_pages), result)
+
+
+def consensus(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """What all samples agree on; a layout change shows up as disagreement."""
+    keys = set.intersection(*(set(sample["keys"]) for sample in samples))
+    fields = {
+        field: anchor for field, anchor in samples[-1]["fields"].items()
+        if all(sample["fields"].get(field) == anchor for sample in samples)
+    }
+    constants = {
+        field: value for field, value in samples[-1]["constants"].items()
+        if all(norm(sample["constants"].get(field)) == norm(value) for sample in samples)
+    }
+    tables = [sample["table"] for sample in samples]
+    table = None
+    if all(t["header"] == tables[0]["header"] and t["end"] == tables[0]["end"]
+           and set(t["columns"]) == set(tables[0]["columns"]) for t in tables):
+        table = {
+            "header": tables[0]["header"],
+            "end": tables[0]["end"],
+            "columns": {
+                field: [min(t["columns"][field][0] for t in tables), max(t["columns"][field][1] for t in tables)]
+                for field in tables[0]["columns"]
+            },
+        }
+    if samples[-1]["constants"].get("category"):
+        # The model's category is a judgement, not printed text; the latest one is kept
+        constants.setdefault("category", samples[-1]["constants"]["category"])
+    decimals = {sample["decimal"] for sample in samples if sample["decimal"]}
+    # Every field the model found on all samples must come out of the template too
+    required = set.intersection(*(set(sample["present"]) for sample in samples))
+    return {
+        "keys": sorted(keys),
+        "fields": fields,
+        "constants": constants,
+        "table": table,
+        "decimal": decimals.pop() if len(decimals) == 1 else ("," if not decimals else None),
+        "complete": (
+            len(keys) >= MIN_LAYOUT_KEYS and table is not None and "total_amount" in fields
+            and required <= set(fields) | set(constants)
+        ),
+    }
+
+
+def apply_template(layout: List[Dict[str, Any]], template: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Extraction result in the engine's format, or None when a learned field or the table is missing."""
+    decimal = template["decimal"]
+    general_fields = dict(template["constants"])
+    for field, anchor in template["fields"].items():
+        value = read_field(layout, anchor, FIELD_KINDS[field], decimal)
+        if value is None:
+            return None
+        general_fields[field] = value
+    items = read_items(layout, template["table"], decimal)
+    if not items:
+        return None
+    return {"general_fields": general_fields, "items": items}
+
+
+# ===== Store =====
+
+class SupplierTemplateStore:
+    """
+    Layout templates of recurring suppliers in the supplier_templates collection.
+    Every verified LLM extraction of a PDF is a sample for its supplier; once the
+    last SUPPLIER_TEMPLATE_MIN_SAMPLES samples agree on the labels next to each
+    field and on the item table's columns, invoices with the same layout are
+    read from their text layer without the LLM.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("SUPPLIER_TEMPLATES_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.min_samples = int(os.getenv("SUPPLIER_TEMPLATE_MIN_SAMPLES", "3"))
+        # Share of a template's layout keys an invoice must have to be read with it
+        self.match_threshold = float(os.getenv("SUPPLIER_TEMPLATE_MATCH_THRESHOLD", "0.8"))
+        # Rejected template extractions in a row before the template is learned again
+        self.max_failures = int(os.getenv("SUPPLIER_TEMPLATE_MAX_FAILURES", "3"))
+
+    async def has_active(self, user_id: Optional[str]) -> bool:
+        """Whether the user has any active template, so layouts are only extracted when one could match."""
+        if not self.enabled or not user_id:
+            return False
+        try:
+            template = await get_supplier_templates_collection().find_one(
+                {"user_id": user_id, "status": "active"}, {"_id": 1}
+            )
+        except Exception as e:
+            logger.warning(f"Supplier template lookup failed: {e}")
+            return False
+        return template is not None
+
+    async def match(self, user_id: str, keys: Set[str]) -> Optional[Dict[str, Any]]:
+        """The user's active template with the largest share of its layout keys on this invoice."""
+        best, best_score = None, 0.0
+        cursor = get_supplier_templates_collection().find(
+            {"user_id": user_id, "status": "active", "keys": {"$in": sorted(keys)}},
+            {"samples": 0}
+        )
+        async for template in cursor:
+            score = len(keys.intersection(template["keys"])) / max(len(template["keys"]), 1)
+            if score > best_score:
+                best, best_score = template, score
+        return best if best_score >= self.match_threshold else None
+
+    async def extract(self, user_id: str, layout: List[Dict[str, Any]]) -> Optional[Tuple[Dict[str, Any], str]]:
+        """(result, template id) when a template matches and its result adds up; None to use the LLM."""
+        if not self.enabled or not user_id:
+            return None
+        keys = layout_keys(layout)
+        if not keys:  # no text layer
+            return None
+        try:
+            template = await self.match(user_id, keys)
+            if template is None:
+                return None
+            result = apply_template(layout, template)
+            if result is not None and is_verified(result):
+                SUPPLIER_TEMPLATE_EXTRACTIONS.labels(result="extracted").inc()
+                await get_supplier_templates_collection().update_one(
+                    {"_id": template["_id"]},
+                    {"$inc": {"extractions": 1}, "$set": {"failures": 0, "last_used_at": datetime.utcnow()}}
+                )
+                return result, template["_id"]
+
+            SUPPLIER_TEMPLATE_EXTRACTIONS.labels(result="rejected").inc()
+            logger.info(f"Template {template['_id']} did not add up on this invoice, using the LLM")
+            if template.get("failures", 0) + 1 >= self.max_failures:
+                await get_supplier_templates_collection().update_one(
+                    {"_id": template["_id"]},
+                    {"$set": {"status": "learning", "samples": [], "failures": 0, "updated_at": datetime.utcnow()}}
+                )
+            else:
+                await get_supplier_templates_collection().update_one({"_id": template["_id"]}, {"$inc": {"failures": 1}})
+        except Exception as e:
+            logger.warning(f"Supplier template lookup failed: {e}")
+        return None
+
+    def should_learn(self, user_id: Optional[str], result: Dict[str, Any]) -> bool:
+        """Only verified extractions with a supplier name are samples."""
+        supplier = (result.get("general_fields") or {}).get("supplier_name")
+        return self.enabled and bool(user_id) and bool(supplier) and is_verified(result)
+
+    async def learn(self, user_id: str, result: Dict[str, Any], sample: Dict[str, Any]):
+        """Add the sample (see learn_sample) of a verified LLM extraction to its supplier's template."""
+        supplier = result["general_fields"]["supplier_name"]
+        try:
+            now = datetime.utcnow()
+            templates = get_supplier_templates_collection()
+            template = await templates.find_one_and_update(
+                {"_id": f"{user_id}:{norm(supplier)}"},
+                {
+                    "$push": {"samples": {"$each": [sample], "$slice": -self.min_samples}},
+                    "$set": {"user_id": user_id, "supplier_name": supplier, "updated_at": now},
+                    "$setOnInsert": {"created_at": now, "extractions": 0, "failures": 0, "status": "learning"},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            learned = consensus(template["samples"])
+            active = learned.pop("complete") and len(template["samples"]) >= self.min_samples
+            await templates.update_one(
+                {"_id": template["_id"]},
+                {"$set": {**learned, "status": "active" if active else "learning"}}
+            )
+            if active and template["status"] != "active":
+                logger.info(f"Supplier template {template['_id']} learned from {len(template['samples'])} invoices")
+        except Exception as e:
+            logger.warning(f"Supplier template learning failed: {e}")
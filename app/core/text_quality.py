@@ -0,0 +1,105 @@
+import os
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import List
+
+CURRENCY_TOKENS = r"(?:₺|\$|€|£|TL|TRY|USD|EUR|GBP)"
+MONTH_NAMES = (
+    r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+    r"|ocak|şubat|mart|nisan|mayıs|haziran|temmuz|ağustos|eylül|ekim|kasım|aralık"
+)
+
+# 1.234,56 / 1,234.56 / 99,90 or any number next to a currency symbol or code
+AMOUNT_PATTERN = re.compile(
+    rf"\d{{1,3}}(?:[.,\s]\d{{3}})*[.,]\d{{2}}(?!\d)"
+    rf"|{CURRENCY_TOKENS}\s?\d[\d.,]*"
+    rf"|\d[\d.,]*\s?{CURRENCY_TOKENS}"
+)
+# 15.03.2024 / 15/03/24 / 2024-03-15 / 20 Nisan 2030 / June 9, 2022
+DATE_PATTERN = re.compile(
+    rf"\b(?:\d{{1,2}}[./-]\d{{1,2}}[./-]\d{{2,4}}|\d{{4}}[./-]\d{{1,2}}[./-]\d{{1,2}})\b"
+    rf"|\b\d{{1,2}}\s+(?:{MONTH_NAMES})\s+\d{{4}}\b"
+    rf"|\b(?:{MONTH_NAMES})\s+\d{{1,2}},?\s+\d{{4}}\b",
+    re.IGNORECASE
+)
+
+
+@dataclass
+class PageTextQuality:
+    """Text-layer statistics for a single PDF page."""
+    page_index: int
+    char_count: int
+    glyph_coverage: float
+    has_amount: bool
+    has_date: bool
+    is_usable: bool
+
+
+@dataclass
+class TextLayerReport:
+    """Per-document decision on which pages can skip rasterization."""
+    pages: List[PageTextQuality] = field(default_factory=list)
+    has_amount: bool = False
+    has_date: bool = False
+
+    @property
+    def text_pages(self) -> List[int]:
+        if not (self.has_amount and self.has_date):
+            return []
+        return [p.page_index for p in self.pages if p.is_usable]
+
+    @property
+    def vision_pages(self) -> List[int]:
+        text_pages = set(self.text_pages)
+        return [p.page_index for p in self.pages if p.page_index not in text_pages]
+
+    @property
+    def path(self) -> str:
+        if not self.text_pages:
+            return "vision"
+        return "hybrid" if self.vision_pages else "text"
+
+
+class TextLayerClassifier:
+    """Decides whether a PDF text layer is complete enough to skip vision processing."""
+
+    def __init__(self):
+        self.min_chars = int(os.getenv("TEXT_LAYER_MIN_CHARS", "40"))
+        self.min_glyph_coverage = float(os.getenv("TEXT_LAYER_MIN_GLYPH_COVERAGE", "0.95"))
+
+    @staticmethod
+    def glyph_coverage(text: str) -> float:
+        """Share of visible characters that map to real glyphs (not U+FFFD, private use or controls)."""
+        visible = [ch for ch in text if not ch.isspace()]
+        if not visible:
+            return 0.0
+        broken = sum(
+            1 for ch in visible
+            if ch == "\ufffd" or unicodedata.category(ch) in ("Co", "Cc", "Cn")
+        )
+        return 1 - broken / len(visible)
+
+    def assess_page(self, page_index: int, text: str) -> PageTextQuality:
+        char_count = len(text.strip())
+        coverage = self.glyph_coverage(text)
+        return PageTextQuality(
+            page_index=page_index,
+            char_count=char_count,
+            glyph_coverage=round(coverage, 4),
+            has_amount=bool(AMOUNT_PATTERN.search(text)),
+            has_date=bool(DATE_PATTERN.search(text)),
+            is_usable=char_count >= self.min_chars and coverage >= self.min_glyph_coverage,
+        )
+
+    def classify(self, page_texts: List[str]) -> TextLayerReport:
+        """
+        Pages with enough real glyphs are sent as text. The document only
+        qualifies if its usable pages contain at least one amount and one date;
+        otherwise every page goes through vision.
+        """
+        report = TextLayerReport(pages=[self.assess_page(i, t) for i, t in enumerate(page_texts)])
+        usable = [p for p in report.pages if p.is_usable]
+        report.has_amount = any(p.has_amount for p in usable)
+        report.has_date = any(p.has_date for p in usable)
+        return report
@@ -1,60 +1,290 @@
-import httpx
+import os
+import json
+import time
+import asyncio
 import logging
-from typing import Dict, Optional, Any
+from dataclasses import dataclass, asdict
+from datetime import datetime, date
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple
+
+from app.core.http_clients import get_http_client
+from app.core.metrics import EXCHANGE_RATE_LOOKUPS, EXCHANGE_RATE_FETCHES
+from app.core.tools.rate_history import RateHistory, QUOTE_CURRENCY
+from app.core.validators import parse_date
 
 logger = logging.getLogger(__name__)
 
+REDIS_KEY = "exchange_rates:{base}"
+
+# Last resort when no rate table was ever fetched; results using it are marked rate_source=fallback
+FALLBACK_RATES_TRY = {
+    "USD": 30.25,
+    "EUR": 33.10,
+    "GBP": 38.50
+}
+
+
+@dataclass
+class RateTable:
+    """Rates of every currency against one base currency (units per 1 base)."""
+    base: str
+    rates: Dict[str, float]
+    fetched_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Cross rate of any pair through the base currency."""
+        rates = {**self.rates, self.base: 1.0}
+        if from_currency not in rates or to_currency not in rates or not rates[from_currency]:
+            return None
+        return rates[to_currency] / rates[from_currency]
+
+
 class ExchangeRateTool:
-    """Tool to fetch exchange rates and convert amounts to TRY."""
-    
+    """
+    Tool to fetch exchange rates and convert amounts to TRY.
+
+    One request fetches the full table of EXCHANGE_RATE_BASE, which covers every
+    pair. The table is kept in process, shared with other workers through Redis
+    and saved to a snapshot file for offline starts. A table older than the TTL
+    is still served while one background request refreshes it; past
+    EXCHANGE_RATE_MAX_STALE_SECONDS callers wait for the refresh (and fall back
+    to the stale table if it fails).
+
+    Conversions with an invoice date use that day's rate from the RateHistory,
+    which also records every fetched table.
+    """
+
     def __init__(self):
-        # Using a free API for demonstration. In production, use a reliable provider.
-        self.api_url = "https://api.exchangerate-api.com/v4/latest/USD"
+        self.api_url = os.getenv("EXCHANGE_RATE_API_URL", "https://api.exchangerate-api.com/v4/latest/{base}")
+        self.base = os.getenv("EXCHANGE_RATE_BASE", "USD").upper()
+        self.ttl_seconds = int(os.getenv("EXCHANGE_RATE_TTL_SECONDS", "3600"))
+        self.max_stale_seconds = int(os.getenv("EXCHANGE_RATE_MAX_STALE_SECONDS", str(7 * 24 * 3600)))
+        self.snapshot_path = Path(os.getenv("EXCHANGE_RATE_SNAPSHOT_PATH", "data/exchange_rates.json"))
+        self.redis_enabled = os.getenv("EXCHANGE_RATE_REDIS_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        # After a failed fetch or Redis call, wait this long before trying again
+        self.retry_seconds = int(os.getenv("EXCHANGE_RATE_RETRY_SECONDS", "60"))
+        self._table: Optional[RateTable] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._fetch_retry_at = 0.0
+        self._redis = None
+        self._redis_loop = None
+        self._redis_retry_at = 0.0
+        self.history = RateHistory()
 
-    async def get_conversion_rate(self, from_currency: str, to_currency: str = "TRY") -> Optional[float]:
-        """Fetch current conversion rate."""
-        if not from_currency:
+    # ===== Shared storage =====
+
+    def _get_redis(self):
+        """Redis client for the running loop (redis.asyncio connections are loop-bound)."""
+        loop = asyncio.get_running_loop()
+        if self._redis is None or self._redis_loop is not loop:
+            import redis.asyncio as aioredis
+            self._redis = aioredis.from_url(self.redis_url, socket_timeout=1, socket_connect_timeout=1)
+            self._redis_loop = loop
+        return self._redis
+
+    def _redis_available(self) -> bool:
+        return self.redis_enabled and time.monotonic() >= self._redis_retry_at
+
+    def _redis_failed(self, e: Exception):
+        logger.warning(f"Exchange rate cache in Redis unavailable, retrying in {self.retry_seconds}s: {e}")
+        self._redis_retry_at = time.monotonic() + self.retry_seconds
+
+    async def _load_redis(self) -> Optional[RateTable]:
+        if not self._redis_available():
+            return None
+        try:
+            data = await self._get_redis().get(REDIS_KEY.format(base=self.base))
+            return RateTable(**json.loads(data)) if data else None
+        except Exception as e:
+            self._redis_failed(e)
             return None
 
-        normalized = from_currency.upper()
-        if normalized in ("TL", "TRY"):
-            normalized = "TRY"
+    async def _store_redis(self, table: RateTable):
+        if not self._redis_available():
+            return
+        try:
+            await self._get_redis().set(
+                REDIS_KEY.format(base=self.base), json.dumps(asdict(table)), ex=self.max_stale_seconds
+            )
+        except Exception as e:
+            self._redis_failed(e)
 
-        target = to_currency.upper()
+    def _load_snapshot(self) -> Optional[RateTable]:
+        try:
+            table = RateTable(**json.loads(self.snapshot_path.read_text(encoding="utf-8")))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable exchange rate snapshot {self.snapshot_path}: {e}")
+            return None
+        return table if table.base == self.base else None
+
+    def _store_snapshot(self, table: RateTable):
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.snapshot_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(asdict(table)), encoding="utf-8")
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Exchange rate snapshot write failed: {e}")
 
-        if normalized == target:
-            return 1.0
+    # ===== Refresh =====
 
-        from_currency = normalized
-        to_currency = target
-            
+    async def _fetch(self) -> Optional[RateTable]:
+        """Fetch the base currency's full rate table and store it everywhere."""
+        url = self.api_url.format(base=self.base)
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"https://api.exchangerate-api.com/v4/latest/{from_currency}")
-                if response.status_code == 200:
-                    data = response.json()
-                    return data.get("rates", {}).get(to_currency)
+            response = await get_http_client("exchange_rate", url).get(url)
+            response.raise_for_status()
+            rates = {k.upper(): float(v) for k, v in response.json().get("rates", {}).items()}
         except Exception as e:
-            logger.error(f"Error fetching exchange rate: {e}")
-        
-        # Fallback rates if API is down
-        fallbacks = {
-            "USD": 30.25,
-            "EUR": 33.10,
-            "GBP": 38.50
-        }
-        return fallbacks.get(from_currency)
-
-    async def convert_to_try(self, amount: float, currency: str) -> Dict[str, Any]:
-        """Convert amount to TRY and return metadata."""
-        if not amount:
-            return {"amount_try": 0, "rate": 0}
-            
-        rate = await self.get_conversion_rate(currency, "TRY")
-        if rate:
-            return {
+            EXCHANGE_RATE_FETCHES.labels(result="error").inc()
+            logger.error(f"Error fetching exchange rates: {e}")
+            self._fetch_retry_at = time.monotonic() + self.retry_seconds
+            return None
+
+        EXCHANGE_RATE_FETCHES.labels(result="success").inc()
+        table = RateTable(base=self.base, rates=rates, fetched_at=time.time())
+        self._table = table
+        await self._store_redis(table)
+        await asyncio.to_thread(self._store_snapshot, table)
+        await self.history.record(date.today(), {
+            currency: table.rate(currency, QUOTE_CURRENCY)
+            for currency in table.rates
+            if currency != QUOTE_CURRENCY and table.rate(currency, QUOTE_CURRENCY)
+        })
+        return table
+
+    def _start_refresh(self) -> Optional[asyncio.Task]:
+        """One refresh at a time per process; concurrent callers share it. None while backing off."""
+        task = self._refresh_task
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            return task
+        if time.monotonic() < self._fetch_retry_at:
+            return None
+        task = self._refresh_task = asyncio.ensure_future(self._fetch())
+        return task
+
+    async def get_rate_table(self) -> Tuple[Optional[RateTable], str]:
+        """The current rate table and where it came from (memory, redis, snapshot, api or stale)."""
+        table, source = self._table, "memory"
+        if table is None or table.age > self.ttl_seconds:
+            # Another worker may have refreshed it already
+            shared = await self._load_redis()
+            if shared is not None and (table is None or shared.fetched_at > table.fetched_at):
+                table, source = shared, "redis"
+            elif table is None:
+                table, source = await asyncio.to_thread(self._load_snapshot), "snapshot"
+            self._table = table or self._table
+
+        if table is not None and table.age <= self.ttl_seconds:
+            return table, source
+        if table is not None and table.age <= self.max_stale_seconds:
+            # Stale while revalidate
+            self._start_refresh()
+            return table, "stale"
+
+        refresh = self._start_refresh()
+        fresh = await asyncio.shield(refresh) if refresh is not None else None
+        if fresh is not None:
+            return fresh, "api"
+        return table, "stale"
+
+    # ===== Lookups =====
+
+    @staticmethod
+    def _normalize(currency: str) -> str:
+        normalized = currency.upper()
+        return "TRY" if normalized == "TL" else normalized
+
+    def _table_rate(
+        self, table: Optional[RateTable], source: str, from_currency: str, to_currency: str
+    ) -> Tuple[Optional[float], Optional[str], Optional[float]]:
+        """(rate, source, fetched_at epoch) from the current table, or the built-in TRY rates without one."""
+        rate = table.rate(from_currency, to_currency) if table else None
+        if rate is None and to_currency == "TRY" and from_currency in FALLBACK_RATES_TRY:
+            logger.warning(f"No exchange rate table available, using the built-in {from_currency}/TRY fallback rate")
+            return FALLBACK_RATES_TRY[from_currency], "fallback", None
+        if rate is None:
+            return None, None, None
+        return rate, source, table.fetched_at
+
+    async def get_rate(self, from_currency: str, to_currency: str = "TRY") -> Tuple[Optional[float], Optional[str], Optional[float]]:
+        """(rate, source, fetched_at epoch) for a pair; rate is None when unknown."""
+        if not from_currency:
+            return None, None, None
+
+        from_currency, to_currency = self._normalize(from_currency), self._normalize(to_currency)
+        if from_currency == to_currency:
+            return 1.0, "identity", None
+
+        table, source = await self.get_rate_table()
+        rate, source, fetched_at = self._table_rate(table, source, from_currency, to_currency)
+        if rate is not None:
+            EXCHANGE_RATE_LOOKUPS.labels(source=source).inc()
+        return rate, source, fetched_at
+
+    async def get_conversion_rate(self, from_currency: str, to_currency: str = "TRY") -> Optional[float]:
+        """Current conversion rate."""
+        rate, _, _ = await self.get_rate(from_currency, to_currency)
+        return rate
+
+    async def convert_to_try(self, amount: float, currency: str, invoice_date: Any = None) -> Dict[str, Any]:
+        """Convert amount to TRY (at the invoice date's rate when known) and return metadata."""
+        conversions = await self.convert_many_to_try([(amount, currency, invoice_date)])
+        return conversions[0]
+
+    async def convert_many_to_try(self, rows: List[Tuple[Any, Optional[str], Any]]) -> List[Dict[str, Any]]:
+        """
+        Convert (amount, currency, invoice date) rows to TRY in one pass: every
+        dated row is matched against the rate history at once, and the rest share
+        one lookup of the current table.
+        """
+        today = date.today()
+        parsed = []
+        for amount, currency, invoice_date in rows:
+            day = parse_date(invoice_date)
+            parsed.append((amount, self._normalize(currency) if currency else None, day if day and day <= today else None))
+
+        if self.history.enabled and any(day for _, currency, day in parsed if currency != QUOTE_CURRENCY):
+            await self.history.ensure_loaded()
+        historical = self.history.lookup_many([(currency, day) for _, currency, day in parsed])
+
+        current = None
+        conversions = []
+        for (amount, currency, _), found in zip(parsed, historical):
+            if not amount:
+                conversions.append({"amount_try": 0, "rate": 0})
+                continue
+            if not currency:
+                conversions.append({"amount_try": amount, "rate": 1.0, "currency": currency, "rate_source": None})
+                continue
+
+            if currency == QUOTE_CURRENCY:
+                rate, source, as_of = 1.0, "identity", None
+            elif found is not None:
+                rate, source, as_of = found[0], "history", found[1].isoformat()
+            else:
+                if current is None:
+                    current = await self.get_rate_table()
+                rate, source, fetched_at = self._table_rate(*current, currency, QUOTE_CURRENCY)
+                as_of = datetime.utcfromtimestamp(fetched_at).isoformat() if fetched_at else None
+
+            if not rate:
+                conversions.append({"amount_try": amount, "rate": 1.0, "currency": currency, "rate_source": None})
+                continue
+            EXCHANGE_RATE_LOOKUPS.labels(source=source).inc()
+            conversions.append({
                 "amount_try": round(amount * rate, 2),
-                "rate": rate,
-                "currency": "TRY"
-            }
-        return {"amount_try": amount, "rate": 1.0, "currency": currency}
+                "rate": round(rate, 6),
+                "currency": "TRY",
+                "rate_source": source,
+                "rates_as_of": as_of,
+            })
+        return conversions
@@ -0,0 +1,187 @@
+import os
+import csv
+import time
+import asyncio
+import logging
+from array import array
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.core.validators import parse_date
+from app.database.connection import get_exchange_rate_history_collection
+
+logger = logging.getLogger(__name__)
+
+# History rates are TRY per 1 unit of the currency, as the central bank publishes them
+QUOTE_CURRENCY = "TRY"
+CSV_WRITE_CHUNK = 1000
+
+
+class RateSeries:
+    """One currency's rates as parallel arrays of day ordinals (ascending) and TRY rates."""
+
+    __slots__ = ("days", "rates")
+
+    def __init__(self):
+        self.days = array("l")
+        self.rates = array("d")
+
+    def put(self, day: int, rate: float):
+        index = bisect_right(self.days, day)
+        if index and self.days[index - 1] == day:
+            self.rates[index - 1] = rate
+        else:
+            self.days.insert(index, day)
+            self.rates.insert(index, rate)
+
+    def at(self, day: int, max_gap_days: int) -> Optional[Tuple[float, int]]:
+        """Rate of the latest day on or before `day` (weekends and holidays have none)."""
+        index = bisect_right(self.days, day) - 1
+        if index < 0 or day - self.days[index] > max_gap_days:
+            return None
+        return self.rates[index], self.days[index]
+
+
+class RateHistory:
+    """
+    Daily exchange rates by date in the exchange_rate_history collection (one
+    document per day, bulk-loaded from CSV or recorded from the live fetches),
+    held in memory as one sorted series per currency for binary search.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("EXCHANGE_RATE_HISTORY_ENABLED", "true").lower() in ("1", "true", "yes")
+        # The closest earlier rate is used up to this many days back
+        self.max_gap_days = int(os.getenv("EXCHANGE_RATE_HISTORY_MAX_GAP_DAYS", "7"))
+        # Picks up rates loaded or recorded by other processes
+        self.reload_seconds = int(os.getenv("EXCHANGE_RATE_HISTORY_RELOAD_SECONDS", "3600"))
+        self._series: Dict[str, RateSeries] = {}
+        self._loaded_at: Optional[float] = None
+        self._load_task: Optional[asyncio.Task] = None
+
+    async def _load(self):
+        series: Dict[str, RateSeries] = defaultdict(RateSeries)
+        try:
+            async for doc in get_exchange_rate_history_collection().find({}).sort("_id", 1):
+                day = date.fromisoformat(doc["_id"]).toordinal()
+                for currency, rate in doc.get("rates", {}).items():
+                    series[currency].days.append(day)
+                    series[currency].rates.append(rate)
+            self._series = dict(series)
+        except Exception as e:
+            logger.warning(f"Exchange rate history could not be loaded: {e}")
+        # Also after a failure, so a broken database is not queried on every lookup
+        self._loaded_at = time.monotonic()
+
+    async def ensure_loaded(self):
+        """Load the history on first use and again after reload_seconds; concurrent callers share one load."""
+        if not self.enabled:
+            return
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.reload_seconds:
+            return
+        task = self._load_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._load_task = asyncio.ensure_future(self._load())
+        await asyncio.shield(task)
+
+    def lookup(self, currency: str, day: date) -> Optional[Tuple[float, date]]:
+        """(TRY rate, rate date) for one currency on a day."""
+        series = self._series.get(currency)
+        found = series.at(day.toordinal(), self.max_gap_days) if series is not None and day else None
+        return (found[0], date.fromordinal(found[1])) if found else None
+
+    def lookup_many(self, queries: List[Tuple[Optional[str], Optional[date]]]) -> List[Optional[Tuple[float, date]]]:
+        """
+        (TRY rate, rate date) for each (currency, day), or None without a rate.
+        The days of each currency are sorted and matched in one forward pass over
+        its series, each binary search starting where the previous one ended.
+        """
+        results: List[Optional[Tuple[float, date]]] = [None] * len(queries)
+        wanted: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for index, (currency, day) in enumerate(queries):
+            if currency in self._series and day is not None:
+                wanted[currency].append((day.toordinal(), index))
+
+        for currency, days in wanted.items():
+            series = self._series[currency]
+            days.sort()
+            position = 0
+            for ordinal, index in days:
+                position = bisect_right(series.days, ordinal, position)
+                if position and ordinal - series.days[position - 1] <= self.max_gap_days:
+                    results[index] = (series.rates[position - 1], date.fromordinal(series.days[position - 1]))
+        return results
+
+    async def record(self, day: date, rates: Dict[str, float]):
+        """Store one day's TRY rates (merged with what the day already has)."""
+        if not self.enabled or not rates:
+            return
+        try:
+            await get_exchange_rate_history_collection().update_one(
+                {"_id": day.isoformat()},
+                {"$set": {f"rates.{currency}": rate for currency, rate in rates.items()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Exchange rates of {day} could not be recorded: {e}")
+            return
+        for currency, rate in rates.items():
+            self._series.setdefault(currency, RateSeries()).put(day.toordinal(), rate)
+
+    async def load_csv(self, path: str) -> int:
+        """
+        Bulk-load a CSV with date, currency and rate columns (rate = TRY per 1 unit).
+        Returns the number of rows stored; rows that cannot be parsed are skipped.
+        """
+        by_day: Dict[date, Dict[str, float]] = defaultdict(dict)
+        rows = 0
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                day = parse_date(row.get("date"))
+                currency = (row.get("currency") or "").strip().upper()
+                try:
+                    rate = float((row.get("rate") or "").strip().replace(",", "."))
+                except ValueError:
+                    rate = None
+                if day is None or not currency or currency == QUOTE_CURRENCY or "." in currency or not rate:
+                    logger.warning(f"Skipping exchange rate row {row}")
+                    continue
+                by_day[day][currency] = rate
+                rows += 1
+
+        operations = [
+            UpdateOne(
+                {"_id": day.isoformat()},
+                {"$set": {f"rates.{currency}": rate for currency, rate in rates.items()}},
+                upsert=True
+            )
+            for day, rates in sorted(by_day.items())
+        ]
+        collection = get_exchange_rate_history_collection()
+        for start in range(0, len(operations), CSV_WRITE_CHUNK):
+            await collection.bulk_write(operations[start:start + CSV_WRITE_CHUNK], ordered=False)
+        self._loaded_at = None
+        return rows
+
+
+async def _load_csv_files(paths: Iterable[str]):
+    from app.database.connection import connect_to_mongo, close_mongo_connection
+    await connect_to_mongo()
+    history = RateHistory()
+    try:
+        for path in paths:
+            print(f"{path}: {await history.load_csv(path)} rates loaded")
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        sys.exit("usage: python -m app.core.tools.rate_history RATES.csv [...]")
+    asyncio.run(_load_csv_files(sys.argv[1:]))
@@ -1,4 +1,42 @@
-from typing import Dict, Any, List
+import re
+from datetime import date, datetime
+from typing import Dict, Any, List, Optional
+
+DATE_FORMATS = ("%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%Y.%m.%d", "%Y/%m/%d", "%d.%m.%y")
+
+
+def clean_number(value: Any) -> Optional[float]:
+    """Clean string number format (e.g., '1.500,00' -> 1500.0)."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    
+    try:
+        # Remove thousands separator and fix decimal separator
+        s = str(value).replace(".", "").replace(",", ".")
+        # Remove any non-numeric chars except .
+        s = re.sub(r'[^0-9.]', '', s)
+        return float(s)
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_date(value: Any) -> Optional[date]:
+    """Parse an extracted invoice date (e.g., '15.03.2024', '2024-03-15')."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not value:
+        return None
+    s = str(value).strip()[:10]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            continue
+    return None
 
 class DataValidator:
     """Validator class for invoice data."""
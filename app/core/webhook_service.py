@@ -1,5 +1,4 @@
 import os
-import httpx
 import hashlib
 import hmac
 import json
@@ -8,6 +7,7 @@ from typing import Dict, Any, Optional, List
 import asyncio
 import logging
 from app.database.connection import get_webhooks_collection
+from app.core.http_clients import get_http_client
 
 logger = logging.getLogger(__name__)
 
@@ -67,24 +67,24 @@ class WebhookService:
         
         for attempt in range(self.max_retries):
             try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        webhook["url"],
-                        content=payload_str,
-                        headers=headers,
-                        timeout=self.timeout
+                client = get_http_client("webhook", webhook["url"])
+                response = await client.post(
+                    webhook["url"],
+                    content=payload_str,
+                    headers=headers,
+                    timeout=self.timeout
+                )
+                last_status = response.status_code
+                
+                if response.status_code < 300:
+                    await webhooks_col.update_one(
+                        {"_id": webhook["_id"]},
+                        {
+                            "$inc": {"total_calls": 1, "successful_calls": 1},
+                            "$set": {"last_called_at": datetime.utcnow(), "last_status_code": last_status}
+                        }
                     )
-                    last_status = response.status_code
-                    
-                    if response.status_code < 300:
-                        await webhooks_col.update_one(
-                            {"_id": webhook["_id"]},
-                            {
-                                "$inc": {"total_calls": 1, "successful_calls": 1},
-                                "$set": {"last_called_at": datetime.utcnow(), "last_status_code": last_status}
-                            }
-                        )
-                        return True
+                    return True
             except Exception as e:
                 logger.warning(f"Webhook {webhook['_id']} failed: {e}")
                 if attempt < self.max_retries - 1:
@@ -103,7 +103,8 @@ class WebhookService:
         self, 
         user_id: str, 
         invoice: dict, 
-        event_type: str = "invoice.processed"
+        event_type: str = "invoice.processed",
+        extra_data: Optional[Dict[str, Any]] = None
     ):
         webhooks_col = get_webhooks_collection()
         cursor = webhooks_col.find({"user_id": user_id, "is_active": True})
@@ -117,4 +118,4 @@ class WebhookService:
                 (is_failure and webhook.get("on_failure", True))
             )
             if should_trigger:
-                await self.trigger_webhook(webhook, event_type, invoice)
+                await self.trigger_webhook(webhook, event_type, invoice, extra_data)
@@ -6,6 +6,7 @@ load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "invoice_db")
+EXTRACTION_CACHE_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
 
 # MongoDB Client
 client: AsyncIOMotorClient = None
@@ -25,7 +26,7 @@ async def connect_to_mongo():
         return # Not in an event loop
 
     # Motor clients bind to the event loop active at creation. Recreate only when
-    # the running loop changes (e.g., Celery using asyncio.run creates a fresh loop).
+    # the running loop changes (e.g., a new Celery worker process or a closed loop).
     recreate = (client is None) or (_client_loop is not current_loop)
 
     if recreate:
@@ -48,8 +49,14 @@ async def connect_to_mongo():
             await db.invoices.create_index([("user_id", 1), ("created_at", -1)])
             await db.invoices.create_index("task_id", unique=True, sparse=True)
             await db.invoices.create_index("status")
+            await db.invoices.create_index([("user_id", 1), ("supplier_name", 1)])
             await db.webhooks.create_index("user_id")
             await db.batch_jobs.create_index("user_id")
+            await db.review_queue.create_index([("group", 1), ("claimed_by", 1), ("enqueued_at", 1)])
+            await db.supplier_templates.create_index([("user_id", 1), ("status", 1), ("keys", 1)])
+            await db.extraction_cache.create_index(
+                "last_used_at", expireAfterSeconds=EXTRACTION_CACHE_TTL_SECONDS
+            )
             connect_to_mongo._indexes_created = True
             print("Connected to MongoDB and verified indexes.")
         except Exception as e:
@@ -92,3 +99,19 @@ def get_batch_jobs_collection():
 
 def get_metrics_collection():
     return db.processing_metrics
+
+
+def get_extraction_cache_collection():
+    return db.extraction_cache
+
+
+def get_review_queue_collection():
+    return db.review_queue
+
+
+def get_exchange_rate_history_collection():
+    return db.exchange_rate_history
+
+
+def get_supplier_templates_collection():
+    return db.supplier_templates
@@ -57,6 +57,7 @@ class InvoiceInDB(BaseModel):
     status: str = "pending"  # pending, processing, completed, failed
     error_message: Optional[str] = None
     processing_time_ms: Optional[int] = None
+    stage_timings_ms: Optional[Dict[str, int]] = None  # extraction, validation, conversion, review, enrichment
     
     # Extracted general fields
     invoice_number: Optional[str] = None
@@ -77,6 +78,10 @@ class InvoiceInDB(BaseModel):
     # Agentic data
     ai_review: Optional[Dict[str, Any]] = None
     conversion: Optional[Dict[str, Any]] = None
+    enrichment_status: Optional[str] = None  # pending/completed/failed when added after completion
+    
+    # Prompt/completion/cached tokens, total and per stage (extraction, review)
+    llm_usage: Optional[Dict[str, Any]] = None
     
     # Embedded items (denormalized for performance)
     items: List[InvoiceItemInDB] = []
@@ -146,7 +151,7 @@ class BatchJobInDB(BaseModel):
 # ===== Metrics Models =====
 
 class ProcessingMetricsInDB(BaseModel):
-    """Metrics document in MongoDB."""
+    """Metrics document in MongoDB, aggregated per hour and LLM provider."""
     id: str = Field(default_factory=generate_id, alias="_id")
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     
@@ -162,7 +167,14 @@ class ProcessingMetricsInDB(BaseModel):
     
     # LLM Provider stats
     llm_provider: Optional[str] = None
+    llm_model: Optional[str] = None
     llm_tokens_used: Optional[int] = None
+    llm_prompt_tokens: int = 0
+    llm_completion_tokens: int = 0
+    llm_cached_tokens: int = 0
+    llm_review_tokens: int = 0
+    llm_estimated_cost_usd: Optional[float] = None
+    total_processing_time_ms: Optional[float] = None
     
     # File type breakdown
     pdf_count: int = 0
@@ -202,6 +214,7 @@ def invoice_helper(invoice: dict) -> dict:
         "status": invoice.get("status", "pending"),
         "error_message": invoice.get("error_message"),
         "processing_time_ms": invoice.get("processing_time_ms"),
+        "stage_timings_ms": invoice.get("stage_timings_ms"),
         "invoice_number": invoice.get("invoice_number"),
         "invoice_date": invoice.get("invoice_date"),
         "supplier_name": invoice.get("supplier_name"),
@@ -217,6 +230,9 @@ def invoice_helper(invoice: dict) -> dict:
         ],
         "ai_review": invoice.get("ai_review"),
         "conversion": invoice.get("conversion"),
+        "enrichment_status": invoice.get("enrichment_status"),
+        "llm_usage": invoice.get("llm_usage"),
+        "partial_result": invoice.get("partial_result"),
         "created_at": invoice.get("created_at"),
         "updated_at": invoice.get("updated_at"),
     }
@@ -1,24 +1,34 @@
 import os
 import asyncio
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
 from typing import Dict, Any, Optional
 from datetime import datetime
 
 from app.core.extraction_engine import ExtractionEngine, GeminiProvider, LocalLLMProvider
-from app.core.validators import DataValidator
+from app.core.replay_provider import ReplayProvider, RecordingProvider
+from app.core.validators import DataValidator, clean_number
 from app.core.webhook_service import WebhookService
-from app.core.metrics import log_invoice_processing, ACTIVE_TASKS
+from app.core.metrics import log_invoice_processing, ACTIVE_TASKS, StageTimer
 from app.core.tools.exchange_rate import ExchangeRateTool
 from app.core.agents.reviewer import ReviewerAgent
-from app.database.connection import connect_to_mongo, get_invoices_collection
+from app.core.result_cache import ExtractionCache, CACHED_FIELDS
+from app.core.http_clients import close_http_clients
+from app.core.llm_usage import start_usage_tracking, UsageTracker
+from app.database.connection import connect_to_mongo, get_invoices_collection, get_metrics_collection
 
 load_dotenv()
 
 # Allow running without Redis/Celery for local dev
 DISABLE_CELERY = os.getenv("DISABLE_CELERY", "false").lower() in ("1", "true", "yes")
 
+# Save invoices as completed right after validation; conversion and AI review
+# are attached later by enrich_invoice_task (webhook event "invoice.enriched")
+DEFER_ENRICHMENT = os.getenv("DEFER_ENRICHMENT", "false").lower() in ("1", "true", "yes")
+
 # Eventlet monkey patch for Windows (only when Celery is enabled)
 if not DISABLE_CELERY and os.name == 'nt':
     import eventlet
@@ -59,33 +69,68 @@ celery.conf.update(
 provider_type = os.getenv("LLM_PROVIDER", "gemini")
 if provider_type == "gemini":
     provider = GeminiProvider(api_key=os.getenv("GOOGLE_API_KEY"))
+elif provider_type == "replay":
+    # Offline: serve responses recorded earlier with LLM_RECORD_DIR
+    provider = ReplayProvider(os.getenv("LLM_REPLAY_DIR", "recordings"))
 else:
     provider = LocalLLMProvider(
         base_url=os.getenv("LOCAL_LLM_URL", "http://localhost:1234/v1"),
         model_name=os.getenv("LOCAL_LLM_MODEL", "qwen/qwen3-vl-4b")
     )
+if os.getenv("LLM_RECORD_DIR"):
+    provider = RecordingProvider(provider, os.getenv("LLM_RECORD_DIR"))
 
 engine = ExtractionEngine(llm_provider=provider)
 webhook_service = WebhookService()
 exchange_tool = ExchangeRateTool()
 reviewer_agent = ReviewerAgent(llm_provider=provider)
+extraction_cache = ExtractionCache()
+
+if reviewer_agent.batcher.enabled:
+    # Run by `celery beat` (or a worker started with -B)
+    celery.conf.beat_schedule = {
+        "sweep-review-queue": {
+            "task": "tasks.sweep_review_queue_task",
+            "schedule": reviewer_agent.batcher.sweep_seconds,
+        },
+    }
+
+# One event loop per worker process, reused across tasks so the Motor client
+# and the pooled HTTP clients keep their connections between invoices. Only
+# pools that run tasks one at a time on the process's main thread can share it;
+# thread and greenlet pools get a fresh loop per task.
+LOOP_REUSE_POOLS = ("prefork", "processes", "solo")
+_reuse_worker_loop = False
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+@worker_init.connect
+def detect_worker_pool(sender, **kwargs):
+    """Decide from the worker's pool whether tasks may share one event loop (inherited by forked children)."""
+    global _reuse_worker_loop
+    pool = sender.pool_cls
+    name = pool if isinstance(pool, str) else pool.__module__.rsplit(".", 1)[-1]
+    _reuse_worker_loop = name in LOOP_REUSE_POOLS
 
-def clean_number(value: Any) -> Optional[float]:
-    """Clean string number format (e.g., '1.500,00' -> 1500.0)."""
-    if value is None:
-        return None
-    if isinstance(value, (int, float)):
-        return float(value)
-    
-    try:
-        # Remove thousands separator and fix decimal separator
-        s = str(value).replace(".", "").replace(",", ".")
-        # Remove any non-numeric chars except .
-        import re
-        s = re.sub(r'[^0-9.]', '', s)
-        return float(s)
-    except (ValueError, TypeError):
-        return None
+
+def run_in_worker_loop(coro):
+    """Run a coroutine to completion on this process's long-lived event loop, where the pool allows one."""
+    global _worker_loop
+    if not _reuse_worker_loop:
+        return asyncio.run(coro)
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_worker_loop)
+    return _worker_loop.run_until_complete(coro)
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_resources(**kwargs):
+    """Release per-process resources when a Celery worker process exits."""
+    engine.render_pool.shutdown()
+    if _worker_loop is not None and not _worker_loop.is_closed():
+        _worker_loop.run_until_complete(close_http_clients())
+        _worker_loop.close()
 
 
 async def save_to_mongodb(invoice_id: str, data: Dict[str, Any], status: str, error: Optional[str] = None):
@@ -132,12 +177,19 @@ async def save_to_mongodb(invoice_id: str, data: Dict[str, Any], status: str, er
             "raw_result": data.get("raw_result"),
             "processing_time_ms": data.get("processing_time_ms"),
             "ai_review": data.get("ai_review"),
-            "conversion": data.get("conversion")
+            "conversion": data.get("conversion"),
+            "enrichment_status": data.get("enrichment_status"),
+            "stage_timings_ms": data.get("stage_timings_ms")
         })
     elif error:
         update_data["error_message"] = error
+    # Tokens are spent (and stored) whether or not the extraction succeeded
+    update_data["llm_usage"] = data.get("llm_usage")
         
-    await invoices_col.update_one({"_id": invoice_id}, {"$set": update_data})
+    await invoices_col.update_one(
+        {"_id": invoice_id},
+        {"$set": update_data, "$unset": {"partial_result": ""}}
+    )
     
     # Get user_id for webhook
     invoice_doc = await invoices_col.find_one({"_id": invoice_id})
@@ -145,73 +197,273 @@ async def save_to_mongodb(invoice_id: str, data: Dict[str, Any], status: str, er
         await webhook_service.trigger_for_invoice(invoice_doc["user_id"], invoice_doc)
 
 
-async def _process_invoice_async(file_path: str, content_type: str, invoice_id: str, user_id: str):
+def file_kind(content_type: Optional[str]) -> str:
+    c_type = (content_type or "").lower()
+    if "pdf" in c_type:
+        return "pdf"
+    if "image" in c_type:
+        return "image"
+    return "text"
+
+
+def _plus(field: str, value: float) -> Dict[str, Any]:
+    return {"$add": [{"$ifNull": [f"${field}", 0]}, value]}
+
+
+def _usage_fields(llm_usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    usage = llm_usage or {}
+    fields = {
+        "llm_tokens_used": _plus("llm_tokens_used", usage.get("total_tokens", 0)),
+        "llm_prompt_tokens": _plus("llm_prompt_tokens", usage.get("prompt_tokens", 0)),
+        "llm_completion_tokens": _plus("llm_completion_tokens", usage.get("completion_tokens", 0)),
+        "llm_cached_tokens": _plus("llm_cached_tokens", usage.get("cached_tokens", 0)),
+        "llm_review_tokens": _plus(
+            "llm_review_tokens", usage.get("stages", {}).get("review", {}).get("total_tokens", 0)
+        ),
+    }
+    if "estimated_cost_usd" in usage:
+        fields["llm_estimated_cost_usd"] = _plus("llm_estimated_cost_usd", usage["estimated_cost_usd"])
+    return fields
+
+
+async def _update_metrics_bucket(fields: Dict[str, Any]):
+    """Apply fields to the processing_metrics document of this hour and provider."""
+    bucket = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    provider_name = engine.llm_provider.__class__.__name__
+    fields = {
+        "timestamp": {"$ifNull": ["$timestamp", bucket]},
+        "llm_provider": provider_name,
+        "llm_model": getattr(engine.llm_provider, "model_name", None),
+        **fields,
+    }
+    try:
+        await get_metrics_collection().update_one(
+            {"_id": f"{bucket:%Y-%m-%dT%H}:{provider_name}"},
+            [
+                {"$set": fields},
+                {"$set": {"avg_processing_time_ms": {"$cond": [
+                    {"$gt": ["$successful_extractions", 0]},
+                    {"$divide": [{"$ifNull": ["$total_processing_time_ms", 0]}, "$successful_extractions"]},
+                    None
+                ]}}},
+            ],
+            upsert=True
+        )
+    except Exception as e:
+        print(f"Processing metrics update failed: {e}")
+
+
+async def record_processing_metrics(
+    status: str,
+    processing_time_ms: int,
+    content_type: Optional[str],
+    llm_usage: Optional[Dict[str, Any]]
+):
+    """Add one processed invoice to the hourly processing_metrics document of this provider."""
+    succeeded = status == "completed"
+
+    fields = {
+        "total_requests": _plus("total_requests", 1),
+        "successful_extractions": _plus("successful_extractions", int(succeeded)),
+        "failed_extractions": _plus("failed_extractions", int(not succeeded)),
+        f"{file_kind(content_type)}_count": _plus(f"{file_kind(content_type)}_count", 1),
+        **_usage_fields(llm_usage),
+    }
+    if succeeded:
+        fields.update({
+            "total_processing_time_ms": _plus("total_processing_time_ms", processing_time_ms),
+            "min_processing_time_ms": {
+                "$min": [{"$ifNull": ["$min_processing_time_ms", processing_time_ms]}, processing_time_ms]
+            },
+            "max_processing_time_ms": {
+                "$max": [{"$ifNull": ["$max_processing_time_ms", processing_time_ms]}, processing_time_ms]
+            },
+        })
+    await _update_metrics_bucket(fields)
+
+
+async def record_enrichment_metrics(llm_usage: Optional[Dict[str, Any]]):
+    """Add the tokens of a deferred enrichment to the hourly processing_metrics document."""
+    await _update_metrics_bucket(_usage_fields(llm_usage))
+
+
+def partial_result_reporter(invoice_id: str):
+    """Progress callback that stores streamed general fields and the item count on the invoice."""
+    async def report(progress: Dict[str, Any]):
+        update: Dict[str, Any] = {"$inc": {"partial_result.items_extracted": progress["items"]}}
+        fields = {
+            f"partial_result.fields.{key}": value
+            for key, value in progress["fields"].items()
+            if "." not in key and not key.startswith("$")
+        }
+        if fields:
+            update["$set"] = fields
+        await get_invoices_collection().update_one({"_id": invoice_id}, update)
+    return report
+
+
+async def enrich_invoice(result: Dict[str, Any], timer: StageTimer, user_id: str, invoice_id: str):
+    """Currency conversion and AI review; neither needs the other, so they run concurrently."""
+    conversion, ai_review = await asyncio.gather(
+        timer.measure("conversion", exchange_tool.convert_to_try(
+            result.get("total_amount", 0), result.get("currency", "TRY"), result.get("date")
+        )),
+        timer.measure("review", reviewer_agent.review_invoice(result, user_id, invoice_id)),
+    )
+    result["conversion"] = conversion
+    result["ai_review"] = ai_review
+    timer.lap("enrichment")
+
+
+# Follow-up work (deferred enrichment, review flushes) running on the API's loop with DISABLE_CELERY;
+# kept so the tasks are not garbage collected
+_local_background_tasks = set()
+
+
+def schedule_enrichment(invoice_id: str):
+    """Run the conversion and review of a completed invoice in the background."""
+    if DISABLE_CELERY:
+        async def enrich_once():
+            try:
+                await _enrich_invoice_async(invoice_id)
+            except Exception as e:
+                await _mark_enrichment_failed(invoice_id, e)
+
+        task = asyncio.ensure_future(enrich_once())
+        _local_background_tasks.add(task)
+        task.add_done_callback(_local_background_tasks.discard)
+    else:
+        celery.send_task("tasks.enrich_invoice_task", args=[invoice_id])
+
+
+async def complete_invoice(
+    extraction_result: Dict[str, Any],
+    start_time: datetime,
+    timer: StageTimer,
+    llm_usage: UsageTracker,
+    invoice_id: str,
+    user_id: str,
+    batch_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Validate, enrich and save an extraction output (fresh from the LLM or from the cache)."""
+    # Move general_fields to top-level for validators and easier access
+    gen_fields = extraction_result.get("general_fields", {})
+    for k, v in gen_fields.items():
+        if k in ["total_amount", "tax_amount", "tax_rate"]:
+            extraction_result[k] = clean_number(v)
+        elif k not in extraction_result:
+            extraction_result[k] = v
+
+    # Clean items too
+    for item in extraction_result.get("items", []):
+        item["quantity"] = clean_number(item.get("quantity"))
+        item["unit_price"] = clean_number(item.get("unit_price"))
+        item["total_price"] = clean_number(item.get("total_price"))
+
+    # 2. Validation
+    validation_results = DataValidator.validate_invoice(extraction_result)
+    extraction_result.update(validation_results)
+    timer.lap("validation")
+
+    # 4. Agentic Review & Tools (currency conversion + AI reviewer)
+    if not DEFER_ENRICHMENT:
+        await enrich_invoice(extraction_result, timer, user_id, invoice_id)
+
+    # 5. Add metadata
+    processing_time = (datetime.utcnow() - start_time).total_seconds() * 1000
+    extraction_result["processing_time_ms"] = int(processing_time)
+    extraction_result["raw_result"] = extraction_result.copy()
+    extraction_result["llm_usage"] = llm_usage.to_dict()
+    extraction_result["stage_timings_ms"] = timer.timings_ms
+    if DEFER_ENRICHMENT:
+        extraction_result["enrichment_status"] = "pending"
+
+    # 6. Save to Database
+    await save_to_mongodb(invoice_id, extraction_result, "completed")
+    timer.lap("save")
+
+    with after_save(invoice_id, "Review scheduling"):
+        if DEFER_ENRICHMENT:
+            schedule_enrichment(invoice_id)
+        else:
+            await queue_batched_review(extraction_result, invoice_id, user_id, batch_id)
+    return extraction_result
+
+
+@contextmanager
+def after_save(invoice_id: str, step: str):
+    """
+    Guard follow-up work on an invoice already saved as completed: a failure is
+    only logged, so it neither marks the invoice failed nor re-extracts it.
+    """
+    try:
+        yield
+    except Exception as e:
+        print(f"{step} of completed invoice {invoice_id} failed: {e}")
+
+
+async def record_failure(invoice_id: str, content_type: Optional[str], usage: Dict[str, Any], error: Exception):
+    """Save an invoice as failed and count it in the metrics."""
+    await save_to_mongodb(invoice_id, {"llm_usage": usage}, "failed", error=str(error))
+    await record_processing_metrics("failed", 0, content_type, usage)
+    log_invoice_processing(
+        invoice_id=invoice_id,
+        status="failed",
+        processing_time_ms=0,
+        llm_provider=engine.llm_provider.__class__.__name__,
+        file_type=content_type,
+        error=str(error)
+    )
+
+
+async def _process_invoice_async(
+    file_path: str,
+    content_type: str,
+    invoice_id: str,
+    user_id: str,
+    batch_id: Optional[str] = None
+):
     """Core async processing logic for MongoDB."""
     start_time = datetime.utcnow()
     ACTIVE_TASKS.inc()
+    llm_usage = start_usage_tracking()
+    timer = StageTimer()
     
     try:
-        # 1. AI Extraction
-        extraction_result = await engine.process_invoice(file_path, content_type)
-        
-        # Move general_fields to top-level for validators and easier access
-        gen_fields = extraction_result.get("general_fields", {})
-        for k, v in gen_fields.items():
-            if k in ["total_amount", "tax_amount", "tax_rate"]:
-                extraction_result[k] = clean_number(v)
-            elif k not in extraction_result:
-                extraction_result[k] = v
-        
-        # Clean items too
-        for item in extraction_result.get("items", []):
-            item["quantity"] = clean_number(item.get("quantity"))
-            item["unit_price"] = clean_number(item.get("unit_price"))
-            item["total_price"] = clean_number(item.get("total_price"))
-
-        # 2. Validation
-        validation_results = DataValidator.validate_invoice(extraction_result)
-        extraction_result.update(validation_results)
-        
-        # 4. Agentic Review & Tools
-        # A. Currency Conversion
-        currency = extraction_result.get("currency", "TRY")
-        amount = extraction_result.get("total_amount", 0)
-        conversion = await exchange_tool.convert_to_try(amount, currency)
-        extraction_result["conversion"] = conversion
-
-        # B. AI Reviewer Agent
-        ai_review = await reviewer_agent.review_invoice(extraction_result)
-        extraction_result["ai_review"] = ai_review
-
-        # 5. Add metadata
-        processing_time = (datetime.utcnow() - start_time).total_seconds() * 1000
-        extraction_result["processing_time_ms"] = int(processing_time)
-        extraction_result["raw_result"] = extraction_result.copy()
-        
-        # 6. Save to Database
-        await save_to_mongodb(invoice_id, extraction_result, "completed")
+        # 1. AI Extraction (streamed fields are stored on the invoice as they arrive)
+        extraction_result = await engine.process_invoice(
+            file_path, content_type, on_progress=partial_result_reporter(invoice_id), user_id=user_id
+        )
+        timer.lap("extraction")
+
+        await complete_invoice(extraction_result, start_time, timer, llm_usage, invoice_id, user_id, batch_id)
+        processing_time = extraction_result["processing_time_ms"]
+
+        # 7. Remember the extraction for re-uploads of the same file
+        with after_save(invoice_id, "Extraction cache store"):
+            await store_in_cache(file_path, extraction_result, invoice_id)
+
+        # 8. A verified LLM extraction teaches its supplier's layout template (off the extraction path)
+        with after_save(invoice_id, "Supplier template learning"):
+            await engine.learn_supplier_template(file_path, extraction_result, user_id)
         
         # 5. Metrics
-        log_invoice_processing(
-            invoice_id=invoice_id,
-            status="completed",
-            processing_time_ms=int(processing_time),
-            llm_provider=engine.llm_provider.__class__.__name__,
-            file_type=content_type
-        )
+        with after_save(invoice_id, "Metrics recording"):
+            log_invoice_processing(
+                invoice_id=invoice_id,
+                status="completed",
+                processing_time_ms=processing_time,
+                llm_provider=engine.llm_provider.__class__.__name__,
+                file_type=content_type
+            )
+            await record_processing_metrics(
+                "completed", processing_time, content_type, extraction_result["llm_usage"]
+            )
         
         return extraction_result
         
     except Exception as e:
-        await save_to_mongodb(invoice_id, {}, "failed", error=str(e))
-        log_invoice_processing(
-            invoice_id=invoice_id,
-            status="failed",
-            processing_time_ms=0,
-            llm_provider=engine.llm_provider.__class__.__name__,
-            file_type=content_type,
-            error=str(e)
-        )
+        await record_failure(invoice_id, content_type, llm_usage.to_dict(), e)
         raise e
     finally:
         ACTIVE_TASKS.dec()
@@ -219,6 +471,210 @@ async def _process_invoice_async(file_path: str, content_type: str, invoice_id:
         # if os.path.exists(file_path): os.remove(file_path)
 
 
+async def store_in_cache(file_path: str, result: Dict[str, Any], invoice_id: str):
+    try:
+        await extraction_cache.store(
+            ExtractionCache.hash_file(file_path),
+            engine.llm_provider.__class__.__name__,
+            getattr(engine.llm_provider, "model_name", None),
+            result,
+            invoice_id
+        )
+    except Exception as e:
+        print(f"Extraction cache store failed: {e}")
+
+
+async def _enrich_invoice_async(invoice_id: str) -> Optional[Dict[str, Any]]:
+    """Attach conversion and AI review to an invoice saved with DEFER_ENRICHMENT."""
+    await connect_to_mongo()
+    invoices_col = get_invoices_collection()
+    invoice = await invoices_col.find_one({"_id": invoice_id})
+    if invoice is None or invoice.get("status") != "completed":
+        return None
+
+    result = invoice.get("raw_result") or {}
+    llm_usage = start_usage_tracking()
+    timer = StageTimer()
+    await enrich_invoice(result, timer, invoice["user_id"], invoice_id)
+
+    usage = UsageTracker.from_dict(invoice.get("llm_usage"))
+    usage.merge(llm_usage)
+    enrichment = {"ai_review": result["ai_review"], "conversion": result["conversion"]}
+    await invoices_col.update_one(
+        {"_id": invoice_id},
+        {"$set": {
+            **enrichment,
+            "raw_result.ai_review": result["ai_review"],
+            "raw_result.conversion": result["conversion"],
+            "enrichment_status": "completed",
+            "llm_usage": usage.to_dict(),
+            **{f"stage_timings_ms.{stage}": ms for stage, ms in timer.timings_ms.items()},
+            "updated_at": datetime.utcnow(),
+        }}
+    )
+    await record_enrichment_metrics(llm_usage.to_dict())
+
+    invoice.update(enrichment, enrichment_status="completed")
+    await webhook_service.trigger_for_invoice(
+        invoice["user_id"], invoice, event_type="invoice.enriched", extra_data=enrichment
+    )
+    await queue_batched_review(result, invoice_id, invoice["user_id"], invoice.get("batch_id"))
+    return result
+
+
+async def _mark_enrichment_failed(invoice_id: str, error: Exception):
+    """Give up on the deferred enrichment of an invoice (after its last retry)."""
+    print(f"Enrichment of invoice {invoice_id} failed: {error}")
+    await connect_to_mongo()
+    await get_invoices_collection().update_one(
+        {"_id": invoice_id},
+        {"$set": {"enrichment_status": "failed", "updated_at": datetime.utcnow()}}
+    )
+
+
+def _sum_usage(usages) -> Dict[str, Any]:
+    """Combined llm_usage shares of a batched review, for processing_metrics."""
+    total: Dict[str, Any] = {}
+    for usage in usages:
+        for key, value in usage.items():
+            if key != "stages":
+                total[key] = total.get(key, 0) + value
+    total["stages"] = {"review": {"total_tokens": total.get("total_tokens", 0)}}
+    return total
+
+
+def schedule_review_flush(group: str, delay: float):
+    """Flush a review batch group after delay seconds."""
+    if DISABLE_CELERY:
+        async def flush_later():
+            await asyncio.sleep(delay)
+            try:
+                await _flush_review_batch_async(group)
+            except Exception as e:
+                print(f"Review batch flush for {group} failed: {e}")
+
+        task = asyncio.ensure_future(flush_later())
+        _local_background_tasks.add(task)
+        task.add_done_callback(_local_background_tasks.discard)
+    else:
+        celery.send_task("tasks.flush_review_batch_task", args=[group], countdown=delay)
+
+
+async def queue_batched_review(result: Dict[str, Any], invoice_id: str, user_id: str, batch_id: Optional[str]):
+    """Hand a saved invoice whose review is batch_pending to the batch reviewer."""
+    if (result.get("ai_review") or {}).get("review_source") != "batch_pending":
+        return
+    batcher = reviewer_agent.batcher
+    group, pending = await reviewer_agent.queue_review(result, invoice_id, user_id, batch_id)
+    if pending >= batcher.batch_size:
+        schedule_review_flush(group, 0)
+    elif pending == 1:
+        # First entry of a new batch: whatever has gathered by then is flushed after the max wait
+        schedule_review_flush(group, batcher.max_wait_seconds)
+
+
+async def _flush_review_batch_async(group: str) -> int:
+    """Review the queued invoices of a group and notify webhooks; returns the number reviewed."""
+    await connect_to_mongo()
+    entries = await reviewer_agent.batcher.flush(group)
+    if not entries:
+        return 0
+
+    reviews = {entry["_id"]: entry["review"] for entry in entries}
+    await record_enrichment_metrics(_sum_usage(entry["llm_usage"] for entry in entries))
+
+    async for invoice in get_invoices_collection().find({"_id": {"$in": list(reviews)}}):
+        await webhook_service.trigger_for_invoice(
+            invoice["user_id"], invoice, event_type="invoice.reviewed", extra_data={"ai_review": reviews[invoice["_id"]]}
+        )
+    return len(entries)
+
+
+async def _sweep_review_queue_async() -> int:
+    """Flush the review groups whose scheduled flush was lost or died; returns the number reviewed."""
+    await connect_to_mongo()
+    reviewed = 0
+    for group in await reviewer_agent.batcher.overdue_groups():
+        try:
+            reviewed += await _flush_review_batch_async(group)
+        except Exception as e:
+            print(f"Review batch flush for {group} failed: {e}")
+    return reviewed
+
+
+async def run_review_sweeper():
+    """Sweep the review queue periodically on the API's loop (with DISABLE_CELERY there is no beat)."""
+    while True:
+        try:
+            await _sweep_review_queue_async()
+        except Exception as e:
+            print(f"Review queue sweep failed: {e}")
+        await asyncio.sleep(reviewer_agent.batcher.sweep_seconds)
+
+
+async def lookup_cached_extraction(content_hash: str) -> Optional[Dict[str, Any]]:
+    """Cache entry of an identical file's extraction; None on a miss (or when the cache is unavailable)."""
+    try:
+        return await extraction_cache.lookup(
+            content_hash,
+            engine.llm_provider.__class__.__name__,
+            getattr(engine.llm_provider, "model_name", None)
+        )
+    except Exception as e:
+        print(f"Extraction cache lookup failed: {e}")
+        return None
+
+
+async def _complete_cached_invoice_async(
+    invoice_id: str,
+    cached_result: Dict[str, Any],
+    cached_from: Optional[str],
+    content_type: str,
+    user_id: str,
+    batch_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Complete an invoice from the cached extraction of an identical file (see
+    lookup_cached_extraction). Only the LLM call is skipped; validation,
+    conversion and review run for this invoice.
+    """
+    await connect_to_mongo()
+    start_time = datetime.utcnow()
+    llm_usage = start_usage_tracking()
+    timer = StageTimer()
+    result = {k: v for k, v in cached_result.items() if k in CACHED_FIELDS}
+    # Fresh item IDs for the new invoice
+    for item in result.get("items", []):
+        item.pop("id", None)
+    result.setdefault("_metadata", {})["cache_hit"] = True
+
+    try:
+        await get_invoices_collection().update_one({"_id": invoice_id}, {"$set": {"cached_from": cached_from}})
+        await complete_invoice(result, start_time, timer, llm_usage, invoice_id, user_id, batch_id)
+    except Exception as e:
+        await record_failure(invoice_id, content_type, llm_usage.to_dict(), e)
+        raise e
+    processing_time = result["processing_time_ms"]
+
+    with after_save(invoice_id, "Metrics recording"):
+        log_invoice_processing(
+            invoice_id=invoice_id,
+            status="completed",
+            processing_time_ms=processing_time,
+            llm_provider=engine.llm_provider.__class__.__name__,
+            file_type=content_type
+        )
+        await record_processing_metrics("completed", processing_time, content_type, result["llm_usage"])
+    return result
+
+
+def is_transient_error(exc: Exception) -> bool:
+    """Errors worth retrying (rate limits, quotas, timeouts, dropped connections)."""
+    error_str = str(exc).lower()
+    transient_errors = ["429", "quota", "rate limit", "connection", "timeout", "resource_exhausted"]
+    return any(err in error_str for err in transient_errors)
+
+
 @celery.task(
     name="tasks.process_invoice_task", 
     bind=True, 
@@ -228,15 +684,64 @@ async def _process_invoice_async(file_path: str, content_type: str, invoice_id:
     retry_backoff_max=600,
     retry_jitter=True
 )
-def process_invoice_task(self, file_path: str, content_type: str, invoice_id: str, user_id: str):
+def process_invoice_task(
+    self,
+    file_path: str,
+    content_type: str,
+    invoice_id: str,
+    user_id: str,
+    batch_id: Optional[str] = None
+):
     """Celery task entry point with advanced retry logic."""
     try:
-        return asyncio.run(_process_invoice_async(file_path, content_type, invoice_id, user_id))
+        return run_in_worker_loop(_process_invoice_async(file_path, content_type, invoice_id, user_id, batch_id))
     except Exception as exc:
         # Retry on common transient errors
-        error_str = str(exc).lower()
-        transient_errors = ["429", "quota", "rate limit", "connection", "timeout", "resource_exhausted"]
-        
-        if any(err in error_str for err in transient_errors):
+        if is_transient_error(exc):
+            raise self.retry(exc=exc)
+        raise exc
+
+
+@celery.task(name="tasks.complete_cached_invoice_task", bind=True, max_retries=3, default_retry_delay=30)
+def complete_cached_invoice_task(
+    self,
+    invoice_id: str,
+    cached_result: Dict[str, Any],
+    cached_from: Optional[str],
+    content_type: str,
+    user_id: str,
+    batch_id: Optional[str] = None
+):
+    """Validation, enrichment and save of a re-uploaded invoice from the extraction cache."""
+    try:
+        return run_in_worker_loop(_complete_cached_invoice_async(
+            invoice_id, cached_result, cached_from, content_type, user_id, batch_id
+        ))
+    except Exception as exc:
+        if is_transient_error(exc):
+            raise self.retry(exc=exc)
+        raise exc
+
+
+@celery.task(name="tasks.enrich_invoice_task", bind=True, max_retries=3, default_retry_delay=30)
+def enrich_invoice_task(self, invoice_id: str):
+    """Deferred conversion and AI review of an invoice that is already completed."""
+    try:
+        return run_in_worker_loop(_enrich_invoice_async(invoice_id))
+    except Exception as exc:
+        if is_transient_error(exc) and self.request.retries < self.max_retries:
             raise self.retry(exc=exc)
+        run_in_worker_loop(_mark_enrichment_failed(invoice_id, exc))
         raise exc
+
+
+@celery.task(name="tasks.flush_review_batch_task")
+def flush_review_batch_task(group: str):
+    """Batched LLM review of the invoices queued for a group."""
+    return run_in_worker_loop(_flush_review_batch_async(group))
+
+
+@celery.task(name="tasks.sweep_review_queue_task")
+def sweep_review_queue_task():
+    """Periodic flush of review groups left behind by a lost or crashed flush."""
+    return run_in_worker_loop(_sweep_review_queue_async())
@@ -0,0 +1,70 @@
+import glob
+import json
+import math
+import os
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SAMPLES_DIR = os.getenv("SAMPLES_DIR", "samples")
+
+
+def sample_pdfs():
+    """All PDFs in the samples directory, sorted for stable output."""
+    files = sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.pdf")))
+    if not files:
+        sys.exit(f"No sample PDFs found in {SAMPLES_DIR}")
+    return files
+
+
+def build_provider():
+    """Build the LLM provider the same way the worker does (LLM_PROVIDER / LLM_RECORD_DIR env)."""
+    from app.core.extraction_engine import GeminiProvider, LocalLLMProvider
+    from app.core.replay_provider import ReplayProvider, RecordingProvider
+
+    provider_type = os.getenv("LLM_PROVIDER", "gemini")
+    if provider_type == "gemini":
+        provider = GeminiProvider(api_key=os.getenv("GOOGLE_API_KEY"))
+    elif provider_type == "replay":
+        provider = ReplayProvider(os.getenv("LLM_REPLAY_DIR", "recordings"))
+    else:
+        provider = LocalLLMProvider(
+            base_url=os.getenv("LOCAL_LLM_URL", "http://localhost:1234/v1"),
+            model_name=os.getenv("LOCAL_LLM_MODEL", "qwen/qwen3-vl-4b"),
+        )
+    if os.getenv("LLM_RECORD_DIR"):
+        provider = RecordingProvider(provider, os.getenv("LLM_RECORD_DIR"))
+    return provider
+
+
+def record_raw_outputs(provider, outputs):
+    """Keep every raw model response (the local provider may send several per invoice)."""
+    name = "_chat_completion" if provider.name == "local" else "generate_json"
+    original = getattr(provider, name)
+
+    async def recorded(*args, **kwargs):
+        text = await original(*args, **kwargs)
+        outputs.append(text)
+        return text
+
+    setattr(provider, name, recorded)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def write_report(report, output=None):
+    """Print the JSON report and optionally save it for comparison across commits."""
+    text = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    print(text)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
@@ -0,0 +1,102 @@
+"""
+Page image encoding benchmark.
+
+Renders every PDF in samples/ with a set of encoding policies and reports
+bytes per page and encode time. With --with-llm, each policy is also run
+through the configured LLM provider (vision path forced) and its general
+fields and item count are compared against the full-colour PNG baseline.
+
+    python -m tests.benchmarks.encoding_bench [--with-llm] [--output report.json]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from tests.benchmarks.common import sample_pdfs, build_provider, write_report
+
+os.environ["TEXT_FAST_PATH_ENABLED"] = "false"
+
+from app.core.extraction_engine import ExtractionEngine  # noqa: E402
+from app.core.page_images import ImageEncodingPolicy  # noqa: E402
+
+POLICIES = {
+    "png": ImageEncodingPolicy("png"),
+    "png_gray": ImageEncodingPolicy("png", grayscale=True),
+    "png_gray_16": ImageEncodingPolicy("png", grayscale=True, palette_colors=16),
+    "jpeg_85": ImageEncodingPolicy("jpeg", quality=85),
+    "jpeg_70_gray": ImageEncodingPolicy("jpeg", quality=70, grayscale=True),
+    "webp_80": ImageEncodingPolicy("webp", quality=80),
+    "webp_70_gray": ImageEncodingPolicy("webp", quality=70, grayscale=True),
+}
+
+GENERAL_FIELDS = ["invoice_number", "date", "supplier_name", "total_amount", "currency", "tax_amount", "tax_rate"]
+
+
+def field_accuracy(result, baseline):
+    """Share of general fields (plus item count) that match the baseline extraction."""
+    gf = result.get("general_fields", {})
+    base_gf = baseline.get("general_fields", {})
+    matches = sum(1 for f in GENERAL_FIELDS if str(gf.get(f)).strip().lower() == str(base_gf.get(f)).strip().lower())
+    matches += int(len(result.get("items", [])) == len(baseline.get("items", [])))
+    return round(matches / (len(GENERAL_FIELDS) + 1), 3)
+
+
+def measure_sizes(engine, files):
+    report = {}
+    for name, policy in POLICIES.items():
+        engine.image_policy = policy
+        total_bytes, pages, started = 0, 0, time.perf_counter()
+        for file_path in files:
+            for page in engine.convert_pdf_to_images(file_path):
+                total_bytes += len(page.data)
+                pages += 1
+        elapsed = time.perf_counter() - started
+        report[name] = {
+            "pages": pages,
+            "bytes_per_page": total_bytes // max(pages, 1),
+            "render_encode_ms_per_page": round(elapsed * 1000 / max(pages, 1), 1),
+        }
+    baseline = report["png"]["bytes_per_page"]
+    for stats in report.values():
+        stats["size_vs_png"] = round(stats["bytes_per_page"] / baseline, 3)
+    return report
+
+
+async def measure_accuracy(engine, files, report):
+    baselines = {}
+    for name, policy in POLICIES.items():
+        engine.image_policy = policy
+        scores, latencies = [], []
+        for file_path in files:
+            started = time.perf_counter()
+            try:
+                result = await engine.process_invoice(file_path, "application/pdf")
+            except Exception as e:
+                print(f"[{name}] {os.path.basename(file_path)} failed: {e}")
+                scores.append(0.0)
+                continue
+            latencies.append(time.perf_counter() - started)
+            if name == "png":
+                baselines[file_path] = result
+            scores.append(field_accuracy(result, baselines.get(file_path, {})))
+        report[name]["accuracy_vs_png"] = round(sum(scores) / len(scores), 3)
+        report[name]["avg_latency_s"] = round(sum(latencies) / len(latencies), 2) if latencies else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--with-llm", action="store_true", help="also run extraction and compare accuracy")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    files = sample_pdfs()
+    engine = ExtractionEngine(llm_provider=build_provider() if args.with_llm else None)
+    report = measure_sizes(engine, files)
+    if args.with_llm:
+        asyncio.run(measure_accuracy(engine, files, report))
+    write_report({"samples": len(files), "dpi_scale": engine.dpi_scale, "policies": report}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Line item output format benchmark.
+
+Runs the samples/ PDFs, plus optional synthetic item-heavy text invoices,
+through the configured LLM provider with items as objects and as compact
+item_rows, and reports output size, wall time and how closely the rows
+results match the objects results.
+
+    python -m tests.benchmarks.items_format_bench [--synthetic-items 50,150] [--runs 2] [--output report.json]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from app.core.extraction_engine import ExtractionEngine
+from tests.benchmarks.common import sample_pdfs, build_provider, record_raw_outputs, write_report
+
+FORMATS = ["objects", "rows"]
+
+
+def write_synthetic_invoice(item_count, directory):
+    """Plain-text invoice with item_count line items (processed on the text path)."""
+    lines = [
+        f"INVOICE No: BENCH-{item_count}",
+        "Date: 15.03.2024",
+        "Supplier: Benchmark Supplies Ltd.",
+        "",
+        "Item | Qty | Unit Price | Total",
+    ]
+    net = 0.0
+    for i in range(1, item_count + 1):
+        qty, price = i % 7 + 1, round(3.5 + i * 1.25, 2)
+        net += qty * price
+        lines.append(f"Spare part model X-{i:04d} | {qty} | {price:.2f} | {qty * price:.2f}")
+    lines += ["", f"Net: {net:.2f} TRY", f"VAT 20%: {net * 0.2:.2f} TRY", f"Total: {net * 1.2:.2f} TRY"]
+
+    path = os.path.join(directory, f"synthetic_{item_count}_items.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return path
+
+
+def item_agreement(result, baseline):
+    """Share of baseline items whose total_price matches at the same position."""
+    items, base_items = result.get("items", []), baseline.get("items", [])
+    if not base_items:
+        return 1.0 if not items else 0.0
+    matches = sum(
+        1 for item, base in zip(items, base_items)
+        if item.get("total_price") == base.get("total_price")
+    )
+    return round(matches / len(base_items), 3)
+
+
+async def run_file(file_path, runs):
+    stats, baseline = {}, None
+    for items_format in FORMATS:
+        provider = build_provider()
+        provider.items_format = items_format
+        engine = ExtractionEngine(llm_provider=provider)
+        outputs, latencies, result = [], [], None
+        record_raw_outputs(provider, outputs)
+
+        content_type = "application/pdf" if file_path.endswith(".pdf") else "text/plain"
+        for _ in range(runs):
+            started = time.perf_counter()
+            try:
+                result = await engine.process_invoice(file_path, content_type)
+            except Exception as e:
+                print(f"[{items_format}] {os.path.basename(file_path)} failed: {e}")
+                continue
+            latencies.append(time.perf_counter() - started)
+
+        chars = sum(len(text) for text in outputs) / max(len(outputs), 1)
+        stats[items_format] = {
+            "items": len(result.get("items", [])) if result else None,
+            "avg_output_chars": round(chars),
+            "avg_est_output_tokens": round(chars / 4),
+            "avg_latency_s": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        }
+        if items_format == "objects":
+            baseline = result
+        elif result and baseline:
+            stats[items_format]["item_agreement_vs_objects"] = item_agreement(result, baseline)
+
+    objects, rows = stats["objects"], stats["rows"]
+    if objects["avg_output_chars"] and rows["avg_output_chars"]:
+        stats["output_size_rows_vs_objects"] = round(rows["avg_output_chars"] / objects["avg_output_chars"], 3)
+    if objects["avg_latency_s"] and rows["avg_latency_s"]:
+        stats["latency_rows_vs_objects"] = round(rows["avg_latency_s"] / objects["avg_latency_s"], 3)
+    return stats
+
+
+async def run(files, runs):
+    return {os.path.basename(file_path): await run_file(file_path, runs) for file_path in files}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic-items", default="", help="comma-separated item counts for synthetic invoices")
+    parser.add_argument("--runs", type=int, default=2, help="extractions per file and format")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = sample_pdfs() + [
+            write_synthetic_invoice(int(count), tmp) for count in args.synthetic_items.split(",") if count
+        ]
+        report = asyncio.run(run(files, args.runs))
+    write_report({"runs": args.runs, "files": report}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Gemini PDF input benchmark.
+
+Runs every PDF in samples/ through Gemini with rendered page images plus
+extracted text (GEMINI_PDF_MODE=images) and with the original PDF sent
+natively (GEMINI_PDF_MODE=native), and reports per mode:
+
+- avg_latency_s: wall time of process_invoice, rendering included
+- avg_prompt_tokens / avg_completion_tokens: from Gemini usage metadata
+- extraction_paths: how the engine routed each document
+
+    python -m tests.benchmarks.pdf_mode_bench [--runs 2] [--output report.json]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+from app.core.extraction_engine import ExtractionEngine, GeminiProvider
+from tests.benchmarks.common import sample_pdfs, build_provider, write_report
+
+MODES = ["images", "native"]
+
+
+def record_usage(provider, usages):
+    """Keep the usage metadata of every Gemini response."""
+    original = provider._record_usage
+
+    def recorded(usage):
+        if usage:
+            usages.append(usage)
+        original(usage)
+
+    provider._record_usage = recorded
+
+
+def average(values):
+    return round(sum(values) / len(values), 2) if values else None
+
+
+async def run_mode(files, runs, pdf_mode):
+    provider = build_provider()
+    provider.pdf_mode = pdf_mode
+    engine = ExtractionEngine(llm_provider=provider)
+    usages, latencies, paths, failures = [], [], Counter(), 0
+    record_usage(provider, usages)
+
+    for _ in range(runs):
+        for file_path in files:
+            started = time.perf_counter()
+            try:
+                result = await engine.process_invoice(file_path, "application/pdf")
+            except Exception as e:
+                print(f"[{pdf_mode}] {os.path.basename(file_path)} failed: {e}")
+                failures += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            paths[result["_metadata"]["extraction_path"]] += 1
+
+    engine.render_pool.shutdown()
+    return {
+        "extractions": len(latencies),
+        "failed_extractions": failures,
+        "extraction_paths": dict(paths),
+        "avg_latency_s": average(latencies),
+        "avg_prompt_tokens": average([u.prompt_token_count or 0 for u in usages]),
+        "avg_completion_tokens": average([u.candidates_token_count or 0 for u in usages]),
+    }
+
+
+async def run(files, runs):
+    report = {mode: await run_mode(files, runs, mode) for mode in MODES}
+    images, native = report["images"], report["native"]
+    for key in ("avg_latency_s", "avg_prompt_tokens"):
+        if images[key] and native[key]:
+            report[f"{key}_native_vs_images"] = round(native[key] / images[key], 3)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=2, help="passes over the samples per mode")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    if not isinstance(build_provider(), GeminiProvider):
+        sys.exit("PDF mode benchmark needs LLM_PROVIDER=gemini")
+
+    files = sample_pdfs()
+    report = asyncio.run(run(files, args.runs))
+    write_report({"samples": len(files), "runs": args.runs, "modes": report}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+PDF rendering throughput benchmark.
+
+Builds a multi-page PDF from the samples and renders it through
+PdfRenderPool with an increasing number of worker processes, reporting
+pages per second for each pool size.
+
+    python -m tests.benchmarks.render_bench [--pages 40] [--output report.json]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+from tests.benchmarks.common import sample_pdfs, write_report
+from app.core.page_images import ImageEncodingPolicy, RenderScalePolicy
+from app.core.pdf_renderer import PdfRenderPool
+
+
+def build_document(pages: int) -> str:
+    """Concatenate sample pages until the document has the requested page count."""
+    doc = fitz.open()
+    sources = [fitz.open(path) for path in sample_pdfs()]
+    while len(doc) < pages:
+        for src in sources:
+            if len(doc) >= pages:
+                break
+            doc.insert_pdf(src, from_page=0, to_page=0)
+    path = os.path.join(tempfile.mkdtemp(), "render_bench.pdf")
+    doc.save(path)
+    return path
+
+
+def warm_up():
+    return None
+
+
+async def render_all(pool: PdfRenderPool, file_path: str, pages: int) -> float:
+    image_policy, scale_policy = ImageEncodingPolicy.from_env(), RenderScalePolicy.from_env()
+    # Start every worker first so process start-up is not measured
+    await asyncio.gather(*(pool.run(warm_up) for _ in range(pool.workers)))
+    started = time.perf_counter()
+    rendered = [page async for page in pool.iter_pages(file_path, list(range(pages)), image_policy, scale_policy)]
+    assert len(rendered) == pages
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--workers", help="comma-separated pool sizes (default: 1, 2, 4, 8 up to the core count)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    file_path = build_document(args.pages)
+    cpu_count = os.cpu_count() or 1
+    if args.workers:
+        worker_counts = [int(w) for w in args.workers.split(",")]
+    else:
+        worker_counts = sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+
+    results = []
+    for workers in worker_counts:
+        pool = PdfRenderPool()
+        pool.mode, pool.workers = "process", workers
+        elapsed = asyncio.run(render_all(pool, file_path, args.pages))
+        pool.shutdown()
+        results.append({
+            "workers": workers,
+            "seconds": round(elapsed, 3),
+            "pages_per_second": round(args.pages / elapsed, 1),
+        })
+
+    base = results[0]["pages_per_second"]
+    for row in results:
+        row["speedup"] = round(row["pages_per_second"] / base, 2)
+    write_report({"pages": args.pages, "cpu_count": cpu_count, "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
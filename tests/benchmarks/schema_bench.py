@@ -0,0 +1,88 @@
+"""
+Structured output benchmark.
+
+Runs every PDF in samples/ through the configured LLM provider with the
+prose-only schema (LLM_STRUCTURED_OUTPUT off) and with schema-constrained
+decoding, and reports output size and parse failures for each mode:
+
+- strict_parse_failures: raw responses that are not valid JSON as-is
+- parse_failures: responses that still fail after clean_json_response,
+  i.e. the ones that fail the Celery task and trigger a retry
+
+Output tokens are estimated as characters / 4.
+
+    python -m tests.benchmarks.schema_bench [--runs 3] [--output report.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from app.core.extraction_engine import ExtractionEngine, clean_json_response
+from tests.benchmarks.common import sample_pdfs, build_provider, record_raw_outputs, write_report
+
+MODES = {"prose": False, "schema": True}
+
+
+def parses(text, cleanup):
+    try:
+        json.loads(clean_json_response(text) if cleanup else text)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+async def run_mode(engine, files, runs, structured):
+    engine.llm_provider.structured_output = structured
+    outputs, latencies, task_failures = [], [], 0
+    record_raw_outputs(engine.llm_provider, outputs)
+
+    for _ in range(runs):
+        for file_path in files:
+            started = time.perf_counter()
+            try:
+                await engine.process_invoice(file_path, "application/pdf")
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                print(f"[{'schema' if structured else 'prose'}] {os.path.basename(file_path)} failed: {e}")
+                task_failures += 1
+
+    chars = [len(text) for text in outputs]
+    return {
+        "responses": len(outputs),
+        "avg_output_chars": round(sum(chars) / len(chars)) if chars else None,
+        "avg_est_output_tokens": round(sum(chars) / len(chars) / 4) if chars else None,
+        "strict_parse_failures": sum(1 for text in outputs if not parses(text, cleanup=False)),
+        "parse_failures": sum(1 for text in outputs if not parses(text, cleanup=True)),
+        "failed_extractions": task_failures,
+        "avg_latency_s": round(sum(latencies) / len(latencies), 2) if latencies else None,
+    }
+
+
+async def run(files, runs):
+    report = {}
+    for mode, structured in MODES.items():
+        # Fresh provider per mode so the recording wrapper does not stack
+        engine = ExtractionEngine(llm_provider=build_provider())
+        report[mode] = await run_mode(engine, files, runs, structured)
+
+    prose, schema = report["prose"], report["schema"]
+    if prose["avg_output_chars"] and schema["avg_output_chars"]:
+        report["output_size_schema_vs_prose"] = round(schema["avg_output_chars"] / prose["avg_output_chars"], 3)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="passes over the samples per mode")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    files = sample_pdfs()
+    report = asyncio.run(run(files, args.runs))
+    write_report({"samples": len(files), "runs": args.runs, "modes": report}, args.output)
+
+
+if __name__ == "__main__":
+    main()
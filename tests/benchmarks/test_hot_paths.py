@@ -0,0 +1,297 @@
+"""
+Microbenchmarks for the CPU hot paths of the worker (everything but the LLM call).
+
+Synthetic invoices of 10/100/1000 items and generated PDFs of 1/10/50 pages,
+timed with pytest-benchmark (pip install -r requirements-dev.txt):
+
+    pytest tests/benchmarks/test_hot_paths.py
+    pytest tests/benchmarks/test_hot_paths.py --benchmark-autosave
+    pytest tests/benchmarks/test_hot_paths.py --benchmark-compare --benchmark-compare-fail=mean:15%
+
+Every case also has to stay under its mean-time budget in hot_path_budgets.json,
+so a slowdown fails the run before deploy. The budgets have headroom for slower
+CI machines; HOT_PATH_BUDGET_SCALE multiplies them all (e.g. 2 on a busy runner).
+"""
+import copy
+import json
+import os
+import random
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import fitz  # PyMuPDF
+
+from app.core import supplier_templates
+from app.core.export_service import ExportService
+from app.core.extraction_engine import ExtractionEngine, clean_json_response, expand_item_rows
+from app.core.pdf_renderer import extract_page_layouts
+from app.core.prompts import ITEM_COLUMNS
+from app.core.tools.rate_history import RateHistory, RateSeries
+from app.core.validators import DataValidator, clean_number
+from app.database.models import invoice_helper
+
+BUDGETS = json.loads((Path(__file__).parent / "hot_path_budgets.json").read_text(encoding="utf-8"))
+BUDGET_SCALE = float(os.getenv("HOT_PATH_BUDGET_SCALE", "1"))
+ITEM_COUNTS = [10, 100, 1000]
+PAGE_COUNTS = [1, 10, 50]
+PRODUCTS = ["Steel bolt M8", "Copper cable 2.5mm", "LED panel 60x60", "Cement 50kg", "Paint 15L", "Wall plug 8mm"]
+
+
+@pytest.fixture
+def within_budget(benchmark, request):
+    """Fail the test when the benchmark's mean exceeds its budget."""
+    yield
+    stats = benchmark.stats
+    if stats is None:  # --benchmark-disable
+        return
+    budget = BUDGETS.get(request.node.name)
+    assert budget is not None, f"No budget for {request.node.name} in hot_path_budgets.json"
+    mean = stats.stats.mean
+    assert mean <= budget * BUDGET_SCALE, (
+        f"{request.node.name}: mean {mean * 1000:.2f} ms exceeds budget {budget * BUDGET_SCALE * 1000:.2f} ms"
+    )
+
+
+# ===== Synthetic data =====
+
+def synthetic_items(count, seed=0):
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        quantity, unit_price = rng.randint(1, 20), round(rng.uniform(2, 500), 2)
+        items.append({
+            "product_name": f"{rng.choice(PRODUCTS)} #{i + 1}",
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "total_price": round(quantity * unit_price, 2),
+            "description": None,
+        })
+    return items
+
+
+def synthetic_invoice(item_count, seed=0):
+    """Extraction result as the engine returns it."""
+    items = synthetic_items(item_count, seed)
+    net = round(sum(item["total_price"] for item in items), 2)
+    return {
+        "general_fields": {
+            "invoice_number": f"BENCH-{seed + 1:04d}",
+            "date": (date(2024, 3, 15) + timedelta(days=17 * seed)).strftime("%d.%m.%Y"),
+            "supplier_name": "Bench Supplies Ltd.",
+            "total_amount": round(net * 1.2, 2),
+            "currency": "TRY",
+            "tax_amount": round(net * 0.2, 2),
+            "tax_rate": 20,
+        },
+        "items": items,
+    }
+
+
+def llm_response(item_count):
+    """Fenced, prose-wrapped item_rows answer, like an unconstrained model sends it."""
+    invoice = synthetic_invoice(item_count)
+    invoice["item_rows"] = [[item[column] for column in ITEM_COLUMNS] for item in invoice.pop("items")]
+    body = json.dumps(invoice, ensure_ascii=False, indent=2)
+    return f"Sure, here is the extracted data:\n```json\n{body}\n```\nLet me know if you need anything else."
+
+
+def invoice_document(item_count):
+    """Invoice as stored in MongoDB."""
+    invoice = synthetic_invoice(item_count)
+    fields = invoice["general_fields"]
+    return {
+        "_id": uuid.uuid4().hex,
+        "user_id": "bench",
+        "original_filename": "bench.pdf",
+        "file_type": "application/pdf",
+        "status": "completed",
+        "processing_time_ms": 1234,
+        "invoice_number": fields["invoice_number"],
+        "invoice_date": fields["date"],
+        "supplier_name": fields["supplier_name"],
+        "total_amount": fields["total_amount"],
+        "currency": fields["currency"],
+        "tax_amount": fields["tax_amount"],
+        "tax_rate": fields["tax_rate"],
+        "items": invoice["items"],
+        "created_at": datetime(2024, 3, 15, 12, 0),
+        "updated_at": datetime(2024, 3, 15, 12, 0),
+    }
+
+
+@pytest.fixture(scope="module")
+def pdf_files(tmp_path_factory):
+    """Born-digital PDFs with an invoice-like text layer, one per page count."""
+    directory = tmp_path_factory.mktemp("hot_path_pdfs")
+    files = {}
+    for pages in PAGE_COUNTS:
+        doc = fitz.open()
+        for page_number in range(pages):
+            page = doc.new_page()
+            page.insert_text((50, 60), f"INVOICE BENCH-0001  page {page_number + 1}/{pages}", fontsize=14)
+            for row, item in enumerate(synthetic_items(30, seed=page_number)):
+                line = f"{item['product_name']:<28} {item['quantity']:>3} x {item['unit_price']:>9.2f} = {item['total_price']:>10.2f}"
+                page.insert_text((50, 100 + row * 22), line, fontsize=10)
+        path = directory / f"invoice_{pages}p.pdf"
+        doc.save(str(path))
+        doc.close()
+        files[pages] = str(path)
+    return files
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = ExtractionEngine(llm_provider=None)
+    yield engine
+    engine.render_pool.shutdown()
+
+
+# ===== PDF =====
+
+@pytest.mark.parametrize("pages", PAGE_COUNTS)
+def test_convert_pdf_to_images(benchmark, within_budget, engine, pdf_files, pages):
+    engine.max_pages = pages
+    images = benchmark.pedantic(engine.convert_pdf_to_images, args=(pdf_files[pages],), rounds=3, warmup_rounds=1)
+    assert len(images) == pages
+
+
+@pytest.mark.parametrize("pages", PAGE_COUNTS)
+def test_extract_text_from_pdf(benchmark, within_budget, engine, pdf_files, pages):
+    text = benchmark(engine.extract_text_from_pdf, pdf_files[pages])
+    assert f"--- Page {pages} ---" in text
+
+
+# ===== Invoice data =====
+
+@pytest.mark.parametrize("items", ITEM_COUNTS)
+def test_json_cleanup(benchmark, within_budget, items):
+    response = llm_response(items)
+
+    def parse():
+        return expand_item_rows(json.loads(clean_json_response(response)))
+
+    result = benchmark(parse)
+    assert len(result["items"]) == items
+
+
+@pytest.mark.parametrize("items", ITEM_COUNTS)
+def test_clean_number(benchmark, within_budget, items):
+    values = [f"{item['total_price']:,.2f}".replace(",", " ").replace(".", ",").replace(" ", ".")
+              for item in synthetic_items(items)]
+
+    def clean_all():
+        return [clean_number(value) for value in values]
+
+    cleaned = benchmark(clean_all)
+    assert cleaned[0] == synthetic_items(items)[0]["total_price"]
+
+
+@pytest.mark.parametrize("items", ITEM_COUNTS)
+def test_validate_invoice(benchmark, within_budget, items):
+    invoice = synthetic_invoice(items)
+    invoice.update(invoice["general_fields"])  # the worker lifts the amounts before validating
+
+    def fresh_invoice():
+        # validate_invoice adds its results to the dict, so every round gets a clean copy
+        return (copy.deepcopy(invoice),), {}
+
+    result = benchmark.pedantic(DataValidator.validate_invoice, setup=fresh_invoice, rounds=50)
+    assert all(check["is_valid"] for check in result["arithmetic_validation"])
+    assert result["tax_validation"]["matches_tax_calculation"]
+
+
+@pytest.mark.parametrize("items", ITEM_COUNTS)
+def test_invoice_helper(benchmark, within_budget, items):
+    document = invoice_document(items)
+    response = benchmark(invoice_helper, document)
+    assert len(response["items"]) == items
+
+
+@pytest.mark.parametrize("items", ITEM_COUNTS)
+def test_export_to_excel(benchmark, within_budget, items):
+    # Attribute objects, as the export endpoint hands them over
+    invoices = []
+    for _ in range(10):
+        invoice = invoice_helper(invoice_document(items))
+        invoices.append(SimpleNamespace(**{**invoice, "items": [SimpleNamespace(**item) for item in invoice["items"]]}))
+    workbook = benchmark.pedantic(ExportService.export_to_excel, args=(invoices,), rounds=3, warmup_rounds=1)
+    assert workbook[:2] == b"PK"
+
+
+def template_invoice_pdf(path, invoice, rows_per_page=30):
+    """One supplier's column layout, with the table header repeated on every page and totals at the end."""
+    fields = invoice["general_fields"]
+    money = "{:,.2f}".format
+    doc = fitz.open()
+    for start in range(0, len(invoice["items"]), rows_per_page):
+        page = doc.new_page()
+        page.insert_text((50, 50), "INVOICE", fontsize=18)
+        page.insert_text((320, 80), f"Invoice No: {fields['invoice_number']}", fontsize=10)
+        page.insert_text((320, 100), "Date:", fontsize=10)
+        page.insert_text((420, 100), fields["date"], fontsize=10)
+        page.insert_text((50, 120), fields["supplier_name"], fontsize=12)
+        for x, header in [(50, "Description"), (300, "Qty"), (360, "Unit Price"), (460, "Amount")]:
+            page.insert_text((x, 160), header, fontsize=10)
+        for row, item in enumerate(invoice["items"][start:start + rows_per_page]):
+            y = 185 + row * 20
+            page.insert_text((50, y), item["product_name"], fontsize=10)
+            page.insert_text((300, y), str(item["quantity"]), fontsize=10)
+            page.insert_text((360, y), money(item["unit_price"]), fontsize=10)
+            page.insert_text((460, y), money(item["total_price"]), fontsize=10)
+    page.insert_text((360, 800), "VAT (%20)", fontsize=10)
+    page.insert_text((460, 800), money(fields["tax_amount"]), fontsize=10)
+    page.insert_text((360, 820), "Total", fontsize=10)
+    page.insert_text((460, 820), money(fields["total_amount"]), fontsize=10)
+    doc.save(str(path))
+    doc.close()
+    return str(path), len(invoice["items"]) // rows_per_page + 1
+
+
+@pytest.mark.parametrize("items", ITEM_COUNTS)
+def test_supplier_template(benchmark, within_budget, tmp_path, items):
+    # Learned from three earlier invoices of the supplier (other numbers, dates and item counts)
+    samples = []
+    for seed, count in enumerate([4, 9, 17], start=1):
+        invoice = synthetic_invoice(count, seed)
+        path, max_pages = template_invoice_pdf(tmp_path / f"sample{seed}.pdf", invoice)
+        samples.append(supplier_templates.learn_sample(extract_page_layouts(path, max_pages), invoice))
+    template = supplier_templates.consensus(samples)
+    assert template.pop("complete")
+
+    invoice = synthetic_invoice(items, seed=4)
+    path, max_pages = template_invoice_pdf(tmp_path / "invoice.pdf", invoice)
+
+    def extract():
+        return supplier_templates.apply_template(extract_page_layouts(path, max_pages), template)
+
+    result = benchmark(extract)
+    assert supplier_templates.is_verified(result)
+    assert result["general_fields"]["invoice_number"] == invoice["general_fields"]["invoice_number"]
+    assert result["general_fields"]["date"] == invoice["general_fields"]["date"]
+    assert [item["total_price"] for item in result["items"]] == [item["total_price"] for item in invoice["items"]]
+
+
+# ===== Exchange rates =====
+
+@pytest.mark.parametrize("rows", ITEM_COUNTS)
+def test_rate_history_lookup(benchmark, within_budget, rows):
+    # Five years of weekday rates for three currencies, queried at random invoice dates
+    history, rng, start = RateHistory(), random.Random(0), date(2020, 1, 1)
+    for currency in ("USD", "EUR", "GBP"):
+        series = history._series[currency] = RateSeries()
+        for offset in range(5 * 365):
+            day = start + timedelta(days=offset)
+            if day.weekday() < 5:
+                series.days.append(day.toordinal())
+                series.rates.append(round(rng.uniform(5, 40), 4))
+    queries = [
+        (rng.choice(("USD", "EUR", "GBP")), start + timedelta(days=rng.randrange(5 * 365))) for _ in range(rows)
+    ]
+    found = benchmark(history.lookup_many, queries)
+    assert found == [history.lookup(currency, day) for currency, day in queries]
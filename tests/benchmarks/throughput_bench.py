@@ -0,0 +1,315 @@
+"""
+End-to-end throughput benchmark.
+
+Pushes N copies of the samples/ PDFs through the running API with /upload
+and/or /batch/upload (always with bypass_cache, so every copy is extracted),
+waits until every invoice is completed or failed, and reports per mode:
+
+- invoices_per_minute over the whole run
+- p50/p95/p99 latency per stage: upload (HTTP request), queue (neither
+  uploading nor processing), extraction / validation / conversion / review
+  / enrichment (the invoice's stage_timings_ms; conversion and review run
+  concurrently inside enrichment), processing and end_to_end
+- CPU seconds and peak RSS of the worker processes (command line matching
+  --process-match, read from /proc; Linux only)
+- MongoDB operations per invoice from serverStatus opcounters, minus the
+  benchmark's own polling queries
+
+Works with DISABLE_CELERY=true (the API process does the work) and with
+Celery workers. Run the API against a mock LLM with rate limits disabled:
+
+    python -m tests.mock_llm_server --port 1234 &
+    LLM_PROVIDER=local LOCAL_LLM_URL=http://localhost:1234/v1 DISABLE_RATE_LIMIT=true \\
+        uvicorn app.api.main:app --port 8000 &
+    python -m tests.benchmarks.throughput_bench --copies 5 --mode both --output run.json
+
+End-to-end latency uses the invoice's updated_at, so run the benchmark on
+the API host (or with synchronized clocks).
+"""
+import argparse
+import asyncio
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+from pymongo import MongoClient
+
+from tests.benchmarks.common import sample_pdfs, percentile, write_report
+
+STAGES = [
+    "upload", "queue", "extraction", "validation", "conversion", "review", "enrichment", "processing", "end_to_end"
+]
+DATA_OPS = ["insert", "query", "update", "delete", "getmore"]
+FINAL_STATUSES = ["completed", "failed"]
+
+
+# ===== Worker processes (/proc) =====
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def matching_pids(pattern):
+    if not os.path.isdir("/proc"):
+        return []
+    regex, pids = re.compile(pattern), []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode("utf-8", "replace")
+        except OSError:
+            continue
+        if regex.search(cmdline):
+            pids.append(int(entry))
+    return pids
+
+
+def cpu_seconds(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class ProcessSampler:
+    """CPU time used and peak combined RSS of the matching processes during a run."""
+
+    def __init__(self, pattern, interval=0.5):
+        self.pattern = pattern
+        self.interval = interval
+        self.pids = []
+        self.cpu_start = {}
+        self.peak_rss = 0
+        self._task = None
+
+    async def _sample(self):
+        while True:
+            self.peak_rss = max(self.peak_rss, sum(rss_bytes(pid) for pid in matching_pids(self.pattern)))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.pids = matching_pids(self.pattern)
+        self.cpu_start = {pid: cpu_seconds(pid) for pid in self.pids}
+        self._task = asyncio.ensure_future(self._sample())
+
+    def stop(self, wall_s, invoices):
+        self._task.cancel()
+        used = [
+            cpu_seconds(pid) - start for pid, start in self.cpu_start.items()
+            if start is not None and cpu_seconds(pid) is not None
+        ]
+        if not self.pids:
+            return {"processes": 0, "note": f"no process matched {self.pattern!r}"}
+        cpu = sum(used)
+        return {
+            "processes": len(self.pids),
+            "cpu_seconds": round(cpu, 2),
+            "cpu_seconds_per_invoice": round(cpu / invoices, 3) if invoices else None,
+            "avg_cores_busy": round(cpu / wall_s, 2) if wall_s else None,
+            "peak_rss_mb": round(self.peak_rss / 1024 / 1024, 1),
+        }
+
+
+# ===== MongoDB =====
+
+class MongoProbe:
+    def __init__(self, url, database):
+        self.client = MongoClient(url, serverSelectionTimeoutMS=5000)
+        self.invoices = self.client[database].invoices
+        self.own_queries = 0
+
+    def opcounters(self):
+        return dict(self.client.admin.command("serverStatus")["opcounters"])
+
+    def final_invoices(self, invoice_ids):
+        self.own_queries += 1
+        return list(self.invoices.find(
+            {"_id": {"$in": invoice_ids}, "status": {"$in": FINAL_STATUSES}},
+            {"status": 1, "updated_at": 1, "processing_time_ms": 1, "stage_timings_ms": 1},
+            batch_size=max(len(invoice_ids), 1),
+        ))
+
+    def ops_report(self, before, after, invoices):
+        delta = {op: after.get(op, 0) - before.get(op, 0) for op in DATA_OPS + ["command"]}
+        delta["query"] -= self.own_queries
+        data_ops = sum(delta[op] for op in DATA_OPS)
+        return {
+            "by_type": delta,
+            "data_ops_total": data_ops,
+            "data_ops_per_invoice": round(data_ops / invoices, 2) if invoices else None,
+        }
+
+
+# ===== API =====
+
+async def login(client, args):
+    if args.token:
+        return {"Authorization": f"Bearer {args.token}"}
+    suffix = uuid.uuid4().hex[:8]
+    credentials = {"email": f"bench_{suffix}@example.com", "password": "BenchPassword123!"}
+    r = await client.post("/auth/register", json={**credentials, "username": f"bench_{suffix}"})
+    r.raise_for_status()
+    r = await client.post("/auth/login", json=credentials)
+    r.raise_for_status()
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def file_part(path):
+    with open(path, "rb") as f:
+        return ("file", (os.path.basename(path), f.read(), "application/pdf"))
+
+
+async def run_uploads(client, headers, files, concurrency):
+    """One /upload per file; returns {invoice_id: (upload started, upload seconds)}."""
+    semaphore, uploads = asyncio.Semaphore(concurrency), {}
+
+    async def upload(path):
+        async with semaphore:
+            started, t0 = datetime.utcnow(), time.perf_counter()
+            r = await client.post("/upload", params={"bypass_cache": "true"}, files=[file_part(path)], headers=headers)
+            r.raise_for_status()
+            uploads[r.json()["invoice_id"]] = (started, time.perf_counter() - t0)
+
+    await asyncio.gather(*(upload(path) for path in files))
+    return uploads
+
+
+async def run_batches(client, headers, files, concurrency, batch_size):
+    """/batch/upload in chunks of batch_size; every invoice shares its batch's upload time."""
+    semaphore, uploads = asyncio.Semaphore(concurrency), {}
+
+    async def upload(chunk):
+        async with semaphore:
+            started, t0 = datetime.utcnow(), time.perf_counter()
+            parts = [("files", part[1]) for part in map(file_part, chunk)]
+            r = await client.post("/batch/upload", params={"bypass_cache": "true"}, files=parts, headers=headers)
+            r.raise_for_status()
+            # In DISABLE_CELERY mode the request returns only after processing; count it as processing time
+            elapsed = time.perf_counter() - t0 if r.json()["status"] != "completed" else 0.0
+            for invoice_id in r.json()["invoice_ids"]:
+                uploads[invoice_id] = (started, elapsed)
+
+    chunks = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+    await asyncio.gather(*(upload(chunk) for chunk in chunks))
+    return uploads
+
+
+async def wait_for_invoices(mongo, invoice_ids, timeout, poll_interval):
+    pending, done = set(invoice_ids), {}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for doc in await asyncio.to_thread(mongo.final_invoices, list(pending)):
+            done[doc["_id"]] = doc
+            pending.discard(doc["_id"])
+        if pending:
+            await asyncio.sleep(poll_interval)
+    return done, pending
+
+
+def latency_report(uploads, docs):
+    samples = {stage: [] for stage in STAGES}
+    for invoice_id, doc in docs.items():
+        if doc["status"] != "completed":
+            continue
+        started, upload_s = uploads[invoice_id]
+        end_to_end = (doc["updated_at"] - started).total_seconds()
+        processing = (doc.get("processing_time_ms") or 0) / 1000
+        samples["upload"].append(upload_s)
+        samples["end_to_end"].append(end_to_end)
+        samples["processing"].append(processing)
+        samples["queue"].append(max(end_to_end - upload_s - processing, 0.0))
+        for stage, ms in (doc.get("stage_timings_ms") or {}).items():
+            if stage in samples:
+                samples[stage].append(ms / 1000)
+    return {
+        stage: {f"p{p}": round(percentile(values, p), 3) for p in (50, 95, 99)}
+        for stage, values in samples.items() if values
+    }
+
+
+async def run_mode(mode, args, files, mongo):
+    async with httpx.AsyncClient(base_url=args.api_url, timeout=args.timeout) as client:
+        headers = await login(client, args)
+        sampler = ProcessSampler(args.process_match)
+        ops_before = mongo.opcounters()
+        mongo.own_queries = 0
+        sampler.start()
+
+        started = time.perf_counter()
+        if mode == "upload":
+            uploads = await run_uploads(client, headers, files, args.concurrency)
+        else:
+            uploads = await run_batches(client, headers, files, args.concurrency, args.batch_size)
+        docs, pending = await wait_for_invoices(mongo, list(uploads), args.timeout, args.poll_interval)
+        wall_s = time.perf_counter() - started
+
+        ops_after = mongo.opcounters()
+        workers = sampler.stop(wall_s, len(docs))
+
+    completed = sum(1 for doc in docs.values() if doc["status"] == "completed")
+    return {
+        "invoices": len(uploads),
+        "completed": completed,
+        "failed": len(docs) - completed,
+        "timed_out": len(pending),
+        "wall_s": round(wall_s, 2),
+        "invoices_per_minute": round(completed / wall_s * 60, 2) if wall_s else None,
+        "latency_s": latency_report(uploads, docs),
+        "workers": workers,
+        "mongo_ops": mongo.ops_report(ops_before, ops_after, len(docs)),
+    }
+
+
+async def run(args):
+    files = sample_pdfs() * args.copies
+    mongo = MongoProbe(args.mongo_url, args.database)
+    modes = ["upload", "batch"] if args.mode == "both" else [args.mode]
+    return {mode: await run_mode(mode, args, files, mongo) for mode in modes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-url", default=os.getenv("BASE_URL", "http://localhost:8000"))
+    parser.add_argument("--token", default=os.getenv("BENCH_TOKEN"), help="bearer token (default: register a user)")
+    parser.add_argument("--mongo-url", default=os.getenv("TEST_MONGODB_URL", os.getenv("MONGODB_URL", "mongodb://localhost:27017")))
+    parser.add_argument("--database", default=os.getenv("TEST_DATABASE_NAME", os.getenv("DATABASE_NAME", "invoice_db")))
+    parser.add_argument("--mode", choices=["upload", "batch", "both"], default="both")
+    parser.add_argument("--copies", type=int, default=3, help="copies of each sample PDF")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent upload requests")
+    parser.add_argument("--batch-size", type=int, default=10, help="files per /batch/upload (max 50)")
+    parser.add_argument("--process-match", default=r"celery|uvicorn|app\.api\.main", help="regex for worker command lines")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for a run to finish")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    write_report({
+        "api_url": args.api_url,
+        "samples": len(sample_pdfs()),
+        "copies": args.copies,
+        "concurrency": args.concurrency,
+        "batch_size": args.batch_size,
+        "modes": report,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
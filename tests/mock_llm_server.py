@@ -0,0 +1,234 @@
+"""
+OpenAI-compatible mock LLM server for CPU-only performance testing.
+
+Answers /v1/chat/completions with a synthetic invoice (or review) that fits
+the requested response_format, with configurable latency, generation speed
+and fault injection. Point the local provider at it:
+
+    python -m tests.mock_llm_server --port 1234 --latency lognormal:0.8,0.4 --tokens-per-second 60
+    LLM_PROVIDER=local LOCAL_LLM_URL=http://localhost:1234/v1
+
+Latency (time to first token) distributions:
+    fixed:S  uniform:MIN,MAX  lognormal:MEDIAN,SIGMA  exponential:MEAN
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CHARS_PER_TOKEN = 4
+TOKENS_PER_IMAGE = 765
+PRODUCTS = ["Steel bolt M8", "Copper cable 2.5mm", "LED panel 60x60", "Cement 50kg", "Paint 15L", "Wall plug 8mm"]
+
+
+def parse_latency(spec):
+    """Sampler for a "kind:params" latency spec, in seconds."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def message_text(messages):
+    """All text parts of the request, and the number of images."""
+    texts, images = [], 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                images += 1
+    return "\n".join(texts), images
+
+
+def synthetic_invoice(rng, item_count, rows):
+    items, net = [], 0.0
+    for i in range(item_count):
+        quantity, unit_price = rng.randint(1, 20), round(rng.uniform(2, 500), 2)
+        total = round(quantity * unit_price, 2)
+        net += total
+        items.append({
+            "product_name": f"{rng.choice(PRODUCTS)} #{i + 1}",
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "total_price": total,
+            "description": None,
+        })
+    tax = round(net * 0.2, 2)
+    invoice = {
+        "general_fields": {
+            "invoice_number": f"MOCK-{rng.randint(10000, 99999)}",
+            "date": f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.2024",
+            "supplier_name": "Mock Supplies Ltd.",
+            "total_amount": round(net + tax, 2),
+            "currency": "TRY",
+            "tax_amount": tax,
+            "tax_rate": 20,
+            "category": "Hardware",
+        },
+    }
+    if rows:
+        invoice["item_rows"] = [
+            [item["product_name"], item["quantity"], item["unit_price"], item["total_price"], item["description"]]
+            for item in items
+        ]
+    else:
+        invoice["items"] = items
+    return invoice
+
+
+def synthetic_review(rng):
+    return {
+        "summary": "Hardware purchase from Mock Supplies Ltd.",
+        "risk_level": rng.choice(["Low", "Low", "Medium"]),
+        "risk_reason": "Totals and tax are consistent",
+        "suggested_action": "Approve",
+    }
+
+
+def synthetic_review_batch(rng, text):
+    """One review per invoice_id listed in a batched review prompt."""
+    invoice_ids = re.findall(r'"invoice_id": "([^".]+)"', text)
+    return {"reviews": [{"invoice_id": invoice_id, **synthetic_review(rng)} for invoice_id in invoice_ids]}
+
+
+def malform(rng, text):
+    """Either unrecoverable (truncated) or wrapped in prose the app has to strip."""
+    if rng.random() < 0.5:
+        return text[:max(1, len(text) // 2)]
+    return f"Sure, here is the extracted data:\n```json\n{text}\n```"
+
+
+def create_app(args):
+    app = FastAPI(title="Mock LLM server")
+    rng = random.Random(args.seed)
+    sample_latency = parse_latency(args.latency)
+    slots = asyncio.Semaphore(args.parallel) if args.parallel else contextlib.nullcontext()
+    stats = {"requests": 0, "rate_limited": 0, "malformed": 0}
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": args.model, "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if rng.random() < args.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit exceeded (429)", "type": "rate_limit_error"}},
+                status_code=429, headers={"Retry-After": "1"}
+            )
+
+        text, images = message_text(body.get("messages", []))
+        schema_name = ((body.get("response_format") or {}).get("json_schema") or {}).get("name", "")
+        # Same request, same answer; latency and faults stay random
+        request_rng = random.Random(hashlib.sha256(text.encode("utf-8")).hexdigest())
+        if schema_name == "invoice_review_batch" or (not schema_name and '"reviews"' in text):
+            result = synthetic_review_batch(request_rng, text)
+        elif schema_name == "invoice_review" or (not schema_name and "financial auditor" in text):
+            result = synthetic_review(request_rng)
+        else:
+            rows = schema_name == "invoice_rows" or (not schema_name and "item_rows" in text)
+            result = synthetic_invoice(request_rng, args.items, rows)
+
+        content = json.dumps(result, ensure_ascii=False)
+        if rng.random() < args.malformed_rate:
+            stats["malformed"] += 1
+            content = malform(rng, content)
+
+        usage = {
+            "prompt_tokens": len(text) // CHARS_PER_TOKEN + images * TOKENS_PER_IMAGE,
+            "completion_tokens": max(1, len(content) // CHARS_PER_TOKEN),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        first_token_delay = sample_latency(rng)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            return StreamingResponse(
+                stream_chunks(completion_id, content, usage, first_token_delay, include_usage),
+                media_type="text/event-stream"
+            )
+
+        async with slots:
+            await asyncio.sleep(first_token_delay + generation_time(usage["completion_tokens"]))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": args.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    def generation_time(tokens):
+        return tokens / args.tokens_per_second if args.tokens_per_second else 0.0
+
+    async def stream_chunks(completion_id, content, usage, first_token_delay, include_usage):
+        def event(payload):
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": args.model}
+        async with slots:
+            await asyncio.sleep(first_token_delay)
+            # Send a few tokens per event so slow token rates stay cheap to simulate
+            step = CHARS_PER_TOKEN * 4
+            for start in range(0, len(content), step):
+                delta = content[start:start + step]
+                yield event({**base, "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]})
+                await asyncio.sleep(generation_time(len(delta) / CHARS_PER_TOKEN))
+            yield event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if include_usage:
+                yield event({**base, "choices": [], "usage": usage})
+            yield "data: [DONE]\n\n"
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--model", default="mock/invoice-model")
+    parser.add_argument("--latency", default="fixed:0.2", help="time to first token distribution")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="generation speed (0 = instant)")
+    parser.add_argument("--parallel", type=int, default=0, help="concurrent requests served (0 = unlimited)")
+    parser.add_argument("--items", type=int, default=8, help="line items per synthetic invoice")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of responses with broken JSON")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()